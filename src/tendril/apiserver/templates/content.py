@@ -1,20 +1,27 @@
 
 
 import os
+from types import SimpleNamespace
 from typing import Dict
+from typing import List
 from typing import Union
+from typing import Literal
 from typing import Optional
 from pydantic.fields import Field
+from sqlalchemy import select
 from inflection import singularize
 from inflection import titleize
 
 from fastapi import APIRouter
 from fastapi import Request
+from fastapi import Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi import Depends
 from fastapi import File
+from fastapi import Form
 from fastapi import Body
+from fastapi import Header
 from fastapi import UploadFile
-from fastapi import BackgroundTasks
 
 from tendril.authn.users import auth_spec
 from tendril.authn.users import AuthUserModel
@@ -29,14 +36,29 @@ from tendril.caching import tokens
 from tendril.caching.tokens import GenericTokenTModel
 
 from tendril.structures.content import content_models
+from tendril.db.controllers.content import get_content_trees
+from tendril.db.controllers.content import get_contents
+from tendril.db.controllers.content import burn_fidx
+from tendril.common.interests.exceptions import InterestActionException
+from tendril.common.interests.exceptions import InterestNotFound
 from tendril.config import MEDIA_EXTENSIONS
 from tendril.interests.mixins.content import MediaContentInterest
+from tendril.common.content.publishing import publisher
+from tendril.common.content.processing import processing
+from tendril.common.content.derivations import derivations
+from tendril.common.content.resumable import resumable
+from tendril.common.content.exceptions import ContentNotReady
 from tendril.common.content.exceptions import ContentTypeMismatchError
+from tendril.common.content.exceptions import BatchUploadMismatch
 from tendril.common.content.exceptions import FileTypeUnsupported
+from tendril.common.content.exceptions import ProcessingQueueFull
 from tendril.db.models.content_formats import MediaContentFormatInfoTModel
 from tendril.db.models.content_formats import MediaContentFormatInfoFullTModel
+from tendril.db.models.content_formats import ThumbnailListingTModel
 from tendril.db.models.content import MediaContentInfoTModel
 from tendril.db.models.content import MediaContentInfoFullTModel
+from tendril.structures.content.timeline import SequenceTimelineTModel
+from tendril.structures.content.timeline import TimelinePositionTModel
 
 
 class ContentTypeDetailTModel(TendrilTORMModel):
@@ -54,7 +76,54 @@ class SequenceAddTModel(TendrilTBaseModel):
     duration: Optional[int]
 
 
+class SequenceBatchOperationTModel(TendrilTBaseModel):
+    op: Literal['add', 'move', 'remove', 'duration']
+    content_id: Optional[int]
+    position: Optional[int]
+    to_position: Optional[int]
+    duration: Optional[int]
+
+
+class ProcessingLaneStatsTModel(TendrilTBaseModel):
+    weight: float
+    pending: int
+    running: int
+    tenants: int
+    oldest_wait: Optional[float]
+    mean_wait: Optional[float]
+
+
+class DerivationCacheStatsTModel(TendrilTBaseModel):
+    hits: int
+    misses: int
+    hit_rate: Optional[float]
+    bytes_saved: int
+    size: int
+    max_size: int
+
+
+def _strip_weak(etag):
+    return etag[2:] if etag.startswith('W/') else etag
+
+
+def _etag_matches(request: Request, etag):
+    # Weak comparison, as is appropriate for If-None-Match.
+    header = request.headers.get('if-none-match')
+    if not header:
+        return False
+    candidates = [x.strip() for x in header.split(',')]
+    if '*' in candidates:
+        return True
+    return _strip_weak(etag) in [_strip_weak(x) for x in candidates]
+
+
 class InterestContentRouterGenerator(ApiRouterGenerator):
+    # Handlers which touch the database, or block in any other way, are
+    # plain functions so that FastAPI runs them in its threadpool instead
+    # of on the event loop. This also lets the interest methods they call
+    # bridge to the async filestore client with async_to_sync, which
+    # cannot be used from a thread running an event loop.
+
     def __init__(self, actual):
         super(InterestContentRouterGenerator, self).__init__()
         self._actual = actual
@@ -63,17 +132,90 @@ class InterestContentRouterGenerator(ApiRouterGenerator):
                              user: AuthUserModel = auth_spec()):
         return self._actual.accepted_types
 
-    async def content_info(self, request: Request,
-                           id: int, full: bool = False,
-                           user: AuthUserModel = auth_spec()):
+    def content_info(self, request: Request, response: Response,
+                     id: int, full: bool = False,
+                     user: AuthUserModel = auth_spec()):
         with get_session() as session:
             interest: MediaContentInterest = self._actual.item(id=id, session=session)
+            etag = interest.content_etag(full=full, auth_user=user, session=session)
+            if _etag_matches(request, etag):
+                return Response(status_code=304, headers={'ETag': etag})
+            response.headers['ETag'] = etag
             return interest.content_information(full=full, auth_user=user, session=session)
 
-    async def upload_media_format(self, request: Request,
-                                  id: int, background_tasks: BackgroundTasks,
-                                  file: UploadFile = File(...),
-                                  user: AuthUserModel = auth_spec()):
+    def content_info_bulk(self, request: Request,
+                          ids: List[int] = Body(...), full: bool = False,
+                          user: AuthUserModel = auth_spec()):
+        """
+        Returns the content information of many interests at once, keyed
+        by interest id. The interests and all their content are loaded up
+        front in a fixed number of queries. Authorization is applied to
+        each interest, and interests which do not exist or which the user
+        cannot read are left out of the response.
+        """
+        model = self._actual.interest_class.model
+        rv = {}
+        with get_session() as session:
+            models = session.scalars(select(model).where(model.id.in_(set(ids)))).all()
+            get_content_trees(ids=[x.content_id for x in models if x.content_id],
+                              session=session)
+            for interest_model in models:
+                interest: MediaContentInterest = self._actual.interest_class(interest_model)
+                try:
+                    rv[interest.id] = interest.content_information(
+                        full=full, auth_user=user, session=session)
+                except InterestActionException:
+                    continue
+        return rv
+
+    @staticmethod
+    def _check_upload(interest, filename):
+        # Make sure it's the correct content type before doing anything.
+        if not content_models[interest.content_type].allows_actual_media:
+            raise ContentTypeMismatchError(interest.content_type, 'media',
+                                           'add_artefact', interest.id, interest.name,)
+
+        # Ensure we accept the file extension
+        file_ext = os.path.splitext(filename)[1]
+        if file_ext not in MEDIA_EXTENSIONS:
+            raise FileTypeUnsupported(file_ext, MEDIA_EXTENSIONS,
+                                      'add_artefact', interest.id, interest.name,)
+        return file_ext
+
+    @classmethod
+    def _prepare_upload(cls, interest, filename, user, session, metadata=None, ttl=600):
+        file_ext = cls._check_upload(interest, filename)
+
+        # Get Auth clearance before queueing the processing job. This will
+        # raise an exception if there is a problem.
+        interest.add_format(probe_only=True, auth_user=user, session=session)
+
+        # Refuse early if the processing queue is full, before anything is
+        # burned or written.
+        processing.check_capacity(interest)
+
+        # Burn an fidx and lock in the filename for the uploaded file.
+        fidx = interest.fidx_burn(auth_user=user, session=session)
+        storage_filename = f"{interest.name}_f{fidx}{file_ext}"
+
+        # The above prechecks are required at the API level here since we are delegating
+        # to the processing queue, and we want to avoid forcing the client to deal with
+        # exceptions in that context.
+
+        # Generate Upload Ticket
+        upload_token = tokens.open(
+            namespace='mfu',
+            metadata={'interest_id': interest.id,
+                      'filename': storage_filename,
+                      **(metadata or {})},
+            user=user.id, current="Request Created",
+            progress_max=1, ttl=ttl,
+        )
+        return storage_filename, upload_token
+
+    def upload_media_format(self, request: Request, id: int,
+                            file: UploadFile = File(...),
+                            user: AuthUserModel = auth_spec()):
         """
         Warning : This can only be done when the interest is in the NEW state. This
                   enforces approval requirements on any change in the formats. An additional
@@ -81,59 +223,195 @@ class InterestContentRouterGenerator(ApiRouterGenerator):
         """
         with get_session() as session:
             interest: MediaContentInterest = self._actual.item(id=id, session=session)
+            storage_filename, upload_token = self._prepare_upload(
+                interest, file.filename, user, session)
 
-            # Make sure it's the correct content type before doing anything.
-            if not content_models[interest.content_type].allows_actual_media:
-                raise ContentTypeMismatchError(interest.content_type, 'media',
-                                               'add_artefact', interest.id, interest.name,)
-
-            # Ensure we accept the file extension
-            file_ext = os.path.splitext(file.filename)[1]
-            if file_ext not in MEDIA_EXTENSIONS:
-                raise FileTypeUnsupported(file_ext, MEDIA_EXTENSIONS,
-                                          'add_artefact', interest.id, interest.name,)
-
-            # Get Auth clearance before sending the task to the background. This will
-            # raise an exception if there is a problem.
-            interest.add_format(probe_only=True, auth_user=user, session=session)
-
-            # Burn an fidx and lock in the filename for the uploaded file.
-            fidx = interest.fidx_burn(auth_user=user, session=session)
-            storage_filename = f"{interest.name}_f{fidx}{file_ext}"
+            # The upload is staged into the processing spool and handed over to
+            # the media processing workers, which have their own sessions.
+            staged = processing.stage(file.file, file.filename)
+            processing.submit(upload_token.id, interest, staged,
+                              rename_to=storage_filename, user=user)
 
-            # The above prechecks are required at the API level here since we are delegating
-            # to a background task, and we want to avoid forcing the client to deal with
-            # exceptions in that context.
+        return upload_token
 
-            # TODO Consider providing a helper function in the interest iteself to do
-            #  this stuff instead. The interest otherwise remains bare and unprotected.
+    def upload_media_formats(self, request: Request,
+                             files: List[UploadFile] = File(...),
+                             ids: List[int] = Form(...),
+                             user: AuthUserModel = auth_spec()):
+        """
+        Upload many media files at once. ``ids`` is either a single interest
+        id, which all the files are uploaded to, or the interest id of each
+        file, in order.
+
+        The interests are loaded, checked and have their file indices burned
+        together, and the files are staged in parallel. A single batch token
+        is returned. Its progress is derived from the upload token of each
+        file, listed in its metadata, and it is closed once all of them have
+        been processed.
+        """
+        if len(ids) == 1:
+            ids = ids * len(files)
+        if len(ids) != len(files):
+            raise BatchUploadMismatch(len(files), len(ids))
 
-            # Generate Upload Ticket and return
-            upload_token = tokens.open(
+        model = self._actual.interest_class.model
+        with get_session() as session:
+            models = {x.id: x for x in
+                      session.scalars(select(model).where(model.id.in_(set(ids))))}
+            for id in ids:
+                if id not in models:
+                    raise InterestNotFound(self._actual.type_name, '<unspecified>', id=id)
+            interests = {id: self._actual.interest_class(x) for id, x in models.items()}
+            for interest in interests.values():
+                if not interest.model_instance.content_id:
+                    raise ContentNotReady('add_artefact', interest.id, interest.name)
+            get_contents(ids=[x.content_id for x in models.values()],
+                         profile='summary', session=session)
+
+            file_exts = [self._check_upload(interests[id], file.filename)
+                         for id, file in zip(ids, files)]
+            for interest in interests.values():
+                interest.add_format(probe_only=True, auth_user=user, session=session)
+            processing.check_capacity(interests[ids[0]], count=len(files))
+
+            counts = {}
+            for id in ids:
+                content_id = interests[id].model_instance.content_id
+                counts[content_id] = counts.get(content_id, 0) + 1
+            fidxs = burn_fidx(counts=counts, session=session)
+
+            uploads = []
+            for id, file_ext in zip(ids, file_exts):
+                interest = interests[id]
+                fidx = fidxs[interest.model_instance.content_id].pop(0)
+                storage_filename = f"{interest.name}_f{fidx}{file_ext}"
+                upload_token = tokens.open(
+                    namespace='mfu',
+                    metadata={'interest_id': interest.id,
+                              'filename': storage_filename},
+                    user=user.id, current="Request Created",
+                    progress_max=1, ttl=600,
+                )
+                uploads.append({'token_id': str(upload_token.id),
+                                'interest_id': interest.id,
+                                'filename': storage_filename})
+            batch_token = tokens.open(
                 namespace='mfu',
-                metadata={'interest_id': interest.id,
-                          'filename': storage_filename},
+                metadata={'batch': True, 'uploads': uploads},
                 user=user.id, current="Request Created",
-                progress_max=1, ttl=600,
+                progress_max=len(uploads), ttl=600,
             )
 
-            background_tasks.add_task(interest.add_format, file=file,
-                                      rename_to=storage_filename,
-                                      token_id=upload_token.id,
-                                      auth_user=user, session=session)
-
+            staged = processing.stage_all([(x.file, x.filename) for x in files])
+            rejected = False
+            for upload, staged_upload in zip(uploads, staged):
+                try:
+                    processing.submit(upload['token_id'], interests[upload['interest_id']],
+                                      staged_upload, rename_to=upload['filename'],
+                                      user=user, batch_id=batch_token.id)
+                except ProcessingQueueFull:
+                    rejected = True
+            if rejected:
+                # Uploads refused by the queue never reach the dispatcher.
+                processing.update_batch(batch_token.id)
+
+        return batch_token
+
+    def create_resumable_upload(self, request: Request, id: int,
+                                filename: str, length: int,
+                                user: AuthUserModel = auth_spec()):
+        """
+        Open a resumable upload of a media file of the given length. The
+        returned token identifies the upload. Chunks are then sent with
+        PATCH, and the current offset can be read with HEAD. Processing
+        starts as soon as the last chunk is received.
+        """
+        with get_session() as session:
+            interest: MediaContentInterest = self._actual.item(id=id, session=session)
+            storage_filename, upload_token = self._prepare_upload(
+                interest, filename, user, session,
+                metadata={'resumable': True, 'length': length},
+                ttl=resumable.expiry)
+            resumable.create(upload_token.id, interest, filename,
+                             rename_to=storage_filename, length=length, user=user)
         return upload_token
 
-    async def format_info(self, request: Request, id: int, format_id: int,
-                          full: bool = True,
-                          user: AuthUserModel = auth_spec()):
+    def resumable_upload_offset(self, request: Request, id: int, token_id: str,
+                                user: AuthUserModel = auth_spec()):
+        with get_session() as session:
+            interest: MediaContentInterest = self._actual.item(id=id, session=session)
+            interest.add_format(probe_only=True, auth_user=user, session=session)
+            upload = resumable.get(token_id, interest, user)
+            return Response(status_code=200, headers={
+                'Upload-Offset': str(resumable.offset(upload)),
+                'Upload-Length': str(upload['length']),
+                'Cache-Control': 'no-store',
+            })
+
+    def _open_resumable_upload(self, id, token_id, user):
+        with get_session() as session:
+            interest: MediaContentInterest = self._actual.item(id=id, session=session)
+            interest.add_format(probe_only=True, auth_user=user, session=session)
+            return resumable.get(token_id, interest, user), (interest.id, interest.name)
+
+    def _complete_resumable_upload(self, id, upload, user):
+        with get_session() as session:
+            interest: MediaContentInterest = self._actual.item(id=id, session=session)
+            # If the queue is full, the complete upload is kept, and the client
+            # can retry by sending an empty chunk at the final offset.
+            processing.check_capacity(interest)
+            staged = resumable.complete(upload, processing.staging_folder)
+            processing.submit(upload['token_id'], interest, staged,
+                              rename_to=upload['rename_to'], user=user)
+
+    async def upload_resumable_chunk(self, request: Request, id: int, token_id: str,
+                                     upload_offset: int = Header(...),
+                                     user: AuthUserModel = auth_spec()):
+        # The request body is streamed straight to the partial file, so this
+        # handler is async. Everything which blocks goes to the threadpool.
+        upload, (interest_id, interest_name) = await run_in_threadpool(
+            self._open_resumable_upload, id, token_id, user)
+        interest = SimpleNamespace(id=interest_id, name=interest_name)
+        with resumable.lock(upload, interest):
+            resumable.check_offset(upload, upload_offset, interest)
+            async for data in request.stream():
+                if data:
+                    await run_in_threadpool(resumable.append, upload, data, interest)
+            offset = resumable.offset(upload)
+            if resumable.is_complete(upload):
+                await run_in_threadpool(self._complete_resumable_upload, id, upload, user)
+            else:
+                # The token lives as long as the upload does, which is
+                # extended by every chunk.
+                await run_in_threadpool(tokens.update, 'mfu', upload['token_id'],
+                                        current=f"Received {offset} of {upload['length']} bytes",
+                                        ttl=resumable.expiry)
+        return Response(status_code=204, headers={'Upload-Offset': str(offset)})
+
+    def processing_stats(self, request: Request,
+                         user: AuthUserModel = auth_spec()):
+        return processing.stats()
+
+    def derivation_cache_stats(self, request: Request,
+                               user: AuthUserModel = auth_spec()):
+        return derivations.stats()
+
+    def format_info(self, request: Request, id: int, format_id: int,
+                    full: bool = True,
+                    user: AuthUserModel = auth_spec()):
         with get_session() as session:
             interest: MediaContentInterest = self._actual.item(id=id, session=session)
             return interest.format_information(format_id, full=full, auth_user=user, session=session)
 
-    async def delete_media_format(self, request: Request,
-                                  id: int, filename: str,
-                                  user: AuthUserModel = auth_spec()):
+    def format_thumbnail(self, request: Request, id: int, format_id: int, size: str,
+                         user: AuthUserModel = auth_spec()):
+        with get_session() as session:
+            interest: MediaContentInterest = self._actual.item(id=id, session=session)
+            return interest.format_thumbnail(format_id, size, auth_user=user, session=session)
+
+    def delete_media_format(self, request: Request,
+                            id: int, filename: str,
+                            user: AuthUserModel = auth_spec()):
         """
         Warning : This can only be done when the interest is in the NEW state. This
                   enforces approval requirements on any change in the formats. An additional
@@ -141,28 +419,39 @@ class InterestContentRouterGenerator(ApiRouterGenerator):
         """
         pass
 
-    async def generate_provider_content(self, request:Request, id:int,
-                                        provider_id:int, args: dict=Body(...),
-                                        user: AuthUserModel = auth_spec()):
+    def generate_provider_content(self, request:Request, id:int,
+                                  provider_id:int, args: dict=Body(...),
+                                  user: AuthUserModel = auth_spec()):
         with get_session() as session:
             interest: MediaContentInterest = self._actual.item(id=id, session=session)
             return interest.generate_from_provider(provider_id, args=args, auth_user=user, session=session)
 
-    async def set_sequence_default_duration(self, request:Request, id:int,
-                                            duration:int = 10000,
-                                            user: AuthUserModel = auth_spec()):
+    def set_sequence_default_duration(self, request:Request, id:int,
+                                      duration:int = 10000,
+                                      user: AuthUserModel = auth_spec()):
         with get_session() as session:
             interest: MediaContentInterest = self._actual.item(id=id, session=session)
             return interest.sequence_set_default_duration(default_duration=duration, auth_user=user, session=session)
 
-    async def get_sequence_contents(self, request: Request, id: int,
-                                    full=False, user: AuthUserModel = auth_spec()):
+    def get_sequence_contents(self, request: Request, response: Response, id: int,
+                              full=False, user: AuthUserModel = auth_spec()):
         with get_session() as session:
             interest: MediaContentInterest = self._actual.item(id=id, session=session)
+            etag = interest.sequence_contents_etag(full=full, auth_user=user, session=session)
+            if _etag_matches(request, etag):
+                return Response(status_code=304, headers={'ETag': etag})
+            response.headers['ETag'] = etag
             return interest.sequence_get_contents(full=full, auth_user=user, session=session)
 
-    async def add_to_sequence(self, request:Request, id:int, item: SequenceAddTModel,
-                              full=True, user: AuthUserModel = auth_spec()):
+    def get_sequence_timeline(self, request: Request, id: int,
+                              at: Optional[int] = None, loop: bool = True,
+                              user: AuthUserModel = auth_spec()):
+        with get_session() as session:
+            interest: MediaContentInterest = self._actual.item(id=id, session=session)
+            return interest.sequence_timeline(at=at, loop=loop, auth_user=user, session=session)
+
+    def add_to_sequence(self, request:Request, id:int, item: SequenceAddTModel,
+                        full=True, user: AuthUserModel = auth_spec()):
         with get_session() as session:
             interest: MediaContentInterest = self._actual.item(id=id, session=session)
             result = interest.sequence_add(**item.dict(), auth_user=user, session=session)
@@ -174,8 +463,8 @@ class InterestContentRouterGenerator(ApiRouterGenerator):
             interest: MediaContentInterest = self._actual.item(id=id, session=session)
             return interest.sequence_get_contents(full=full, auth_user=user, session=session)
 
-    async def remove_from_sequence(self, request:Request, id:int, position:int,
-                                   full=True, user: AuthUserModel = auth_spec()):
+    def remove_from_sequence(self, request:Request, id:int, position:int,
+                             full=True, user: AuthUserModel = auth_spec()):
         with get_session() as session:
             interest: MediaContentInterest = self._actual.item(id=id, session=session)
             result = interest.sequence_remove(position=position, auth_user=user, session=session)
@@ -187,22 +476,44 @@ class InterestContentRouterGenerator(ApiRouterGenerator):
             interest: MediaContentInterest = self._actual.item(id=id, session=session)
             return interest.sequence_get_contents(full=full, auth_user=user, session=session)
 
-    async def change_item_duration(self, request:Request, id:int,
-                                   position:int, duration:int,
-                                   user: AuthUserModel = auth_spec()):
-        pass
+    def change_item_duration(self, request:Request, id:int,
+                             position:int, duration:Optional[int] = None,
+                             full=True, user: AuthUserModel = auth_spec()):
+        with get_session() as session:
+            interest: MediaContentInterest = self._actual.item(id=id, session=session)
+            interest.sequence_set_item_duration(position=position, duration=duration,
+                                                auth_user=user, session=session)
+            return interest.sequence_get_contents(full=full, auth_user=user, session=session)
+
+    def batch_edit_sequence(self, request:Request, id:int,
+                            operations: List[SequenceBatchOperationTModel],
+                            full=True, user: AuthUserModel = auth_spec()):
+        # All operations are applied in a single session, so any failure
+        # rolls back the entire batch.
+        with get_session() as session:
+            interest: MediaContentInterest = self._actual.item(id=id, session=session)
+            interest.sequence_batch([x.dict() for x in operations],
+                                    auth_user=user, session=session)
+            return interest.sequence_get_contents(full=full, auth_user=user, session=session)
 
     def generate(self, name):
         desc = f'Content API for {titleize(singularize(name))} Interests'
         prefix = self._actual.interest_class.model.role_spec.prefix
         router = APIRouter(prefix=f'/{name}', tags=[desc],
-                           dependencies=[Depends(authn_dependency)])
+                           dependencies=[Depends(authn_dependency)],
+                           on_startup=[publisher.resume, processing.autostart],
+                           on_shutdown=[processing.stop])
 
         router.add_api_route("/allowed_types", self.accepted_types, methods=["GET"],
                              response_model=Dict[str, ContentTypeDetailTModel],
                              response_model_exclude_none=True,
                              dependencies=[auth_spec(scopes=[f'{prefix}:read'])], )
 
+        router.add_api_route("/content_info", self.content_info_bulk, methods=["POST"],
+                             response_model=Dict[int, Union[MediaContentInfoFullTModel, MediaContentInfoTModel]],
+                             response_model_exclude_none=True,
+                             dependencies=[auth_spec(scopes=[f'{prefix}:read'])])
+
         router.add_api_route("/{id}/content_info", self.content_info, methods=["GET"],
                              response_model=Union[MediaContentInfoFullTModel, MediaContentInfoTModel],
                              response_model_exclude_none=True,
@@ -214,10 +525,38 @@ class InterestContentRouterGenerator(ApiRouterGenerator):
                                  response_model_exclude_none=True,
                                  dependencies=[auth_spec(scopes=[f'{prefix}:write'])])
 
+            router.add_api_route("/{id}/formats/thumbnail/{format_id}/{size}", self.format_thumbnail, methods=["GET"],
+                                 response_model=ThumbnailListingTModel,
+                                 dependencies=[auth_spec(scopes=[f'{prefix}:read'])])
+
+            router.add_api_route("/processing/stats", self.processing_stats, methods=["GET"],
+                                 response_model=Dict[str, ProcessingLaneStatsTModel],
+                                 dependencies=[auth_spec(scopes=[f'{prefix}:read'])])
+
+            router.add_api_route("/processing/cache", self.derivation_cache_stats, methods=["GET"],
+                                 response_model=DerivationCacheStatsTModel,
+                                 dependencies=[auth_spec(scopes=[f'{prefix}:read'])])
+
             router.add_api_route("/{id}/formats/upload", self.upload_media_format, methods=["POST"],
                                  response_model=GenericTokenTModel,
                                  dependencies=[auth_spec(scopes=[f'{prefix}:write'])])
 
+            router.add_api_route("/formats/upload", self.upload_media_formats, methods=["POST"],
+                                 response_model=GenericTokenTModel,
+                                 dependencies=[auth_spec(scopes=[f'{prefix}:write'])])
+
+            router.add_api_route("/{id}/formats/uploads", self.create_resumable_upload, methods=["POST"],
+                                 response_model=GenericTokenTModel,
+                                 dependencies=[auth_spec(scopes=[f'{prefix}:write'])])
+
+            router.add_api_route("/{id}/formats/uploads/{token_id}", self.resumable_upload_offset,
+                                 methods=["HEAD"],
+                                 dependencies=[auth_spec(scopes=[f'{prefix}:write'])])
+
+            router.add_api_route("/{id}/formats/uploads/{token_id}", self.upload_resumable_chunk,
+                                 methods=["PATCH"], status_code=204,
+                                 dependencies=[auth_spec(scopes=[f'{prefix}:write'])])
+
             # router.add_api_route("/{id}/formats/delete", self.delete_media_format, methods=["POST"],
             #                      # response_model=[],
             #                      dependencies=[auth_spec(scopes=[f'{prefix}:write'])])
@@ -231,6 +570,10 @@ class InterestContentRouterGenerator(ApiRouterGenerator):
             router.add_api_route("/{id}/sequence/contents", self.get_sequence_contents, methods=['GET'],
                                  dependencies=[auth_spec(scopes=[f'{prefix}:read'])])
 
+            router.add_api_route("/{id}/sequence/timeline", self.get_sequence_timeline, methods=['GET'],
+                                 response_model=Optional[Union[TimelinePositionTModel, SequenceTimelineTModel]],
+                                 dependencies=[auth_spec(scopes=[f'{prefix}:read'])])
+
             router.add_api_route("/{id}/sequence/duration", self.set_sequence_default_duration, methods=['POST'],
                                  response_model=SequenceDefaultDurationResponseTModel,
                                  dependencies=[auth_spec(scopes=[f'{prefix}:write'])])
@@ -243,4 +586,12 @@ class InterestContentRouterGenerator(ApiRouterGenerator):
                                  # response_model=,
                                  dependencies=[auth_spec(scopes=[f'{prefix}:write'])])
 
+            router.add_api_route("/{id}/sequence/duration/{position}", self.change_item_duration, methods=['POST'],
+                                 # response_model=,
+                                 dependencies=[auth_spec(scopes=[f'{prefix}:write'])])
+
+            router.add_api_route("/{id}/sequence/batch", self.batch_edit_sequence, methods=['POST'],
+                                 # response_model=,
+                                 dependencies=[auth_spec(scopes=[f'{prefix}:write'])])
+
         return [router]
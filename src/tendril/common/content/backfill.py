@@ -0,0 +1,101 @@
+
+
+import argparse
+from concurrent.futures import as_completed
+from concurrent.futures import ThreadPoolExecutor
+
+from tendril.utils.db import get_session
+from tendril.config import MEDIA_THUMBNAIL_SIZES
+from tendril.config import MEDIA_THUMBNAIL_BACKFILL_CONCURRENCY
+from tendril.db.controllers.content import get_content_format
+from tendril.db.controllers.content import get_formats_missing_thumbnails
+from tendril.common.interests.representations import rewrap_interest
+
+from .thumbnails import thumbnail_box
+from .thumbnails import parse_thumbnail_size
+
+from tendril.utils import log
+logger = log.get_logger(__name__, log.DEFAULT)
+
+
+def _backfill_format(format_id, sizes):
+    with get_session() as session:
+        fmt = get_content_format(id=format_id, session=session)
+        interest_model = fmt.content.interest
+        if interest_model is None:
+            logger.info(f"Format {format_id} does not belong to any interest. Skipping.")
+            return False
+        interest = rewrap_interest(interest_model)
+        interest._generate_format_thumbnails(format_id, sizes, session=session)
+        return True
+
+
+def backfill_thumbnails(sizes=None, concurrency=MEDIA_THUMBNAIL_BACKFILL_CONCURRENCY,
+                        after_id=None, batch_size=None):
+    """
+    Generate thumbnails of the given sizes for every file media format in
+    the library which lacks any of them, processing up to ``concurrency``
+    formats at a time.
+
+    The job is resumable. Formats are walked in order of their id, and the
+    id of the last format of each completed batch is logged as a
+    checkpoint. Restarting with ``after_id`` set to a checkpoint continues
+    from there. Restarting from scratch is also safe, since formats which
+    already have all the sizes are never selected, but it retries any
+    formats which failed.
+    """
+    if sizes is None:
+        sizes = MEDIA_THUMBNAIL_SIZES
+    if batch_size is None:
+        batch_size = concurrency * 8
+    boxes = [thumbnail_box(x) for x in sizes]
+
+    processed, failed = 0, 0
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        while True:
+            with get_session() as session:
+                batch = [x.id for x in get_formats_missing_thumbnails(
+                    sizes=boxes, after_id=after_id, limit=batch_size, session=session)]
+            if not batch:
+                break
+            futures = {executor.submit(_backfill_format, x, sizes): x for x in batch}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                    processed += 1
+                except Exception as e:
+                    logger.warning(f"Could not backfill thumbnails for format {futures[future]} : {e}")
+                    failed += 1
+            after_id = batch[-1]
+            logger.info(f"Thumbnail backfill checkpoint : after_id={after_id}, "
+                        f"processed={processed}, failed={failed}")
+
+    return {'processed': processed, 'failed': failed, 'after_id': after_id}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generate missing thumbnails for existing media formats."
+    )
+    parser.add_argument('--sizes', nargs='*', default=None,
+                        help="Thumbnail sizes to generate, as <size> or <width>x<height>. "
+                             "Defaults to MEDIA_THUMBNAIL_SIZES.")
+    parser.add_argument('--concurrency', type=int, default=MEDIA_THUMBNAIL_BACKFILL_CONCURRENCY,
+                        help="Number of formats to process concurrently.")
+    parser.add_argument('--after-id', type=int, default=None,
+                        help="Resume after the format with this id, as logged in a checkpoint.")
+    args = parser.parse_args()
+
+    sizes = None
+    if args.sizes:
+        sizes = [parse_thumbnail_size(x) for x in args.sizes]
+        if None in sizes:
+            parser.error(f"Could not parse thumbnail sizes {args.sizes}")
+
+    result = backfill_thumbnails(sizes=sizes, concurrency=args.concurrency,
+                                 after_id=args.after_id)
+    logger.info(f"Thumbnail backfill complete : {result}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,273 @@
+
+
+import os
+import json
+import shutil
+import hashlib
+import fcntl
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from tendril.config import MEDIA_THUMBNAIL_SIZES
+from tendril.config import MEDIA_THUMBNAIL_BACKGROUND
+from tendril.config import MEDIA_DERIVATION_CACHE_DIR
+from tendril.config import MEDIA_DERIVATION_CACHE_SIZE
+from tendril.utils.parsers.media.info import get_media_info
+
+from .thumbnails import thumbnail_target
+from .thumbnails import generate_thumbnails
+
+from tendril.utils import log
+logger = log.get_logger(__name__, log.DEFAULT)
+
+
+class DerivationCache(object):
+    """
+    A size bounded, on-disk cache of artefacts derived from media files,
+    keyed on the sha256 of the source file, the operation which produced
+    the artefact and the parameters the operation was run with.
+
+    Entries are evicted least recently used first once the total size of
+    the cache exceeds ``max_size`` bytes. The file modification time of
+    each entry doubles as its last access time, so the LRU order survives
+    restarts.
+
+    The cache is shared by every process using the same folder, such as
+    the media processing workers. The total size and the hit counters
+    are kept in a state file in the cache folder, which is only read and
+    written under an exclusive lock, so the size bound holds across
+    processes and the counters cover all of them.
+
+    Lookups do not take the lock. Each instance counts its own hits and
+    misses, and adds them to the shared counters the next time it takes
+    the lock to store an entry or to report the stats.
+    """
+    def __init__(self, path=MEDIA_DERIVATION_CACHE_DIR, max_size=MEDIA_DERIVATION_CACHE_SIZE):
+        self.path = path
+        self.max_size = max_size
+        self._counts_lock = threading.Lock()
+        self._counts = self._no_counts()
+
+    @staticmethod
+    def _no_counts():
+        return {'hits': 0, 'misses': 0, 'bytes_saved': 0}
+
+    def _count(self, **counts):
+        with self._counts_lock:
+            for name, value in counts.items():
+                self._counts[name] += value
+
+    @staticmethod
+    def key(sha256, operation, **params):
+        spec = json.dumps([sha256, operation, params], sort_keys=True, default=str)
+        return hashlib.sha256(spec.encode()).hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.path, key[:2], key)
+
+    def _entries(self):
+        for root, _, files in os.walk(self.path):
+            if root == self.path:
+                # The lock and state files live at the top level.
+                continue
+            for fname in files:
+                if fname.endswith('.tmp'):
+                    continue
+                fpath = os.path.join(root, fname)
+                try:
+                    st = os.stat(fpath)
+                except FileNotFoundError:
+                    continue
+                yield fpath, st
+
+    @contextmanager
+    def _state(self):
+        # Holds the cache lock, and yields the shared state for reading
+        # and updating. The state is written back when the block exits.
+        os.makedirs(self.path, exist_ok=True)
+        state_path = os.path.join(self.path, 'state.json')
+        with open(os.path.join(self.path, 'cache.lock'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                try:
+                    with open(state_path, 'r') as f:
+                        state = json.load(f)
+                except (FileNotFoundError, ValueError):
+                    state = {'hits': 0, 'misses': 0, 'bytes_saved': 0, 'size': None}
+                if state['size'] is None:
+                    state['size'] = sum(st.st_size for _, st in self._entries())
+                with self._counts_lock:
+                    counts, self._counts = self._counts, self._no_counts()
+                for name, value in counts.items():
+                    state[name] += value
+                yield state
+                tmp_path = f'{state_path}.tmp'
+                with open(tmp_path, 'w') as f:
+                    json.dump(state, f)
+                os.replace(tmp_path, state_path)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _open(self, key, mode='rb'):
+        # Entries are only ever replaced or removed whole, so an entry
+        # which is opened can be read in full even if it is evicted in
+        # the meanwhile.
+        try:
+            f = open(self._entry_path(key), mode)
+        except FileNotFoundError:
+            self._count(misses=1)
+            return None
+        self._count(hits=1, bytes_saved=os.fstat(f.fileno()).st_size)
+        os.utime(f.fileno())
+        return f
+
+    def _store(self, key, writer):
+        entry_path = self._entry_path(key)
+        os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(entry_path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                writer(f)
+            with self._state() as state:
+                if os.path.exists(entry_path):
+                    state['size'] -= os.path.getsize(entry_path)
+                os.replace(tmp_path, entry_path)
+                state['size'] += os.path.getsize(entry_path)
+                if state['size'] > self.max_size:
+                    state['size'] = self._evict()
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _evict(self):
+        # The size is recounted from the disk while evicting, so that any
+        # drift in the recorded size does not outlive an eviction.
+        entries = sorted(self._entries(), key=lambda x: x[1].st_mtime)
+        size = sum(st.st_size for _, st in entries)
+        for fpath, st in entries:
+            if size <= self.max_size:
+                break
+            try:
+                os.remove(fpath)
+            except FileNotFoundError:
+                continue
+            size -= st.st_size
+        return size
+
+    def get_json(self, key):
+        f = self._open(key, 'r')
+        if not f:
+            return None
+        with f:
+            return json.load(f)
+
+    def put_json(self, key, value):
+        self._store(key, lambda f: f.write(json.dumps(value, default=str).encode()))
+
+    def get_file(self, key, target_path):
+        f = self._open(key)
+        if not f:
+            return None
+        with f, open(target_path, 'wb') as target:
+            shutil.copyfileobj(f, target)
+        return target_path
+
+    def put_file(self, key, source_path):
+        def _writer(f):
+            with open(source_path, 'rb') as source:
+                shutil.copyfileobj(source, f)
+        self._store(key, _writer)
+
+    def stats(self):
+        with self._state() as state:
+            lookups = state['hits'] + state['misses']
+            return {'hits': state['hits'],
+                    'misses': state['misses'],
+                    'hit_rate': state['hits'] / lookups if lookups else None,
+                    'bytes_saved': state['bytes_saved'],
+                    'size': state['size'],
+                    'max_size': self.max_size}
+
+
+derivations = DerivationCache()
+
+
+class CachedMediaInfo(object):
+    """
+    Stands in for the media information objects produced by the media
+    parsers when they are recovered from the derivation cache.
+    """
+    def __init__(self, width, height, duration, info):
+        self._width = width
+        self._height = height
+        self._duration = duration
+        self._info = info
+
+    def width(self):
+        return self._width
+
+    def height(self):
+        return self._height
+
+    def duration(self):
+        return self._duration
+
+    def asdict(self):
+        return self._info
+
+
+def cached_media_info(file, sha256, filename=None, original_filename=None):
+    ext = os.path.splitext(filename)[1]
+    key = derivations.key(sha256, 'media_info', ext=ext)
+    cached = derivations.get_json(key)
+    if cached is not None:
+        info = cached['info']
+        info['filename'] = os.path.split(filename)[-1]
+        info['original_filename'] = original_filename
+        return CachedMediaInfo(cached['width'], cached['height'], cached['duration'], info)
+    media_info = get_media_info(file, filename=filename, original_filename=original_filename)
+    derivations.put_json(key, {'width': media_info.width(),
+                               'height': media_info.height(),
+                               'duration': media_info.duration(),
+                               'info': media_info.asdict()})
+    return media_info
+
+
+def cached_thumbnails(file, sha256, output_dir, filename=None,
+                      sizes=None, background=MEDIA_THUMBNAIL_BACKGROUND):
+    """
+    Produce thumbnails for a media file in the same way as
+    :func:`tendril.common.content.thumbnails.generate_thumbnails`, serving
+    sizes already derived from identical content from the cache and
+    rendering only the rest.
+    """
+    if sizes is None:
+        sizes = MEDIA_THUMBNAIL_SIZES
+    ext = os.path.splitext(filename)[1]
+    os.makedirs(output_dir, exist_ok=True)
+
+    found = {}
+    missing = []
+    boxes = []
+    for size in sizes:
+        box, output_fname = thumbnail_target(filename, size, background=background)
+        boxes.append(box)
+        key = derivations.key(sha256, 'thumbnail', ext=ext, size=box, background=background)
+        output_path = derivations.get_file(key, os.path.join(output_dir, output_fname))
+        if output_path:
+            found[box] = output_path
+        else:
+            missing.append((size, box, key))
+
+    if missing:
+        keys = {box: key for _, box, key in missing}
+        generated = generate_thumbnails(file, output_dir, filename=filename,
+                                        sizes=[x[0] for x in missing],
+                                        background=background)
+        for box, output_path in generated:
+            derivations.put_file(keys[box], output_path)
+            found[box] = output_path
+
+    return [(box, found[box]) for box in boxes if box in found]
@@ -43,3 +43,109 @@ class FileTypeUnsupported(InterestActionException):
                f"failed. Provided file has extension '{self.extension}' which is unsupported. " \
                f"Supported extensions are `{self.allowed}`."
 
+
+class FormatNotFound(InterestActionException):
+    status_code = 404
+
+    def __init__(self, format_id, *args, **kwargs):
+        super(FormatNotFound, self).__init__(*args, **kwargs)
+        self.format_id = format_id
+
+    def __str__(self):
+        return f"The interest {self.interest_id}, {self.interest_name} does not have " \
+               f"a media format with id {self.format_id}. '{self.action}' cannot be performed."
+
+
+class ThumbnailSizeUnsupported(InterestActionException):
+    status_code = 406
+
+    def __init__(self, size, allowed, max_size, *args, **kwargs):
+        super(ThumbnailSizeUnsupported, self).__init__(*args, **kwargs)
+        self.size = size
+        self.allowed = allowed
+        self.max_size = max_size
+
+    def __str__(self):
+        return f"Thumbnail size '{self.size}' for interest {self.interest_id}, " \
+               f"{self.interest_name} is not supported. Sizes must be one of " \
+               f"{self.allowed}, or, for users who can add artefacts, positive " \
+               f"integers or <width>x<height> with no dimension larger than {self.max_size}."
+
+
+class ThumbnailNotAvailable(InterestActionException):
+    status_code = 404
+
+    def __init__(self, format_id, size, *args, **kwargs):
+        super(ThumbnailNotAvailable, self).__init__(*args, **kwargs)
+        self.format_id = format_id
+        self.size = size
+
+    def __str__(self):
+        return f"A thumbnail of size '{self.size}' is not available for media format " \
+               f"{self.format_id} of interest {self.interest_id}, {self.interest_name}. " \
+               f"The format may not be backed by a stored file."
+
+
+class ProcessingQueueFull(InterestActionException):
+    status_code = 429
+
+    def __init__(self, depth, max_depth, *args, **kwargs):
+        super(ProcessingQueueFull, self).__init__(*args, **kwargs)
+        self.depth = depth
+        self.max_depth = max_depth
+
+    def __str__(self):
+        return f"Media processing for interest {self.interest_id}, {self.interest_name} " \
+               f"cannot be accepted right now. {self.depth} of {self.max_depth} jobs " \
+               f"are already queued. Try again later."
+
+
+class UploadNotFound(InterestActionException):
+    status_code = 404
+
+    def __init__(self, token_id, *args, **kwargs):
+        super(UploadNotFound, self).__init__(*args, **kwargs)
+        self.token_id = token_id
+
+    def __str__(self):
+        return f"The interest {self.interest_id}, {self.interest_name} does not have " \
+               f"an open resumable upload {self.token_id}. It may have completed or expired."
+
+
+class UploadConflict(InterestActionException):
+    status_code = 409
+
+    def __init__(self, token_id, reason, *args, **kwargs):
+        super(UploadConflict, self).__init__(*args, **kwargs)
+        self.token_id = token_id
+        self.reason = reason
+
+    def __str__(self):
+        return f"Resumable upload {self.token_id} to interest {self.interest_id}, " \
+               f"{self.interest_name} cannot accept this chunk. {self.reason}"
+
+
+class UploadLengthExceeded(InterestActionException):
+    status_code = 413
+
+    def __init__(self, token_id, length, *args, **kwargs):
+        super(UploadLengthExceeded, self).__init__(*args, **kwargs)
+        self.token_id = token_id
+        self.length = length
+
+    def __str__(self):
+        return f"Resumable upload {self.token_id} to interest {self.interest_id}, " \
+               f"{self.interest_name} was declared to be {self.length} bytes long. " \
+               f"The data sent goes beyond that."
+
+
+class BatchUploadMismatch(HTTPCodedException):
+    status_code = 422
+
+    def __init__(self, files, ids):
+        self.files = files
+        self.ids = ids
+
+    def __str__(self):
+        return f"A batch upload needs either one interest id for all its files, " \
+               f"or one for each file. Got {self.ids} ids for {self.files} files."
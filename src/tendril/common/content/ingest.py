@@ -0,0 +1,157 @@
+
+
+import os
+import hashlib
+import tempfile
+
+from tendril.config import MEDIA_INGEST_CHUNK_SIZE
+from tendril.utils.www import async_client
+from tendril.utils.fsutils import TEMPDIR
+
+from tendril.utils import log
+logger = log.get_logger(__name__, log.DEFAULT)
+
+
+class StagedUpload(object):
+    """
+    An uploaded media file along with its size and sha256, computed in a
+    single pass over the upload in chunks.
+
+    Uploads which can be rewound, such as the spooled file behind an
+    ``UploadFile``, are staged in place by :meth:`from_file`, and the
+    stages of ``add_format`` read the upload itself. Other sources, and
+    uploads which must outlive the request, such as those queued for
+    processing, are copied to a local file while they are hashed. The
+    object mimics the parts of ``UploadFile`` that ``add_format`` uses, so
+    it can be handed over in its place.
+    """
+    def __init__(self, source, filename, chunk_size=MEDIA_INGEST_CHUNK_SIZE, folder=None):
+        self.filename = filename
+        self._chunk_size = chunk_size
+        self._folder = folder or os.path.join(TEMPDIR, 'ingest')
+        self._file = None
+        self._owned = True
+        self._target = None
+        self._hash = None
+        self.path = None
+        self.size = 0
+        self.sha256 = None
+        if source is not None:
+            self._stage(source)
+
+    def _open(self):
+        os.makedirs(self._folder, exist_ok=True)
+        ext = os.path.splitext(self.filename)[1]
+        self._hash = hashlib.sha256()
+        self._target = tempfile.NamedTemporaryFile(dir=self._folder, suffix=ext, delete=False)
+        self.path = self._target.name
+
+    def _write(self, chunk):
+        self._hash.update(chunk)
+        self._target.write(chunk)
+        self.size += len(chunk)
+
+    def _close(self):
+        self._target.close()
+        self._target = None
+        self.sha256 = self._hash.hexdigest()
+        logger.debug(f"Staged {self.filename} to {self.path} : "
+                     f"{self.size} bytes, sha256 {self.sha256}")
+
+    def _stage(self, source):
+        if hasattr(source, 'seek'):
+            source.seek(0)
+        self._open()
+        try:
+            for chunk in iter(lambda: source.read(self._chunk_size), b''):
+                self._write(chunk)
+        except Exception:
+            self._close()
+            self.cleanup()
+            raise
+        self._close()
+
+    @classmethod
+    def from_file(cls, source, filename, chunk_size=MEDIA_INGEST_CHUNK_SIZE, folder=None):
+        """
+        Stage an upload in place, without copying it. The upload is read
+        once to compute its sha256, and is then rewound for each stage.
+        It remains owned by the caller, and is not closed on cleanup.
+        Sources which cannot be rewound are copied instead.
+        """
+        if not (hasattr(source, 'seekable') and source.seekable()):
+            return cls(source, filename, chunk_size=chunk_size, folder=folder)
+        rv = cls(None, filename, chunk_size=chunk_size, folder=folder)
+        h = hashlib.sha256()
+        source.seek(0)
+        for chunk in iter(lambda: source.read(chunk_size), b''):
+            h.update(chunk)
+            rv.size += len(chunk)
+        rv.sha256 = h.hexdigest()
+        rv._file = source
+        rv._owned = False
+        return rv
+
+    @classmethod
+    async def from_uri(cls, uri, filename, chunk_size=MEDIA_INGEST_CHUNK_SIZE, folder=None):
+        """
+        Stage a file by streaming it from the given URI, such as the
+        ``expose_uri`` of a file already in the filestore.
+        """
+        rv = cls(None, filename, chunk_size=chunk_size, folder=folder)
+        rv._open()
+        try:
+            async with async_client() as client:
+                async with client.stream('GET', uri) as response:
+                    response.raise_for_status()
+                    async for chunk in response.aiter_bytes(chunk_size):
+                        rv._write(chunk)
+        except Exception:
+            rv._close()
+            rv.cleanup()
+            raise
+        rv._close()
+        return rv
+
+    @classmethod
+    def from_path(cls, path, filename, sha256=None, chunk_size=MEDIA_INGEST_CHUNK_SIZE):
+        """
+        Adopt a file which has already been staged, such as one held in
+        the media processing spool, without copying it. The sha256 of the
+        file is computed unless it is provided.
+        """
+        rv = cls(None, filename, chunk_size=chunk_size, folder=os.path.dirname(path))
+        rv.path = path
+        rv.size = os.path.getsize(path)
+        if sha256 is None:
+            h = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(chunk_size), b''):
+                    h.update(chunk)
+            sha256 = h.hexdigest()
+        rv.sha256 = sha256
+        return rv
+
+    @property
+    def file(self):
+        """
+        A shared read handle on the staged file, rewound to the start
+        every time it is accessed.
+        """
+        if self._file is None or self._file.closed:
+            self._file = open(self.path, 'rb')
+        self._file.seek(0)
+        return self._file
+
+    def cleanup(self):
+        if self._file is not None and self._owned:
+            self._file.close()
+        self._file = None
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.cleanup()
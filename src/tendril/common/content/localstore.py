@@ -0,0 +1,103 @@
+
+
+import os
+import shutil
+import hashlib
+
+from tendril.filestore import buckets
+from tendril.filestore.base import FilestoreBucketBase
+from tendril.filestore.db.model import StoredFileModel
+from tendril.filestore.db.model import FilestoreBucketModel
+from tendril.utils.db import get_session
+
+from tendril.utils import log
+logger = log.get_logger(__name__, log.DEFAULT)
+
+
+class LocalFilesystemBucket(FilestoreBucketBase):
+    """
+    A stand-in for a remote filestore bucket, which keeps its files in a
+    local directory and records them in the database directly.
+
+    This implements the parts of the remote bucket interface used by media
+    content, so that uploads, processing and publishing can be exercised
+    in tests and local development without a filestore component. Use
+    :func:`install_local_buckets` to put it in place of the configured
+    buckets.
+    """
+    def __init__(self, root, name, expose_uri=None):
+        path = os.path.join(root, name)
+        super(LocalFilesystemBucket, self).__init__(
+            path, name, expose_uri=expose_uri or f'file://{path}/',
+            allow_delete=True, allow_overwrite=True
+        )
+        os.makedirs(path, exist_ok=True)
+
+    def _async_http_client_args(self):
+        return {}
+
+    def _path(self, filename):
+        return os.path.join(self.uri, filename)
+
+    def _bucket_id(self, session):
+        bucket = session.query(FilestoreBucketModel).filter_by(name=self.name).one_or_none()
+        if bucket is None:
+            bucket = FilestoreBucketModel(name=self.name)
+            session.add(bucket)
+            session.flush()
+        return bucket.id
+
+    async def upload(self, file, actual_user=None, interest=None, label=None,
+                     overwrite=False, client=None):
+        filename, source = file
+        target = self._path(filename)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        h = hashlib.sha256()
+        with open(target, 'wb') as f:
+            for chunk in iter(lambda: source.read(1024 * 1024), b''):
+                h.update(chunk)
+                f.write(chunk)
+        fileinfo = {'props': {'size': os.path.getsize(target)},
+                    'hash': {'sha256': h.hexdigest()},
+                    'ext': os.path.splitext(filename)[1]}
+        with get_session() as session:
+            bucket_id = self._bucket_id(session)
+            stored_file = session.query(StoredFileModel)\
+                .filter_by(filename=filename, bucket_id=bucket_id).one_or_none()
+            if stored_file is None:
+                stored_file = StoredFileModel(filename=filename, bucket_id=bucket_id,
+                                              type='stored_file', interest_id=interest,
+                                              label=label)
+            stored_file.fileinfo = fileinfo
+            session.add(stored_file)
+            session.flush()
+            return {'storedfileid': stored_file.id, 'filename': filename}
+
+    async def move(self, filename, target_bucket, actual_user=None,
+                   overwrite=False, client=None):
+        target = buckets.get_bucket(target_bucket)
+        if not os.path.exists(self._path(filename)):
+            raise FileNotFoundError(f"Move of nonexisting file {filename} "
+                                    f"from bucket {self.name} requested.")
+        os.makedirs(os.path.dirname(target._path(filename)), exist_ok=True)
+        shutil.move(self._path(filename), target._path(filename))
+        with get_session() as session:
+            stored_file = session.query(StoredFileModel)\
+                .filter_by(filename=filename, bucket_id=self._bucket_id(session)).one()
+            stored_file.bucket_id = target._bucket_id(session)
+            session.add(stored_file)
+            return {'storedfileid': stored_file.id, 'filename': filename}
+
+    async def delete(self, filename, user, client=None):
+        if os.path.exists(self._path(filename)):
+            os.remove(self._path(filename))
+
+
+def install_local_buckets(root, names):
+    """
+    Replace the named filestore buckets with local filesystem stand-ins
+    rooted at the given directory.
+    """
+    for name in names:
+        logger.info(f"Using a local filesystem stand-in for filestore bucket {name} at {root}")
+        buckets._available_buckets[name] = LocalFilesystemBucket(root, name)
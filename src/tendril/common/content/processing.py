@@ -0,0 +1,571 @@
+
+
+import os
+import json
+import time
+import uuid
+import errno
+import fcntl
+import socket
+import argparse
+import itertools
+import threading
+import multiprocessing
+from concurrent.futures import wait
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from tendril.caching import tokens
+from tendril.caching.tokens import TokenStatus
+from tendril.utils.db import get_session
+from tendril.db.controllers.interests import get_interest
+
+from tendril.config import MEDIA_PROCESSING_MODE
+from tendril.config import MEDIA_PROCESSING_SPOOL_DIR
+from tendril.config import MEDIA_PROCESSING_WORKERS
+from tendril.config import MEDIA_PROCESSING_QUEUE_MAX
+from tendril.config import MEDIA_PROCESSING_MAX_ATTEMPTS
+from tendril.config import MEDIA_PROCESSING_POLL_INTERVAL
+from tendril.config import MEDIA_PROCESSING_LANE_WEIGHTS
+from tendril.config import MEDIA_PROCESSING_FAST_LANE_MAX_SIZE
+from tendril.config import MEDIA_PROCESSING_FAIRNESS_KEY
+from tendril.config import MEDIA_IMAGE_EXTENSIONS
+from tendril.config import MEDIA_UPLOAD_BATCH_CONCURRENCY
+
+from .ingest import StagedUpload
+from .exceptions import ProcessingQueueFull
+
+from tendril.utils import log
+logger = log.get_logger(__name__, log.DEFAULT)
+
+
+token_namespace = 'mfu'
+
+
+def process_job(job):
+    """
+    Run a single media processing job. This is executed in a worker
+    process, with its own database session.
+    """
+    staged = StagedUpload.from_path(job['path'], job['filename'], sha256=job['sha256'])
+    # Jobs only carry the id of the user, which the interests resolve
+    # their roles from. Jobs spooled by older versions carry the user.
+    user_id = job['user_id'] if 'user_id' in job else job['user']['id']
+    with get_session() as session:
+        interest = get_interest(id=job['interest_id'], session=session).actual
+        interest.add_format(file=staged, rename_to=job['rename_to'],
+                            token_id=job['token_id'], auth_user=user_id,
+                            session=session)
+
+
+class ProcessingQueue(object):
+    """
+    A queue of media processing jobs, kept in a spool directory and run
+    by a dispatcher on a pool of worker processes.
+
+    Each job is a JSON file named after the ``mfu`` token which tracks it,
+    and is in the ``pending`` folder of the spool until a dispatcher claims
+    it. The uploaded file it processes is held in the ``files`` folder.
+    A dispatcher claims a job by renaming it into its own folder under
+    ``running``, so that when several dispatchers share a spool, each job
+    is claimed by exactly one of them. Every dispatcher holds a lock on
+    its folder while it runs. The jobs in the folder of a dispatcher which
+    no longer holds its lock were interrupted, and are queued again by
+    :meth:`recover`, under a lock on the whole spool.
+
+    If a worker process dies, every job running on the pool is lost with
+    it. When more than one job was running, the one which killed the pool
+    is not known, so the jobs are queued again without using up one of
+    their attempts, and are then run one at a time until each has either
+    ended or killed the pool on its own.
+
+    Jobs are sorted into lanes when they are queued, small images into
+    the ``fast`` lane and everything else into the ``bulk`` lane. While
+    several lanes have jobs waiting, workers are shared between them in
+    proportion to their weights. Within a lane, the users (or interests,
+    see ``fairness_key``) with waiting jobs are served in turns, so that
+    one large batch of uploads does not hold up everyone else.
+
+    The dispatcher can run in a thread of the API server (see
+    :meth:`autostart`), or standalone with :func:`main`.
+    """
+    def __init__(self, path=MEDIA_PROCESSING_SPOOL_DIR,
+                 workers=MEDIA_PROCESSING_WORKERS,
+                 max_depth=MEDIA_PROCESSING_QUEUE_MAX,
+                 max_attempts=MEDIA_PROCESSING_MAX_ATTEMPTS,
+                 poll_interval=MEDIA_PROCESSING_POLL_INTERVAL,
+                 lane_weights=MEDIA_PROCESSING_LANE_WEIGHTS,
+                 fairness_key=MEDIA_PROCESSING_FAIRNESS_KEY):
+        self.path = path
+        self.workers = workers
+        self.max_depth = max_depth
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.lane_weights = lane_weights
+        self.fairness_key = fairness_key
+        # Stride scheduling state for the lanes, and the order in which
+        # the tenants of each lane were last served.
+        self._vtime = 0.0
+        self._passes = {}
+        self._served = {}
+        self._serial = itertools.count()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._recovered_at = None
+        self.dispatcher_id = f'{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}'
+
+    def _folder(self, state):
+        folder = os.path.join(self.path, state)
+        os.makedirs(folder, exist_ok=True)
+        return folder
+
+    def _job_path(self, state, token_id):
+        return os.path.join(self._folder(state), f'{token_id}.json')
+
+    def _jobs(self, state):
+        folder = self._folder(state)
+        if state == 'running':
+            # Running jobs are in the folders of the dispatchers running them.
+            return [os.path.join(folder, d, x)
+                    for d in os.listdir(folder) if os.path.isdir(os.path.join(folder, d))
+                    for x in os.listdir(os.path.join(folder, d)) if x.endswith('.json')]
+        return [os.path.join(folder, x) for x in os.listdir(folder) if x.endswith('.json')]
+
+    @property
+    def _running_folder(self):
+        return self._folder(os.path.join('running', self.dispatcher_id))
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def _try_lock(path):
+        # Returns an open file holding an exclusive lock on the path, or
+        # None if someone else holds it. The lock is released when the
+        # file is closed, including when the process holding it dies.
+        f = open(path, 'a')
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            f.close()
+            return None
+        return f
+
+    @staticmethod
+    def _read(job_path):
+        with open(job_path, 'r') as f:
+            return json.load(f)
+
+    @staticmethod
+    def _write(job_path, job):
+        tmp_path = f'{job_path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(job, f, default=str)
+        os.replace(tmp_path, job_path)
+
+    def depth(self):
+        return len(self._jobs('pending')) + len(self._jobs('running'))
+
+    def check_capacity(self, interest=None, count=1):
+        depth = self.depth()
+        if depth + count > self.max_depth:
+            raise ProcessingQueueFull(depth, self.max_depth, 'add_artefact',
+                                      interest.id if interest else None,
+                                      interest.name if interest else None)
+
+    @property
+    def staging_folder(self):
+        return self._folder('files')
+
+    def stage(self, source, filename):
+        """
+        Stage an upload into the spool, where it stays until the job
+        which processes it is done.
+        """
+        return StagedUpload(source, filename, folder=self.staging_folder)
+
+    def stage_all(self, files, concurrency=MEDIA_UPLOAD_BATCH_CONCURRENCY):
+        """
+        Stage several uploads, given as ``(source, filename)`` pairs, in
+        parallel. If any of them cannot be staged, the others are discarded
+        and the exception is raised.
+        """
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = [executor.submit(self.stage, source, filename)
+                       for source, filename in files]
+        staged = [x.result() for x in futures if not x.exception()]
+        errors = [x.exception() for x in futures if x.exception()]
+        if errors:
+            for x in staged:
+                x.cleanup()
+            raise errors[0]
+        return staged
+
+    def _lane(self, staged):
+        ext = os.path.splitext(staged.filename)[1].lower()
+        if ext in MEDIA_IMAGE_EXTENSIONS and staged.size <= MEDIA_PROCESSING_FAST_LANE_MAX_SIZE:
+            return 'fast'
+        return 'bulk'
+
+    def _job_lane(self, job):
+        lane = job.get('lane')
+        return lane if lane in self.lane_weights else 'bulk'
+
+    def submit(self, token_id, interest, staged, rename_to, user, batch_id=None):
+        """
+        Queue processing of a staged upload for an interest. Raises
+        :class:`ProcessingQueueFull` if the queue is at capacity, in which
+        case the staged upload is discarded. If the upload is part of a
+        batch, the batch token is updated whenever the job ends.
+        """
+        try:
+            self.check_capacity(interest)
+        except ProcessingQueueFull as e:
+            staged.cleanup()
+            tokens.update(token_namespace, token_id, state=TokenStatus.FAILED,
+                          error={"summary": str(e)})
+            raise
+        job = {
+            'token_id': str(token_id),
+            'interest_id': interest.id,
+            'path': staged.path,
+            'filename': staged.filename,
+            'sha256': staged.sha256,
+            'size': staged.size,
+            'rename_to': rename_to,
+            'user_id': user.id,
+            'lane': self._lane(staged),
+            'tenant': str(interest.id if self.fairness_key == 'interest' else user.id),
+            'queued_at': time.time(),
+            'attempts': 0,
+        }
+        if batch_id:
+            job['batch_id'] = str(batch_id)
+        self._write(self._job_path('pending', job['token_id']), job)
+        tokens.update(token_namespace, job['token_id'], current="Queued for Processing")
+        self._wakeup.set()
+        return job
+
+    def _finish(self, job_path, job):
+        for path in (job_path, job['path']):
+            self._remove(path)
+        if job.get('batch_id'):
+            self.update_batch(job['batch_id'])
+
+    @staticmethod
+    def update_batch(batch_id):
+        """
+        Derive the progress of a batch upload token from the tokens of the
+        uploads in it, and close it once all of them have ended. The end
+        state of each upload is recorded in the batch token, since the
+        upload tokens expire soon after they are closed.
+        """
+        batch = tokens.read(token_namespace, batch_id)
+        if batch is None:
+            return
+        uploads = batch.metadata['uploads']
+        for upload in uploads:
+            if upload.get('state'):
+                continue
+            token = tokens.read(token_namespace, upload['token_id'])
+            if token is None:
+                upload['state'] = TokenStatus.FAILED.value
+            elif token.state in (TokenStatus.CLOSED, TokenStatus.FAILED):
+                upload['state'] = token.state.value
+        ended = [x for x in uploads if x.get('state')]
+        failed = [x['token_id'] for x in ended if x['state'] == TokenStatus.FAILED.value]
+        error = None
+        if failed:
+            error = {"summary": f"{len(failed)} of {len(uploads)} files could not be processed",
+                     "failed": failed}
+        tokens.update(token_namespace, batch_id, state=TokenStatus.INPROGRESS,
+                      current=f"{len(ended)} of {len(uploads)} files processed",
+                      done=len(ended), metadata={'uploads': uploads}, error=error)
+        if len(ended) == len(uploads):
+            tokens.close(token_namespace, batch_id, failed=len(failed) == len(uploads))
+
+    def _give_up(self, job_path, job, summary):
+        logger.error(f"Giving up on media processing job {job['token_id']} : {summary}")
+        tokens.update(token_namespace, job['token_id'], state=TokenStatus.FAILED,
+                      error={"summary": summary})
+        self._finish(job_path, job)
+
+    def _requeue(self, job_path, job, charge=True):
+        if not charge:
+            # The job may not be what interrupted it, so the attempt is
+            # not counted, and it is run alone until that is known.
+            job['attempts'] -= 1
+            job['suspect'] = True
+        elif job['attempts'] >= self.max_attempts:
+            self._give_up(job_path, job, f"Processing was interrupted "
+                                         f"{job['attempts']} times")
+            return
+        logger.warning(f"Requeueing interrupted media processing job {job['token_id']}")
+        self._write(self._job_path('pending', job['token_id']), job)
+        self._remove(job_path)
+
+    def recover(self):
+        """
+        Queue again every job claimed by a dispatcher which is no longer
+        running. This is safe to call while other dispatchers are running
+        against the same spool.
+        """
+        spool_lock = open(os.path.join(self._folder(''), 'spool.lock'), 'a')
+        try:
+            fcntl.flock(spool_lock, fcntl.LOCK_EX)
+            running = self._folder('running')
+            for name in os.listdir(running):
+                folder = os.path.join(running, name)
+                if not os.path.isdir(folder) or name == self.dispatcher_id:
+                    continue
+                lock = self._try_lock(f'{folder}.lock')
+                if lock is None:
+                    # Its dispatcher is alive.
+                    continue
+                try:
+                    for x in os.listdir(folder):
+                        if not x.endswith('.json'):
+                            continue
+                        job_path = os.path.join(folder, x)
+                        try:
+                            job = self._read(job_path)
+                        except (FileNotFoundError, ValueError):
+                            self._remove(job_path)
+                            continue
+                        self._requeue(job_path, job)
+                    for x in os.listdir(folder):
+                        self._remove(os.path.join(folder, x))
+                    os.rmdir(folder)
+                    self._remove(f'{folder}.lock')
+                finally:
+                    lock.close()
+        finally:
+            fcntl.flock(spool_lock, fcntl.LOCK_UN)
+            spool_lock.close()
+        self._recovered_at = time.time()
+
+    def _lane_pass(self, lane):
+        # A lane which has been idle does not bank credit for later.
+        return max(self._passes.get(lane, 0.0), self._vtime)
+
+    def _select(self, jobs, count):
+        queues = {}
+        for job_path, job in sorted(jobs, key=lambda x: x[1]['queued_at']):
+            queues.setdefault(self._job_lane(job), {})\
+                .setdefault(job.get('tenant'), []).append((job_path, job))
+
+        rv = []
+        while len(rv) < count and queues:
+            lane = min(queues, key=lambda x: (self._lane_pass(x), x))
+            tenants = queues[lane]
+            tenant = min(tenants, key=lambda x: (self._served.get((lane, x), -1),
+                                                 tenants[x][0][1]['queued_at']))
+            rv.append(tenants[tenant].pop(0))
+
+            self._served[(lane, tenant)] = next(self._serial)
+            self._vtime = self._lane_pass(lane)
+            self._passes[lane] = self._vtime + 1 / self.lane_weights[lane]
+            if not tenants[tenant]:
+                del tenants[tenant]
+            if not tenants:
+                del queues[lane]
+        return rv
+
+    def _claim(self, count, alone=False):
+        """
+        Claim up to ``count`` pending jobs for this dispatcher. Suspect
+        jobs are only claimed when ``alone`` is set, that is when nothing
+        else is running, and are then claimed on their own. While a
+        suspect job is waiting, no other jobs are claimed, so that the
+        running ones drain and the suspect gets its turn even under
+        steady traffic.
+        """
+        if count <= 0:
+            return []
+        pending = []
+        for job_path in self._jobs('pending'):
+            try:
+                pending.append((job_path, self._read(job_path)))
+            except (FileNotFoundError, ValueError):
+                # Claimed by another dispatcher, or still being written.
+                continue
+        suspects = sorted((x for x in pending if x[1].get('suspect')),
+                          key=lambda x: x[1]['queued_at'])
+        if suspects:
+            selected = suspects[:1] if alone else []
+        else:
+            selected = self._select([x for x in pending if not x[1].get('suspect')], count)
+        rv = []
+        for job_path, job in selected:
+            running_path = os.path.join(self._running_folder, os.path.basename(job_path))
+            try:
+                os.rename(job_path, running_path)
+            except OSError as e:
+                if e.errno == errno.ENOENT:
+                    # Another dispatcher claimed it first.
+                    continue
+                raise
+            job['attempts'] += 1
+            job['started_at'] = time.time()
+            self._write(running_path, job)
+            rv.append((running_path, job))
+        return rv
+
+    def stats(self):
+        """
+        Returns the queue depth and waiting times of each lane, read from
+        the spool so that it is available wherever the dispatcher runs.
+        """
+        now = time.time()
+        waits = {x: [] for x in self.lane_weights}
+        tenants = {x: set() for x in self.lane_weights}
+        running = {x: 0 for x in self.lane_weights}
+        for state in ('pending', 'running'):
+            for job_path in self._jobs(state):
+                try:
+                    job = self._read(job_path)
+                except FileNotFoundError:
+                    continue
+                lane = self._job_lane(job)
+                if state == 'running':
+                    running[lane] += 1
+                    continue
+                waits[lane].append(now - job['queued_at'])
+                tenants[lane].add(job.get('tenant'))
+        return {lane: {'weight': weight,
+                       'pending': len(waits[lane]),
+                       'running': running[lane],
+                       'tenants': len(tenants[lane]),
+                       'oldest_wait': max(waits[lane]) if waits[lane] else None,
+                       'mean_wait': sum(waits[lane]) / len(waits[lane]) if waits[lane] else None}
+                for lane, weight in self.lane_weights.items()}
+
+    def _executor(self):
+        # Workers are spawned rather than forked, so that they do not
+        # inherit the database connections of the parent.
+        return ProcessPoolExecutor(max_workers=self.workers,
+                                   mp_context=multiprocessing.get_context('spawn'))
+
+    def run(self):
+        """
+        Run the dispatcher until :meth:`stop` is called.
+        """
+        # The lock is taken before the folder is created, so that no other
+        # dispatcher takes the folder for the remains of a dead one.
+        lock = self._try_lock(os.path.join(self._folder('running'), f'{self.dispatcher_id}.lock'))
+        if lock is None:
+            logger.error(f"Media processing dispatcher {self.dispatcher_id} is already running")
+            return
+        self.recover()
+        executor = self._executor()
+        in_flight = {}
+        try:
+            while not self._stop.is_set():
+                if time.time() - self._recovered_at > 30 * self.poll_interval:
+                    # Pick up the jobs of dispatchers which died since.
+                    self.recover()
+                if not any(job.get('suspect') for _, job in in_flight.values()):
+                    for job_path, job in self._claim(self.workers - len(in_flight),
+                                                     alone=not in_flight):
+                        logger.info(f"Starting media processing job {job['token_id']}")
+                        in_flight[executor.submit(process_job, job)] = (job_path, job)
+
+                if not in_flight:
+                    self._wakeup.wait(self.poll_interval)
+                    self._wakeup.clear()
+                    continue
+
+                done, _ = wait(in_flight, timeout=self.poll_interval,
+                               return_when=FIRST_COMPLETED)
+                lost = []
+                for future in done:
+                    job_path, job = in_flight.pop(future)
+                    try:
+                        future.result()
+                    except BrokenProcessPool:
+                        lost.append((job_path, job))
+                    except Exception as e:
+                        self._give_up(job_path, job, f"Exception while processing "
+                                                     f"media file : {e}")
+                    else:
+                        self._finish(job_path, job)
+                if lost:
+                    # A worker died. Every job on the pool is lost with it,
+                    # and only a job which was running alone is to blame.
+                    lost.extend(in_flight.values())
+                    for job_path, job in lost:
+                        self._requeue(job_path, job, charge=len(lost) == 1)
+                    in_flight = {}
+                    executor.shutdown(wait=False)
+                    executor = self._executor()
+        finally:
+            executor.shutdown(wait=True)
+            lock.close()
+
+    def _run_exclusive(self):
+        # Wait for the processes which share the spool to hand over the
+        # dispatcher, checking in on the same interval as for new jobs.
+        while not self._stop.is_set():
+            lock = self._try_lock(os.path.join(self._folder(''), 'dispatcher.lock'))
+            if lock is None:
+                self._stop.wait(self.poll_interval)
+                continue
+            try:
+                logger.info(f"Running the media processing dispatcher in process {os.getpid()}")
+                self.run()
+            finally:
+                lock.close()
+
+    def start(self, exclusive=False):
+        """
+        Run the dispatcher in a background thread of this process. If
+        ``exclusive`` is set, the dispatcher only runs while no other
+        process started with ``exclusive`` is running one against the
+        same spool.
+        """
+        if self._thread and self._thread.is_alive():
+            return self._thread
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run_exclusive if exclusive else self.run,
+                                        daemon=True, name='media-processing')
+        self._thread.start()
+        return self._thread
+
+    def autostart(self):
+        # Every API server worker process calls this. Only one of them
+        # runs the dispatcher at a time, and the others stand by.
+        if MEDIA_PROCESSING_MODE == 'inprocess':
+            self.start(exclusive=True)
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+
+
+processing = ProcessingQueue()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run the media processing dispatcher and its worker processes."
+    )
+    parser.add_argument('--workers', type=int, default=MEDIA_PROCESSING_WORKERS,
+                        help="Number of worker processes.")
+    args = parser.parse_args()
+    processing.workers = args.workers
+    logger.info(f"Processing media from {processing.path} with {args.workers} workers")
+    try:
+        processing.run()
+    except KeyboardInterrupt:
+        processing.stop()
+
+
+if __name__ == '__main__':
+    main()
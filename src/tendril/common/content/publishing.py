@@ -0,0 +1,182 @@
+
+
+import asyncio
+import threading
+import weakref
+from httpx import HTTPError
+from httpx import HTTPStatusError
+from sqlalchemy.orm.exc import NoResultFound
+
+from tendril.config import MEDIA_PUBLISH_CONCURRENCY
+from tendril.config import MEDIA_PUBLISH_MAX_ATTEMPTS
+from tendril.config import MEDIA_PUBLISH_RETRY_BACKOFF
+from tendril.config import MEDIA_PUBLISH_CLAIM_TIMEOUT
+from tendril.db.controllers.interests import get_interest
+from tendril.filestore.db.controller import get_stored_file
+from tendril.db.controllers.content import set_stored_file_published
+from tendril.db.controllers.content_publishing import claim_publish_tasks
+from tendril.db.controllers.content_publishing import record_publish_attempt
+from tendril.db.controllers.content_publishing import get_interests_with_publish_tasks
+
+from tendril.utils import log
+logger = log.get_logger(__name__, log.DEFAULT)
+
+
+def _is_retryable(e):
+    if isinstance(e, HTTPStatusError):
+        code = e.response.status_code
+        return code >= 500 or code in (408, 429)
+    return isinstance(e, HTTPError)
+
+
+def _is_not_found(e):
+    return isinstance(e, HTTPStatusError) and e.response.status_code == 404
+
+
+def _in_bucket(filename, bucket):
+    try:
+        get_stored_file(filename=filename, bucket=bucket)
+    except NoResultFound:
+        return False
+    return True
+
+
+class PublishScheduler(object):
+    """
+    Publishes the stored files of content interests by moving them from
+    the upload bucket to the publishing bucket.
+
+    The state of every file is held in a ``ContentPublishTaskModel``. At
+    most ``concurrency`` moves are in flight at once on any event loop, and
+    failed moves are retried with exponential backoff, up to
+    ``max_attempts`` times. Publishing which was interrupted, for instance
+    by a restart, can be picked up again with :meth:`resume`.
+
+    Tasks are claimed before they are run, so that when several processes
+    publish at once, as every API server worker does when it resumes,
+    each file is moved by only one of them. A claimed task which sees no
+    attempt for ``claim_timeout`` seconds is assumed to be abandoned, and
+    can be claimed again. The retries of a task are spaced out to take
+    no more than half of that in all.
+
+    A move which fails because the file is not found is taken to have
+    succeeded if the file is already in the publishing bucket. This
+    happens when an earlier attempt moved the file but its response was
+    lost.
+    """
+    def __init__(self, concurrency=MEDIA_PUBLISH_CONCURRENCY,
+                 max_attempts=MEDIA_PUBLISH_MAX_ATTEMPTS,
+                 backoff=MEDIA_PUBLISH_RETRY_BACKOFF,
+                 claim_timeout=MEDIA_PUBLISH_CLAIM_TIMEOUT):
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.claim_timeout = claim_timeout
+        self._semaphores = weakref.WeakKeyDictionary()
+        self._running = set()
+        self._resumed = False
+
+    def _retry_delays(self):
+        delays = [self.backoff * 2 ** x for x in range(self.max_attempts - 1)]
+        limit = self.claim_timeout / 2
+        if sum(delays) > limit:
+            delays = [x * limit / sum(delays) for x in delays]
+        return delays
+
+    def _semaphore(self):
+        loop = asyncio.get_running_loop()
+        if loop not in self._semaphores:
+            self._semaphores[loop] = asyncio.Semaphore(self.concurrency)
+        return self._semaphores[loop]
+
+    async def _publish_task(self, interest, task_id, stored_file_id, filename):
+        semaphore = self._semaphore()
+        delays = self._retry_delays()
+        for attempt in range(self.max_attempts):
+            if attempt:
+                await asyncio.sleep(delays[attempt - 1])
+            async with semaphore:
+                logger.info(f"Publishing file {filename}")
+                try:
+                    await interest.upload_bucket.move(
+                        filename=filename,
+                        target_bucket=interest.publish_bucket_name,
+                        actual_user=None,
+                    )
+                except Exception as e:
+                    if _is_not_found(e) and _in_bucket(filename, interest.publish_bucket_name):
+                        logger.info(f"File {filename} was already published")
+                    else:
+                        retry = _is_retryable(e) and attempt + 1 < self.max_attempts
+                        logger.warning(f"Exception while publishing {filename} "
+                                       f"(attempt {attempt + 1}) : {e}")
+                        record_publish_attempt(id=task_id, status=None if retry else 'failed',
+                                               error=str(e))
+                        if not retry:
+                            return False
+                        continue
+            record_publish_attempt(id=task_id, status='done')
+            set_stored_file_published(stored_file_id=stored_file_id)
+            return True
+        return False
+
+    async def publish(self, interest, task_ids):
+        """
+        Run the given publish tasks of an interest to completion, or all
+        of them if ``task_ids`` is None. Tasks claimed by someone else are
+        skipped. Returns True if all the files this ran were published.
+        """
+        tasks = [(x.id, x.stored_file_id, x.stored_file.filename)
+                 for x in claim_publish_tasks(ids=task_ids, interest_id=interest.id,
+                                              stale_after=self.claim_timeout)]
+        results = await asyncio.gather(
+            *[self._publish_task(interest, *task) for task in tasks]
+        )
+        return all(results)
+
+    def schedule(self, interest, task_ids):
+        """
+        Start publishing without waiting for it to complete. On a running
+        event loop, this creates a task which the scheduler holds on to
+        until it finishes. Otherwise, publishing runs on its own event loop
+        in a background thread.
+        """
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+
+        if loop is None:
+            thread = threading.Thread(target=asyncio.run, daemon=True,
+                                      args=(self.publish(interest, task_ids),))
+            thread.start()
+            return thread
+
+        task = loop.create_task(self.publish(interest, task_ids))
+        self._running.add(task)
+        task.add_done_callback(self._done)
+        return task
+
+    def _done(self, task):
+        self._running.discard(task)
+        if not task.cancelled() and task.exception():
+            logger.error(f"Publishing failed with an unhandled exception : {task.exception()}")
+
+    async def resume(self, force=False):
+        """
+        Publish all files with pending or abandoned publish tasks, such as
+        those left over when the process was last stopped. This is only
+        done once per process unless ``force`` is set.
+        """
+        if self._resumed and not force:
+            return
+        self._resumed = True
+        interest_ids = get_interests_with_publish_tasks(stale_after=self.claim_timeout)
+        if interest_ids:
+            logger.info(f"Resuming incomplete publishing for {len(interest_ids)} interests")
+        for interest_id in interest_ids:
+            interest = get_interest(id=interest_id).actual
+            self.schedule(interest, None)
+
+
+publisher = PublishScheduler()
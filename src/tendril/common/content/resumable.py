@@ -0,0 +1,162 @@
+
+
+import os
+import json
+import time
+import fcntl
+from contextlib import contextmanager
+
+from tendril.config import MEDIA_PROCESSING_SPOOL_DIR
+from tendril.config import MEDIA_UPLOAD_RESUMABLE_EXPIRY
+
+from .ingest import StagedUpload
+from .exceptions import UploadNotFound
+from .exceptions import UploadConflict
+from .exceptions import UploadLengthExceeded
+
+from tendril.utils import log
+logger = log.get_logger(__name__, log.DEFAULT)
+
+
+class ResumableUploads(object):
+    """
+    Resumable, chunked uploads of media files, along the lines of the tus
+    protocol. Each upload is keyed by its ``mfu`` token.
+
+    An upload is created with its total length. Chunks are then appended
+    to a partial file in the ``partial`` folder of the processing spool,
+    each at the offset the client believes the upload to be at. The
+    current offset is simply the size of the partial file, so whatever
+    was received before a dropped connection is kept, and the client can
+    ask for the offset and carry on from there. Once the last byte lands,
+    the file is moved into the processing spool as a staged upload.
+    """
+    def __init__(self, path=MEDIA_PROCESSING_SPOOL_DIR, expiry=MEDIA_UPLOAD_RESUMABLE_EXPIRY):
+        self.path = path
+        self.expiry = expiry
+
+    def _folder(self):
+        folder = os.path.join(self.path, 'partial')
+        os.makedirs(folder, exist_ok=True)
+        return folder
+
+    def _state_path(self, token_id):
+        return os.path.join(self._folder(), f'{token_id}.json')
+
+    def _data_path(self, token_id):
+        return os.path.join(self._folder(), f'{token_id}.part')
+
+    def create(self, token_id, interest, filename, rename_to, length, user):
+        self.expire()
+        upload = {
+            'token_id': str(token_id),
+            'interest_id': interest.id,
+            'filename': filename,
+            'rename_to': rename_to,
+            'length': length,
+            'user_id': str(user.id),
+            'created_at': time.time(),
+        }
+        open(self._data_path(upload['token_id']), 'wb').close()
+        tmp_path = f"{self._state_path(upload['token_id'])}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(upload, f)
+        os.replace(tmp_path, self._state_path(upload['token_id']))
+        return upload
+
+    def get(self, token_id, interest, user):
+        """
+        Returns an upload, if it is open against the interest and was
+        created by the user. Uploads of other users are reported as not
+        found, like those which do not exist.
+        """
+        try:
+            with open(self._state_path(token_id), 'r') as f:
+                upload = json.load(f)
+        except FileNotFoundError:
+            raise UploadNotFound(token_id, 'add_artefact', interest.id, interest.name)
+        if upload['interest_id'] != interest.id or upload['user_id'] != str(user.id):
+            raise UploadNotFound(token_id, 'add_artefact', interest.id, interest.name)
+        return upload
+
+    def offset(self, upload):
+        return os.path.getsize(self._data_path(upload['token_id']))
+
+    @contextmanager
+    def lock(self, upload, interest):
+        """
+        Hold exclusive access to an upload while a chunk is written to it.
+        A concurrent request for the same upload is refused rather than
+        made to wait.
+        """
+        state_path = self._state_path(upload['token_id'])
+        try:
+            f = open(state_path, 'r')
+        except FileNotFoundError:
+            # Completed or expired since it was read.
+            raise UploadNotFound(upload['token_id'], 'add_artefact', interest.id, interest.name)
+        with f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                raise UploadConflict(upload['token_id'], "Another chunk is being written.",
+                                     'add_artefact', interest.id, interest.name)
+            if not os.path.exists(state_path):
+                raise UploadNotFound(upload['token_id'], 'add_artefact',
+                                     interest.id, interest.name)
+            try:
+                yield upload
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def check_offset(self, upload, offset, interest):
+        current = self.offset(upload)
+        if offset != current:
+            raise UploadConflict(upload['token_id'], f"The chunk is for offset {offset}, "
+                                                     f"but the upload is at offset {current}.",
+                                 'add_artefact', interest.id, interest.name)
+        return current
+
+    def append(self, upload, data, interest):
+        if self.offset(upload) + len(data) > upload['length']:
+            raise UploadLengthExceeded(upload['token_id'], upload['length'],
+                                       'add_artefact', interest.id, interest.name)
+        with open(self._data_path(upload['token_id']), 'ab') as f:
+            f.write(data)
+
+    def is_complete(self, upload):
+        return self.offset(upload) == upload['length']
+
+    def complete(self, upload, folder):
+        """
+        Move a complete upload into the given folder, and return it as a
+        staged upload.
+        """
+        ext = os.path.splitext(upload['filename'])[1]
+        path = os.path.join(folder, f"{upload['token_id']}{ext}")
+        os.replace(self._data_path(upload['token_id']), path)
+        os.remove(self._state_path(upload['token_id']))
+        return StagedUpload.from_path(path, upload['filename'])
+
+    def expire(self):
+        """
+        Discard incomplete uploads which have not received a chunk within
+        the expiry time.
+        """
+        cutoff = time.time() - self.expiry
+        for fname in os.listdir(self._folder()):
+            if not fname.endswith('.part'):
+                continue
+            token_id = fname[:-len('.part')]
+            data_path = self._data_path(token_id)
+            try:
+                if os.path.getmtime(data_path) > cutoff:
+                    continue
+                logger.info(f"Discarding expired resumable upload {token_id}")
+                os.remove(data_path)
+                os.remove(self._state_path(token_id))
+            except FileNotFoundError:
+                continue
+
+
+resumable = ResumableUploads()
@@ -0,0 +1,206 @@
+
+
+import os
+import warnings
+from typing import Tuple
+from typing import Union
+from concurrent.futures import ThreadPoolExecutor
+
+import av
+from PIL import Image
+from pdf2image import convert_from_bytes
+
+from tendril.config import MEDIA_VIDEO_EXTENSIONS
+from tendril.config import MEDIA_IMAGE_EXTENSIONS
+from tendril.config import MEDIA_DOCUMENT_EXTENSIONS
+from tendril.config import MEDIA_THUMBNAIL_SIZES
+from tendril.config import MEDIA_THUMBNAIL_BACKGROUND
+from tendril.config import MEDIA_THUMBNAIL_WORKERS
+from tendril.utils.parsers.media.base import MediaThumbnailGenerator
+
+from tendril.utils import log
+logger = log.get_logger(__name__, log.DEFAULT)
+
+
+_writer = MediaThumbnailGenerator()
+
+
+def _normalize_size(size: Union[int, Tuple[int, int]]):
+    if isinstance(size, int):
+        return (size, size), f'{size}'
+    return tuple(size), f'{size[0]}x{size[1]}'
+
+
+def thumbnail_box(size: Union[int, Tuple[int, int]]):
+    """
+    Returns the ``(width, height)`` bounding box of a thumbnail size as
+    specified in ``MEDIA_THUMBNAIL_SIZES``.
+    """
+    return _normalize_size(size)[0]
+
+
+def parse_thumbnail_size(spec: str):
+    """
+    Parses a thumbnail size in the form used in thumbnail listings, either
+    a single integer for square thumbnails or ``<width>x<height>``.
+    Returns ``None`` if the size is not understood.
+    """
+    try:
+        if 'x' in spec:
+            width, height = spec.split('x')
+            return int(width), int(height)
+        return int(spec)
+    except ValueError:
+        return None
+
+
+def _output_format(background):
+    if background and len(background) == 4 and background[3] < 255:
+        return 'png'
+    return 'jpg'
+
+
+def thumbnail_target(filename, size, background=MEDIA_THUMBNAIL_BACKGROUND):
+    """
+    Returns the bounding box and the output file name of the thumbnail of
+    the given size for a media file with the given name.
+    """
+    box, label = _normalize_size(size)
+    fname, fext = os.path.splitext(os.path.split(filename)[1])
+    return box, f'{fname}{fext.replace(".", "_")}_thumb_{label}.{_output_format(background)}'
+
+
+def _fit(source_size, box):
+    # The size PIL's Image.thumbnail() would produce for the given box,
+    # which never upscales and preserves the aspect ratio.
+    scale = min(box[0] / source_size[0], box[1] / source_size[1], 1)
+    return max(1, round(source_size[0] * scale)), max(1, round(source_size[1] * scale))
+
+
+def _decode_image(file, largest):
+    image = Image.open(file)
+    # For JPEGs, let the decoder do the bulk of the downscaling by
+    # decoding directly at a reduced DCT scale no smaller than the
+    # largest thumbnail. This is a no-op for other formats.
+    image.draft('RGB', largest)
+    image.load()
+    return image
+
+
+def _decode_video(file, largest):
+    file.seek(0)
+    container = av.open(file, 'r')
+    try:
+        duration = container.duration * 1e-6
+        thumb_frame_time = duration * 0.1
+        stream = container.streams.video[0]
+        stream.codec_context.skip_frame = "NONKEY"
+        for frame in container.decode(stream):
+            if frame.time > thumb_frame_time:
+                return frame.to_image()
+    finally:
+        container.close()
+        file.seek(0)
+    raise Exception("Something strange happened. No viable thumb frame found!")
+
+
+def _decode_document(file, largest):
+    file.seek(0)
+    # Rasterize the first page only at the resolution the largest
+    # thumbnail needs instead of at the default 200 DPI.
+    images = convert_from_bytes(file.read(), first_page=1, last_page=1,
+                                size=(largest[0], None))
+    file.seek(0)
+    return images[0]
+
+
+def _build_decoders():
+    rv = {}
+    for decoder, exts in [
+        (_decode_video, MEDIA_VIDEO_EXTENSIONS),
+        (_decode_image, MEDIA_IMAGE_EXTENSIONS),
+        (_decode_document, MEDIA_DOCUMENT_EXTENSIONS),
+    ]:
+        for ext in exts:
+            rv[ext] = decoder
+    return rv
+
+
+_decoders = _build_decoders()
+
+
+def build_pyramid(image, sizes):
+    """
+    Derive thumbnails for all the given boxes from a single decoded image.
+
+    Boxes are processed from the largest to the smallest, and each is
+    resized from the smallest intermediate already produced which still
+    covers it, falling back to the decoded source when the aspect ratios
+    of the boxes differ enough that no intermediate does.
+
+    Returns a dict of box to resized image.
+    """
+    rv = {}
+    intermediates = [image]
+    for box in sorted(set(sizes), key=lambda x: x[0] * x[1], reverse=True):
+        target = _fit(image.size, box)
+        base = image
+        for candidate in intermediates:
+            if candidate.size[0] >= target[0] and candidate.size[1] >= target[1]:
+                base = candidate
+        derived = base.copy()
+        derived.thumbnail(box)
+        rv[box] = derived
+        intermediates.append(derived)
+    return rv
+
+
+def generate_thumbnails(file, output_dir, filename=None,
+                        sizes=None, background=MEDIA_THUMBNAIL_BACKGROUND,
+                        workers=MEDIA_THUMBNAIL_WORKERS):
+    """
+    Generate thumbnails of all the configured sizes for a media file.
+
+    This is a drop-in replacement for
+    :func:`tendril.utils.parsers.media.thumbnails.generate_thumbnails`,
+    producing the same file names and returning the same list of
+    ``(size, path)`` tuples. The source is decoded exactly once, the
+    sizes are derived from it as a pyramid, and the thumbnails are
+    encoded and written in parallel.
+    """
+    if sizes is None:
+        sizes = MEDIA_THUMBNAIL_SIZES
+    if not filename:
+        filename = file.name
+
+    fext = os.path.splitext(filename)[1]
+
+    try:
+        decoder = _decoders[fext]
+    except KeyError:
+        warnings.warn(f"Generator for extension {fext} not installed. "
+                      f"No thumbnail will be generated.")
+        return []
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    targets = []
+    for size in sizes:
+        box, output_fname = thumbnail_target(filename, size, background=background)
+        targets.append((box, os.path.join(output_dir, output_fname)))
+
+    if not targets:
+        return []
+
+    largest = (max(x[0][0] for x in targets), max(x[0][1] for x in targets))
+    source = decoder(file, largest)
+    pyramid = build_pyramid(source, [x[0] for x in targets])
+
+    # Encoding is done by PIL's C codecs, which release the GIL, so
+    # threads get real parallelism here without having to ship the
+    # decoded bitmaps across process boundaries.
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(targets)))) as executor:
+        futures = [executor.submit(_writer.pack_and_write, box, output_path,
+                                   pyramid[box], background)
+                   for box, output_path in targets]
+        return [(box, future.result()) for (box, _), future in zip(targets, futures)]
@@ -24,7 +24,8 @@ from tendril.utils.config import ConfigOption
 from tendril.utils import log
 logger = log.get_logger(__name__, log.DEFAULT)
 
-depends = ['tendril.config.core']
+depends = ['tendril.config.core',
+           'tendril.config.paths']
 
 config_elements_media = [
     ConfigOption(
@@ -75,6 +76,44 @@ config_elements_media = [
         "(255,255,255) creates a letterbox effect with a white background. Provide RGBA "
         "colors such as (255,255,255, 0) instead if transparency is needed. "
     ),
+    ConfigOption(
+        'MEDIA_THUMBNAIL_WORKERS',
+        "4",
+        "The number of threads used to encode and write the thumbnails of a single "
+        "media file. The source is decoded only once, regardless of this setting."
+    ),
+    ConfigOption(
+        'MEDIA_THUMBNAIL_ON_DEMAND_SIZES',
+        "MEDIA_THUMBNAIL_SIZES",
+        "List of thumbnail sizes, in the same form as MEDIA_THUMBNAIL_SIZES, which any "
+        "user who can read a content may request. Thumbnails of these sizes are generated "
+        "the first time they are requested, if the format does not have them yet, and "
+        "stored for later use."
+    ),
+    ConfigOption(
+        'MEDIA_THUMBNAIL_ON_DEMAND_MAX',
+        "1024",
+        "The largest width or height of thumbnails which may be requested on demand. "
+        "Sizes not in MEDIA_THUMBNAIL_ON_DEMAND_SIZES are only generated for users "
+        "who can add artefacts to the content."
+    ),
+    ConfigOption(
+        'MEDIA_THUMBNAIL_BACKFILL_CONCURRENCY',
+        "2",
+        "The number of formats processed concurrently by the thumbnail backfill job."
+    ),
+    ConfigOption(
+        'MEDIA_DERIVATION_CACHE_DIR',
+        "os.path.join(INSTANCE_CACHE, 'media')",
+        "The folder in which derived artefacts of media files, such as media "
+        "information and thumbnails, are cached against the hash of the source file."
+    ),
+    ConfigOption(
+        'MEDIA_DERIVATION_CACHE_SIZE',
+        "512 * 1024 * 1024",
+        "The maximum size, in bytes, of the media derivation cache. The least "
+        "recently used entries are evicted once the cache grows beyond this size."
+    ),
     ConfigOption(
         'MEDIA_UPLOAD_FILESTORE_BUCKET',
         '"incoming"',
@@ -87,6 +126,138 @@ config_elements_media = [
         "The filestore bucket in which published media files are to be written Note that "
         "filestore will not have this bucket by default. You must create it or choose one "
         "that exists."
+    ),
+    ConfigOption(
+        'MEDIA_INGEST_CHUNK_SIZE',
+        "1024 * 1024",
+        "The chunk size, in bytes, used when staging uploaded media files. Uploads "
+        "are read once, in chunks of this size, and hashed while they are copied "
+        "to the local staging area."
+    ),
+    ConfigOption(
+        'MEDIA_UPLOAD_CONCURRENCY',
+        "4",
+        "The maximum number of files, such as generated thumbnails, uploaded to "
+        "the filestore concurrently while processing a single media file."
+    ),
+    ConfigOption(
+        'MEDIA_PROCESSING_MODE',
+        '"inprocess"',
+        "Where uploaded media files are processed. 'inprocess' runs the processing "
+        "dispatcher, and its pool of worker processes, alongside the API server. When "
+        "the API server has several worker processes, one of them runs the dispatcher "
+        "and the others take over if it exits. "
+        "'standalone' only queues jobs from the API server, and expects the dispatcher "
+        "to be run separately with 'python -m tendril.common.content.processing' on a "
+        "host which shares the spool directory."
+    ),
+    ConfigOption(
+        'MEDIA_PROCESSING_SPOOL_DIR',
+        "os.path.join(INSTANCE_CACHE, 'media_processing')",
+        "The spool directory holding queued media processing jobs and the uploaded "
+        "files they process. Jobs survive restarts of the API server and of the "
+        "dispatcher."
+    ),
+    ConfigOption(
+        'MEDIA_PROCESSING_WORKERS',
+        "2",
+        "The number of worker processes used to process uploaded media files."
+    ),
+    ConfigOption(
+        'MEDIA_PROCESSING_QUEUE_MAX',
+        "100",
+        "The maximum number of media processing jobs which may be queued or running "
+        "at once. Uploads beyond this are refused with HTTP 429."
+    ),
+    ConfigOption(
+        'MEDIA_PROCESSING_MAX_ATTEMPTS',
+        "3",
+        "The number of times a media processing job is started before it is given "
+        "up on. Jobs are only retried when their worker or the dispatcher died while "
+        "running them."
+    ),
+    ConfigOption(
+        'MEDIA_PROCESSING_POLL_INTERVAL',
+        "2",
+        "The interval, in seconds, at which the media processing dispatcher checks "
+        "the spool for new jobs when it is not otherwise woken up."
+    ),
+    ConfigOption(
+        'MEDIA_UPLOAD_RESUMABLE_EXPIRY',
+        "24 * 60 * 60",
+        "The time, in seconds, after its last chunk that an incomplete resumable media "
+        "upload is discarded."
+    ),
+    ConfigOption(
+        'MEDIA_UPLOAD_BATCH_CONCURRENCY',
+        "4",
+        "The maximum number of files of a batch upload staged into the media "
+        "processing spool concurrently."
+    ),
+    ConfigOption(
+        'MEDIA_PROCESSING_LANE_WEIGHTS',
+        "{'fast': 4, 'bulk': 1}",
+        "The relative share of media processing workers given to each processing lane "
+        "while more than one lane has jobs waiting. Small images go to the 'fast' lane, "
+        "everything else to the 'bulk' lane."
+    ),
+    ConfigOption(
+        'MEDIA_PROCESSING_FAST_LANE_MAX_SIZE',
+        "16 * 1024 * 1024",
+        "The largest image file, in bytes, which is processed in the 'fast' lane."
+    ),
+    ConfigOption(
+        'MEDIA_PROCESSING_FAIRNESS_KEY',
+        '"user"',
+        "Whose jobs are taken in turns within each media processing lane. One of "
+        "'user', for the uploading user, or 'interest', for the interest the media "
+        "is uploaded to."
+    ),
+    ConfigOption(
+        'MEDIA_PUBLISH_CONCURRENCY',
+        "4",
+        "The maximum number of media files moved to the publishing bucket concurrently."
+    ),
+    ConfigOption(
+        'MEDIA_PUBLISH_MAX_ATTEMPTS',
+        "5",
+        "The number of times publishing a media file is attempted before it is marked "
+        "as failed. Only network errors and server side filestore errors are retried."
+    ),
+    ConfigOption(
+        'MEDIA_PUBLISH_RETRY_BACKOFF',
+        "2",
+        "The delay, in seconds, before the first retry of a failed publish. The delay "
+        "doubles with every subsequent attempt."
+    ),
+    ConfigOption(
+        'MEDIA_PUBLISH_CLAIM_TIMEOUT',
+        "600",
+        "The time, in seconds, after its last attempt at which a media file being "
+        "published is assumed to have been abandoned, for instance by an API server "
+        "worker which exited, and may be claimed for publishing by another."
+    ),
+    ConfigOption(
+        'MEDIA_SEQUENCE_ORDERING',
+        '"dense"',
+        "The ordering mode used for newly created content sequences. 'dense' stores "
+        "the actual 0..N-1 position of each item, and every insert or removal "
+        "renumbers all later items. 'gapped' stores a sparse sortable rank instead, "
+        "so that inserts, moves and removals only write the affected item. Clients "
+        "always see dense positions, regardless of the mode."
+    ),
+    ConfigOption(
+        'MEDIA_SEQUENCE_RANK_SPACING',
+        "1024",
+        "The rank interval left between neighbouring items of 'gapped' sequences "
+        "when they are appended or rebalanced. Larger values allow more inserts "
+        "between two items before the sequence has to be rebalanced."
+    ),
+    ConfigOption(
+        'MEDIA_SEQUENCE_TIMELINE_CACHE_SIZE',
+        "256",
+        "The number of compiled sequence timelines to hold in memory. Timelines "
+        "are recompiled only when the revision of the sequence changes."
     )
 ]
 
@@ -1,15 +1,41 @@
 
 
+from sqlalchemy import or_
+from sqlalchemy import func
+from sqlalchemy import case
+from sqlalchemy import select
+from sqlalchemy import update
+from sqlalchemy import inspect
+from sqlalchemy.orm import lazyload
+from sqlalchemy.orm import selectinload
+from sqlalchemy.orm import with_polymorphic
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy.orm.exc import NoResultFound
 from tendril.utils.db import with_db
 
 from tendril.db.models.content import ContentModel
+from tendril.db.models.content import MediaContentModel
+from tendril.db.models.content import SequenceContentModel
+from tendril.db.models.content_formats import MediaContentFormatModel
 from tendril.db.models.content_formats import FileMediaContentFormatModel
+from tendril.db.models.content_formats import stored_file_sha256
 from tendril.db.models.content_thumbnails import MediaContentFormatThumbnailModel
 from tendril.db.models.content import SequenceContentAssociationModel
 from tendril.db.controllers.interests import get_interest
+from tendril.filestore.db.model import StoredFileModel
+from tendril.filestore.db.model import FilestoreBucketModel
 from tendril.filestore.db.controller import get_stored_file
 from tendril.structures.content import content_models
+from tendril.structures.content.timeline import timelines
+from tendril.structures.content.timeline import compile_timeline
+from tendril.config import MEDIA_SEQUENCE_RANK_SPACING
+from tendril.config import MEDIA_PUBLISHING_FILESTORE_BUCKET
+
+from tendril.utils import log
+logger = log.get_logger(__name__, log.DEFAULT)
+
+_max_rank = 2 ** 31 - 1
 
 
 def _type_discriminator(type):
@@ -22,24 +48,114 @@ def _type_discriminator(type):
     return qmodel
 
 
-@with_db
-def get_content(id=None, type=None, raise_if_none=True, session=None):
-    filters = []
-    qmodel = _type_discriminator(type)
-    filters.append(qmodel.id == id)
-    q = session.query(qmodel).filter(*filters)
+def _media_entity(entity):
+    # The part of a (polymorphic) content entity which has formats, if any.
+    cls = inspect(entity).mapper.class_
+    if issubclass(cls, MediaContentModel):
+        return entity
+    if issubclass(MediaContentModel, cls):
+        return entity.MediaContentModel
+    return None
+
+
+def _profile_summary(entity):
+    # Only the content itself, for listings and bookkeeping.
+    return [lazyload('*')]
+
+
+def _profile_export(entity):
+    # Everything touched by export(), down to the stored file buckets.
+    media = _media_entity(entity)
+    if media is None:
+        return []
+    format_entity = with_polymorphic(MediaContentFormatModel, '*')
+    formats = selectinload(media.formats.of_type(format_entity))
+    return [
+        formats.selectinload(format_entity.thumbnails)
+        .selectinload(MediaContentFormatThumbnailModel.stored_file)
+        .selectinload(StoredFileModel.bucket),
+        formats.selectinload(format_entity.FileMediaContentFormatModel.stored_file)
+        .selectinload(StoredFileModel.bucket),
+    ]
+
+
+def _profile_publish(entity):
+    # The published state of the formats and thumbnails, without any
+    # stored files.
+    media = _media_entity(entity)
+    if media is None:
+        return []
+    return [selectinload(media.formats).selectinload(MediaContentFormatModel.thumbnails)]
+
+
+content_load_profiles = {
+    'summary': _profile_summary,
+    'export': _profile_export,
+    'publish': _profile_publish,
+}
+
+
+def content_load_options(profile, entity=None):
+    """
+    Returns the loader options for a named loading profile, for use in
+    queries against the given content entity. If the entity is a base
+    class, it should be polymorphic over its subclasses.
+
+    Profiles :
+      - ``summary`` : only the content itself.
+      - ``export`` : formats, thumbnails, stored files and buckets, i.e.
+        everything content export touches. Nested sequences are loaded
+        with :func:`get_content_trees`, which uses this profile.
+      - ``publish`` : formats and thumbnails, for their published state.
+    """
+    if entity is None:
+        entity = with_polymorphic(ContentModel, '*')
     try:
-        return q.one()
-    except NoResultFound:
+        return content_load_profiles[profile](entity)
+    except KeyError:
+        raise ValueError(f"Unrecognized content loading profile '{profile}'. "
+                         f"Try one of {list(content_load_profiles.keys())}")
+
+
+@with_db
+def get_contents(ids=None, type=None, profile=None, with_interests=False, session=None):
+    """
+    Loads many content items, of any mix of content types, in a single
+    round trip along with whatever the loading ``profile`` asks for. The
+    content is returned in the order of ``ids``. Ids which do not exist,
+    or which are not of the given type, are left out.
+
+    If ``with_interests`` is set, the interest model of each content is
+    loaded as well.
+    """
+    ids = list(ids)
+    if not ids:
+        return []
+    entity = with_polymorphic(_type_discriminator(type), '*')
+    options = content_load_options(profile, entity) if profile else []
+    if with_interests:
+        options.extend([selectinload(entity.advertisement),
+                        selectinload(entity.device_content)])
+    found = {x.id: x for x in session.scalars(
+        select(entity).where(entity.id.in_(set(ids))).options(*options)
+    )}
+    return [found[x] for x in ids if x in found]
+
+
+@with_db
+def get_content(id=None, type=None, profile=None, raise_if_none=True, session=None):
+    rv = get_contents(ids=[id], type=type, profile=profile, session=session)
+    if not rv:
         if raise_if_none:
-            raise
+            raise NoResultFound
         return None
+    return rv[0]
 
 
 @with_db
 def create_content(id=None, type=None, session=None, **kwargs):
     try:
-        existing = get_content(id=id, session=session)
+        existing = get_content(id=id, profile='summary', session=session)
     except NoResultFound:
         pass
     else:
@@ -52,18 +168,53 @@ def create_content(id=None, type=None, session=None, **kwargs):
     return content
 
 
+@with_db
+def burn_fidx(counts=None, session=None):
+    """
+    Reserve file indices on many content containers in a single statement.
+    ``counts`` maps content ids to the number of indices needed for each.
+    Returns a dict mapping each content id to the list of its reserved
+    indices.
+    """
+    if not counts:
+        return {}
+    stmt = update(MediaContentModel)\
+        .where(MediaContentModel.id.in_(counts))\
+        .values(fidx=MediaContentModel.fidx + case(counts, value=MediaContentModel.id, else_=0))\
+        .returning(MediaContentModel.id, MediaContentModel.fidx)\
+        .execution_options(synchronize_session=False)
+    rv = {id: list(range(fidx - counts[id], fidx)) for id, fidx in session.execute(stmt)}
+    for instance in list(session.identity_map.values()):
+        if isinstance(instance, MediaContentModel):
+            session.expire(instance, ['fidx'])
+    return rv
+
+
 @with_db
 def create_content_format_thumbnail(id=None, stored_file_id=None,
-                                    width=None, height=None, session=None):
+                                    width=None, height=None, published=False, session=None):
+    # A format has at most one thumbnail of each size. If one was created
+    # concurrently, it is returned instead, and the new file is left unused.
     try:
         thumbnail_instance = MediaContentFormatThumbnailModel(
             format_id=id,
             width=width,
             height=height,
-            stored_file_id=stored_file_id
+            stored_file_id=stored_file_id,
+            published=published
         )
-        session.add(thumbnail_instance)
-        session.flush()
+        try:
+            with session.begin_nested():
+                session.add(thumbnail_instance)
+        except IntegrityError:
+            logger.warning(f"Format {id} already has a {width}x{height} thumbnail. "
+                           f"Not using stored file {stored_file_id}.")
+            return session.query(MediaContentFormatThumbnailModel)\
+                .filter_by(format_id=id, width=width, height=height).one()
+        format_instance = session.get(MediaContentFormatModel, id)
+        if format_instance is None:
+            raise NoResultFound
+        get_content(id=format_instance.content_id, session=session).propagate_change()
         return thumbnail_instance
     except NoResultFound:
         raise ValueError(f"Could not find a content format "
@@ -73,36 +224,205 @@ def create_content_format_thumbnail(id=None, stored_file_id=None,
 @with_db
 def create_content_format_file(id=None, stored_file_id=None,
                                width=None, height=None, duration=None,
-                               info=None, session=None):
+                               info=None, published=False, session=None):
     try:
-        _ = get_content(id=id, type='media', session=session)
+        content = get_content(id=id, type='media', session=session)
         format_instance = FileMediaContentFormatModel(
             stored_file_id=stored_file_id,
             content_id=id,
             width=width,
             height=height,
             duration=duration,
-            info=info
+            info=info,
+            published=published
         )
+        content.published = content.published and published
         session.add(format_instance)
         session.flush()
+        session.expire(content, ['formats'])
+        content.propagate_change()
         return format_instance
     except NoResultFound:
         raise ValueError(f"Could not find a {type} content file "
                          f"container with the provided id {id}")
 
 
+@with_db
+def create_content_format_reference(id=None, format_id=None, info=None, session=None):
+    # Formats with identical files share the stored file and thumbnails of
+    # the format which first introduced them instead of storing copies.
+    # Everything else about the upload, such as its filename, is its own
+    # and is provided by the caller in info.
+    source = session.query(FileMediaContentFormatModel).filter(
+        FileMediaContentFormatModel.id == format_id).one()
+    format_instance = create_content_format_file(
+        id=id, stored_file_id=source.stored_file_id,
+        width=source.width, height=source.height,
+        duration=source.duration, info=info,
+        published=source.published, session=session
+    )
+    for thumbnail in source.thumbnails:
+        create_content_format_thumbnail(
+            id=format_instance.id, stored_file_id=thumbnail.stored_file_id,
+            width=thumbnail.width, height=thumbnail.height,
+            published=thumbnail.published, session=session
+        )
+    session.expire(format_instance, ['thumbnails'])
+    return format_instance
+
+
+def _content_refresh_published(content_ids, session):
+    # Content is published when none of its file formats are unpublished.
+    unpublished = select(FileMediaContentFormatModel.id).where(
+        FileMediaContentFormatModel.content_id == ContentModel.id,
+        FileMediaContentFormatModel.published.is_(False),
+    ).exists()
+    session.execute(
+        update(ContentModel)
+        .where(ContentModel.id.in_(content_ids))
+        .values(published=~unpublished)
+        .execution_options(synchronize_session=False)
+    )
+    for instance in list(session.identity_map.values()):
+        if isinstance(instance, ContentModel):
+            session.expire(instance, ['published'])
+
+
+@with_db
+def set_stored_file_published(stored_file_id=None, session=None):
+    """
+    Mark the formats and thumbnails backed by a stored file as published,
+    and update the published state of the content they belong to.
+    """
+    format_ids = select(FileMediaContentFormatModel.id)\
+        .where(FileMediaContentFormatModel.stored_file_id == stored_file_id)
+    session.execute(
+        update(MediaContentFormatModel)
+        .where(MediaContentFormatModel.id.in_(format_ids))
+        .values(published=True)
+        .execution_options(synchronize_session=False)
+    )
+    session.execute(
+        update(MediaContentFormatThumbnailModel)
+        .where(MediaContentFormatThumbnailModel.stored_file_id == stored_file_id)
+        .values(published=True)
+        .execution_options(synchronize_session=False)
+    )
+    thumbnail_format_ids = select(MediaContentFormatThumbnailModel.format_id)\
+        .where(MediaContentFormatThumbnailModel.stored_file_id == stored_file_id)
+    content_ids = select(MediaContentFormatModel.content_id)\
+        .where(MediaContentFormatModel.id.in_(format_ids) |
+               MediaContentFormatModel.id.in_(thumbnail_format_ids))
+    _content_refresh_published(content_ids, session)
+    for instance in list(session.identity_map.values()):
+        if isinstance(instance, (MediaContentFormatModel, MediaContentFormatThumbnailModel)):
+            session.expire(instance, ['published'])
+    for content in get_contents(ids=session.scalars(content_ids).all(), session=session):
+        content.propagate_change()
+
+
+@with_db
+def sync_published_state(bucket=MEDIA_PUBLISHING_FILESTORE_BUCKET, session=None):
+    """
+    Recompute the published state of all formats, thumbnails and content
+    from the bucket their stored files are actually in. This is only needed
+    to initialize the published state of content which predates it.
+    """
+    published_files = select(StoredFileModel.id)\
+        .join(FilestoreBucketModel, StoredFileModel.bucket_id == FilestoreBucketModel.id)\
+        .where(FilestoreBucketModel.name == bucket)
+    published_formats = select(FileMediaContentFormatModel.id)\
+        .where(FileMediaContentFormatModel.stored_file_id.in_(published_files))
+    session.execute(
+        update(MediaContentFormatModel)
+        .where(MediaContentFormatModel.format_class == FileMediaContentFormatModel.format_class_name)
+        .values(published=MediaContentFormatModel.id.in_(published_formats))
+        .execution_options(synchronize_session=False)
+    )
+    session.execute(
+        update(MediaContentFormatThumbnailModel)
+        .values(published=MediaContentFormatThumbnailModel.stored_file_id.in_(published_files))
+        .execution_options(synchronize_session=False)
+    )
+    _content_refresh_published(select(ContentModel.id), session)
+    session.expire_all()
+
+
+@with_db
+def get_unpublished_contents(type=None, profile='publish', session=None):
+    qmodel = with_polymorphic(_type_discriminator(type), '*')
+    return session.query(qmodel)\
+        .options(*content_load_options(profile, qmodel))\
+        .filter(qmodel.published.is_(False)).all()
+
+
+@with_db
+def get_unpublished_stored_files(content_id=None, session=None):
+    """
+    Returns the ids of the stored files of a content, both of its formats
+    and of their thumbnails, which are not yet published.
+    """
+    formats = select(FileMediaContentFormatModel.stored_file_id)\
+        .where(FileMediaContentFormatModel.content_id == content_id,
+               FileMediaContentFormatModel.published.is_(False))
+    thumbnails = select(MediaContentFormatThumbnailModel.stored_file_id)\
+        .join(MediaContentFormatModel, MediaContentFormatThumbnailModel.format_id == MediaContentFormatModel.id)\
+        .where(MediaContentFormatModel.content_id == content_id,
+               MediaContentFormatThumbnailModel.published.is_(False))
+    return session.execute(formats.union(thumbnails)).scalars().all()
+
+
+@with_db
+def get_content_format(id=None, session=None):
+    q = session.query(MediaContentFormatModel).filter(MediaContentFormatModel.id == id)
+    return q.one()
+
+
+@with_db
+def get_formats_missing_thumbnails(sizes=None, after_id=None, limit=None, session=None):
+    # Keyset paginated over the format id, so that long running callers
+    # can walk the whole library in batches and resume from any point.
+    missing = [~select(MediaContentFormatThumbnailModel.id).where(
+        MediaContentFormatThumbnailModel.format_id == FileMediaContentFormatModel.id,
+        MediaContentFormatThumbnailModel.width == width,
+        MediaContentFormatThumbnailModel.height == height,
+    ).exists() for width, height in sizes]
+    q = session.query(FileMediaContentFormatModel).filter(or_(*missing))
+    if after_id is not None:
+        q = q.filter(FileMediaContentFormatModel.id > after_id)
+    q = q.order_by(FileMediaContentFormatModel.id)
+    if limit:
+        q = q.limit(limit)
+    return q.all()
+
+
 @with_db
 def get_format_by_stored_file(stored_file_id=None, raise_if_none=True, session=None):
+    # Deduplicated formats share stored files. The format which first
+    # introduced the file is returned.
     filters = []
     filters.append(FileMediaContentFormatModel.stored_file_id == stored_file_id)
     q = session.query(FileMediaContentFormatModel).filter(*filters)
-    try:
-        return q.one()
-    except NoResultFound:
-        if raise_if_none:
-            raise
-        return None
+    rv = q.order_by(FileMediaContentFormatModel.id).first()
+    if rv is None and raise_if_none:
+        raise NoResultFound
+    return rv
+
+
+@with_db
+def get_format_by_hash(sha256=None, content_id=None, session=None):
+    """
+    Returns the first file media format whose stored file has the given
+    hash. Formats of the content with the given ``content_id`` are
+    preferred over those of other contents, which callers must check
+    access to before using.
+    """
+    own = case((FileMediaContentFormatModel.content_id == content_id, 0), else_=1)
+    return session.query(FileMediaContentFormatModel)\
+        .join(StoredFileModel, FileMediaContentFormatModel.stored_file_id == StoredFileModel.id)\
+        .filter(stored_file_sha256 == sha256)\
+        .order_by(own, FileMediaContentFormatModel.id)\
+        .first()
 
 
 @with_db
@@ -117,55 +437,270 @@ def get_content_by_filename(filename=None, content_type=None, bucket=None, sessi
     return get_content(id=format.content_id, type=content_type, session=session)
 
 
-@with_db
-def sequence_next_position(id=None, session=None):
+def _sequence_evict_associations(id, session):
+    # The position is part of the association's primary key. Instances
+    # loaded before a bulk renumbering are keyed on stale identities, so
+    # they are dropped from the session and reloaded on next access.
+    for instance in list(session.identity_map.values()):
+        if isinstance(instance, SequenceContentAssociationModel):
+            if instance.sequence_id == id:
+                session.expunge(instance)
+            continue
+        if isinstance(instance, SequenceContentModel) and instance.id == id:
+            session.expire(instance, ['contents'])
+        if isinstance(instance, ContentModel) and 'sequence_usages' in instance.__dict__:
+            session.expire(instance, ['sequence_usages'])
+
+
+def _sequence_settle_positions(id, session=None):
+    # Renumbering is done in two statements to stay clear of the
+    # (sequence_id, position) primary key. Rows are first parked at
+    # -1 - target, which cannot collide with any live position, and
+    # are then moved to their targets here.
+    session.execute(
+        update(SequenceContentAssociationModel)
+        .where(SequenceContentAssociationModel.sequence_id == id,
+               SequenceContentAssociationModel.position < 0)
+        .values(position=-1 - SequenceContentAssociationModel.position)
+        .execution_options(synchronize_session=False)
+    )
+    _sequence_evict_associations(id, session)
+
+
+def _sequence_shift_positions(id, start, offset, session=None):
+    # Moves every association at or after start by offset using a single
+    # statement, rather than stepping through the rows one at a time.
+    session.flush()
+    session.execute(
+        update(SequenceContentAssociationModel)
+        .where(SequenceContentAssociationModel.sequence_id == id,
+               SequenceContentAssociationModel.position >= start)
+        .values(position=-1 - (SequenceContentAssociationModel.position + offset))
+        .execution_options(synchronize_session=False)
+    )
+    _sequence_settle_positions(id, session=session)
+
+
+def _sequence_changed(id, members=(), session=None):
+    # Members are given as (duration, content_id, sign) for each item
+    # added (sign 1) or removed (sign -1), so that the estimate of the
+    # sequence is moved by their share of it instead of recomputed.
+    sequence = _get_sequence(id, session=session)
+    delta = sum(sign * sequence.member_estimate(
+                    duration, session.get(ContentModel, content_id).estimated_duration())
+                for duration, content_id, sign in members)
+    sequence.propagate_change(delta=delta)
+
+
+def _sequence_renumber_positions(id, first, step, session=None):
+    session.flush()
+    ranked = select(
+        SequenceContentAssociationModel.position,
+        (func.row_number().over(order_by=SequenceContentAssociationModel.position) - 1).label('idx')
+    ).where(SequenceContentAssociationModel.sequence_id == id).subquery()
+    target = first + ranked.c.idx * step
+    session.execute(
+        update(SequenceContentAssociationModel)
+        .where(SequenceContentAssociationModel.sequence_id == id,
+               SequenceContentAssociationModel.position == ranked.c.position,
+               SequenceContentAssociationModel.position != target)
+        .values(position=-1 - target)
+        .execution_options(synchronize_session=False)
+    )
+    _sequence_settle_positions(id, session=session)
+
+
+def _get_sequence(id, session=None):
     try:
-        sequence = get_content(id=id, type='sequence', session=session)
-        return max([x.position for x in sequence.contents], default=-1) + 1
+        return get_content(id=id, type='sequence', profile='summary', session=session)
     except NoResultFound:
         raise ValueError(f"Could not find a 'sequence' content "
                          f"container with the provided id {id}")
 
 
+@with_db
+def sequence_rebalance_positions(id=None, session=None):
+    _sequence_renumber_positions(id, MEDIA_SEQUENCE_RANK_SPACING,
+                                 MEDIA_SEQUENCE_RANK_SPACING, session=session)
+
+
+def _sequence_gapped_rank(id, position=None, session=None, _rebalanced=False):
+    # Finds a rank which would place an item at the provided dense
+    # position of a gapped sequence, without touching any other item.
+    # The sequence is only rebalanced when no such rank is available.
+    filters = [SequenceContentAssociationModel.sequence_id == id]
+    q = select(SequenceContentAssociationModel.position)\
+        .where(*filters).order_by(SequenceContentAssociationModel.position)
+
+    if position is None:
+        bounds = []
+    elif position > 0:
+        bounds = session.scalars(q.offset(position - 1).limit(2)).all()
+    else:
+        bounds = [-1] + session.scalars(q.limit(1)).all()
+
+    if len(bounds) == 2:
+        lower, upper = bounds
+        if upper - lower > 1:
+            return (lower + upper) // 2
+    else:
+        last = session.scalar(select(func.max(SequenceContentAssociationModel.position)).where(*filters))
+        if last is None:
+            return MEDIA_SEQUENCE_RANK_SPACING
+        if last + MEDIA_SEQUENCE_RANK_SPACING <= _max_rank:
+            return last + MEDIA_SEQUENCE_RANK_SPACING
+
+    if _rebalanced:
+        raise ValueError(f"Could not find a free rank in sequence {id} "
+                         f"even after rebalancing.")
+    sequence_rebalance_positions(id=id, session=session)
+    return _sequence_gapped_rank(id, position, session=session, _rebalanced=True)
+
+
+@with_db
+def sequence_next_position(id=None, session=None):
+    sequence = _get_sequence(id, session=session)
+    if sequence.ordering == 'gapped':
+        return _sequence_gapped_rank(id, session=session)
+    last = session.scalar(select(func.max(SequenceContentAssociationModel.position))
+                          .where(SequenceContentAssociationModel.sequence_id == id))
+    return 0 if last is None else last + 1
+
+
 @with_db
 def sequence_get_at_position(id, position, session=None):
-    try:
-        sequence = get_content(id=id, type='sequence', session=session)
-        for x in sequence.contents:
-            if x.position == position:
-                return x
-    except NoResultFound:
-        raise ValueError(f"Could not find a 'sequence' content "
-                         f"container with the provided id {id}")
+    sequence = _get_sequence(id, session=session)
+    q = select(SequenceContentAssociationModel) \
+        .where(SequenceContentAssociationModel.sequence_id == id)
+    if sequence.ordering == 'gapped':
+        if position < 0:
+            return None
+        q = q.order_by(SequenceContentAssociationModel.position).offset(position).limit(1)
+    else:
+        q = q.where(SequenceContentAssociationModel.position == position)
+    return session.scalars(q).first()
 
 
 @with_db
 def sequence_prep_position(id, position, session=None):
-    existing = sequence_get_at_position(id, position, session=session)
-    if not existing:
-        return
-    sequence_prep_position(id, position + 1, session=session)
-    existing.position = position + 1
+    _sequence_shift_positions(id, position, 1, session=session)
+
+
+@with_db
+def get_content_trees(ids=None, with_interests=False, session=None):
+    """
+    Loads the given content along with every sequence nested within any
+    of them, their member content, formats, thumbnails and stored files.
+    The number of queries is fixed, and does not depend on the number of
+    content items or on the depth or size of the trees. The returned
+    content can be exported without further loads.
+
+    If ``with_interests`` is set, the interest model of every node is
+    loaded as well.
+
+    Returns a dictionary of the loaded content keyed by id. Ids which do
+    not exist are left out.
+    """
+    ids = set(ids)
+    if not ids:
+        return {}
     session.flush()
 
+    # Walk the trees in the database. UNION rather than UNION ALL, so
+    # that a sequence nested within itself does not recurse forever.
+    tree = select(SequenceContentAssociationModel.sequence_id,
+                  SequenceContentAssociationModel.content_id)\
+        .where(SequenceContentAssociationModel.sequence_id.in_(ids))\
+        .cte('sequence_tree', recursive=True)
+    tree = tree.union(
+        select(SequenceContentAssociationModel.sequence_id,
+               SequenceContentAssociationModel.content_id)
+        .join(tree, SequenceContentAssociationModel.sequence_id == tree.c.content_id)
+    )
+    content_ids = set(session.scalars(select(tree.c.content_id)).all())
+    content_ids.update(ids)
+
+    # Bulk load every node, with everything its export touches.
+    contents = get_contents(ids=content_ids, profile='export',
+                            with_interests=with_interests, session=session)
+
+    # Hydrate the contents of every sequence node from a single query.
+    sequence_ids = [x.id for x in contents if isinstance(x, SequenceContentModel)]
+    nodes = {x.id: x for x in contents}
+    if sequence_ids:
+        associations = session.scalars(
+            select(SequenceContentAssociationModel)
+            .where(SequenceContentAssociationModel.sequence_id.in_(sequence_ids))
+            .order_by(SequenceContentAssociationModel.sequence_id,
+                      SequenceContentAssociationModel.position)
+            .options(lazyload(SequenceContentAssociationModel.content),
+                     lazyload(SequenceContentAssociationModel.sequence))
+        ).all()
+        members = {x: [] for x in sequence_ids}
+        for association in associations:
+            set_committed_value(association, 'sequence', nodes[association.sequence_id])
+            set_committed_value(association, 'content', nodes[association.content_id])
+            members[association.sequence_id].append(association)
+        for node_id in sequence_ids:
+            set_committed_value(nodes[node_id], 'contents', members[node_id])
+    return {x: nodes[x] for x in ids if x in nodes}
+
+
 @with_db
-def sequence_get_contents(id, session=None):
-    try:
-        sequence = get_content(id=id, type='sequence', session=session)
-    except NoResultFound:
-        raise ValueError(f"Could not find a 'sequence' content "
-                         f"container with the provided id {id}")
+def sequence_get_tree(id, with_interests=False, session=None):
+    """
+    Loads a sequence along with every sequence nested within it, their
+    member content, formats, thumbnails and stored files. See
+    :func:`get_content_trees`.
+    """
+    sequence = _get_sequence(id, session=session)
+    get_content_trees(ids=[id], with_interests=with_interests, session=session)
+    return sequence
+
+
+@with_db
+def sequence_member_interests(id=None, session=None):
+    """
+    Returns the interest models of the direct members of a sequence,
+    without loading anything else about the member content.
+    """
+    member_ids = select(SequenceContentAssociationModel.content_id)\
+        .where(SequenceContentAssociationModel.sequence_id == id)
+    q = session.query(ContentModel).options(
+        lazyload('*'),
+        selectinload(ContentModel.advertisement),
+        selectinload(ContentModel.device_content),
+    ).filter(ContentModel.id.in_(member_ids))
+    return [x.interest for x in q if x.interest is not None]
+
+
+@with_db
+def sequence_get_timeline(id, session=None):
+    sequence = _get_sequence(id, session=session)
+    timeline = timelines.get(id, sequence.revision)
+    if timeline is None:
+        timeline = compile_timeline(sequence_get_tree(id, session=session))
+        timelines.put(timeline)
+    return timeline
+
+
+@with_db
+def sequence_get_contents(id, with_interests=False, session=None):
+    sequence = sequence_get_tree(id, with_interests=with_interests, session=session)
     return [{
-        'position': c.position,
+        'position': idx,
         'duration': c.duration,
         'content': c.content,
-    } for c in sequence.contents]
+    } for idx, c in enumerate(sequence.contents)]
 
 
 @with_db
 def sequence_add_content(id, content, position=None, duration=None, session=None):
     content_id = content
-    if position is None:
+    sequence = _get_sequence(id, session=session)
+    if sequence.ordering == 'gapped':
+        position = _sequence_gapped_rank(id, position, session=session)
+    elif position is None:
         position = sequence_next_position(id=id, session=session)
     else:
         sequence_prep_position(id, position, session=session)
@@ -176,7 +711,10 @@ def sequence_add_content(id, content, position=None, duration=None, session=None
                                                   position=position,
                                                   duration=duration)
     session.add(association)
-    session.commit()
+    session.flush()
+    _sequence_evict_associations(id, session)
+    _sequence_changed(id, [(duration, content_id, 1)], session=session)
+    return association
 
 
 @with_db
@@ -185,30 +723,63 @@ def sequence_remove_content(id, position, session=None):
     if not assn:
         raise ValueError(f"Sequence does not seem to have any "
                          f"content at position {position}.")
+    sequence = assn.sequence
+    content_id, duration, rank = assn.content_id, assn.duration, assn.position
     session.delete(assn)
-    session.commit()
+    if sequence.ordering == 'gapped':
+        session.flush()
+        _sequence_evict_associations(id, session)
+    else:
+        # Close the gap immediately so that positions remain valid
+        # for any further edits within the same transaction.
+        _sequence_shift_positions(id, rank + 1, -1, session=session)
+    _sequence_changed(id, [(duration, content_id, -1)], session=session)
+    return content_id, duration
+
+
+@with_db
+def sequence_move_content(id, position, to_position, session=None):
+    # A move is a removal followed by an insert. In gapped sequences
+    # this only ever writes the moved item.
+    content_id, duration = sequence_remove_content(id, position, session=session)
+    return sequence_add_content(id, content_id, position=to_position,
+                                duration=duration, session=session)
 
 
 @with_db
-def sequence_pull_back_position(id, position, to_position, session=None):
+def sequence_set_content_duration(id, position, duration=None, session=None):
     assn = sequence_get_at_position(id=id, position=position, session=session)
     if not assn:
-        sequence_pull_back_position(id, position + 1, to_position, session=session)
-    else:
-        assn.position = to_position
-        session.commit()
+        raise ValueError(f"Sequence does not seem to have any "
+                         f"content at position {position}.")
+    members = [(assn.duration, assn.content_id, -1), (duration, assn.content_id, 1)]
+    assn.duration = duration
+    session.flush()
+    _sequence_changed(id, members, session=session)
+    return assn
 
 
 @with_db
 def sequence_heal_positions(id=None, session=None):
-    try:
-        sequence = get_content(id=id, type='sequence', session=session)
-        session.expire(sequence)
-        if not len(sequence.contents):
-            return
-        for position in range(len(sequence.contents)):
-            if not sequence_get_at_position(id=id, position=position, session=session):
-                sequence_pull_back_position(id=id, position=position + 1, to_position=position, session=session)
-    except NoResultFound:
-        raise ValueError(f"Could not find a 'sequence' content "
-                         f"container with the provided id {id}")
+    sequence = _get_sequence(id, session=session)
+    if sequence.ordering == 'gapped':
+        # Gaps are intentional here, and ranks are only ever
+        # rebalanced when an insert runs out of room.
+        return
+    _sequence_renumber_positions(id, 0, 1, session=session)
+
+
+@with_db
+def sequence_set_ordering(id=None, ordering='dense', session=None):
+    if ordering not in ('dense', 'gapped'):
+        raise ValueError(f"Unrecognized sequence ordering {ordering}. "
+                         f"Expecting one of 'dense' or 'gapped'.")
+    sequence = _get_sequence(id, session=session)
+    if sequence.ordering == ordering:
+        return sequence
+    sequence.ordering = ordering
+    if ordering == 'gapped':
+        sequence_rebalance_positions(id=id, session=session)
+    else:
+        _sequence_renumber_positions(id, 0, 1, session=session)
+    return sequence
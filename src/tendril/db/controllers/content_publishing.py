@@ -0,0 +1,109 @@
+
+
+import arrow
+from sqlalchemy import or_
+from sqlalchemy import and_
+from sqlalchemy import select
+from sqlalchemy import update
+from tendril.utils.db import with_db
+
+from tendril.db.models.content_publishing import ContentPublishTaskModel
+
+
+@with_db
+def create_publish_tasks(interest_id=None, stored_file_ids=None, session=None):
+    """
+    Create, or reset to pending if they failed, the publish tasks of the
+    given stored files of an interest. Returns the ids of the tasks.
+    Tasks which are done or being run are left as they are.
+    """
+    existing = {x.stored_file_id: x for x in session.execute(
+        select(ContentPublishTaskModel).where(
+            ContentPublishTaskModel.interest_id == interest_id,
+            ContentPublishTaskModel.stored_file_id.in_(stored_file_ids))
+    ).scalars()}
+    rv = []
+    for stored_file_id in stored_file_ids:
+        task = existing.get(stored_file_id)
+        if task is None:
+            task = ContentPublishTaskModel(interest_id=interest_id,
+                                           stored_file_id=stored_file_id)
+            session.add(task)
+        elif task.status == 'failed':
+            task.status = 'pending'
+            task.attempts = 0
+            task.error = None
+        rv.append(task)
+    session.flush()
+    return [x.id for x in rv]
+
+
+@with_db
+def get_publish_tasks(ids=None, interest_id=None, status=None, session=None):
+    stmt = select(ContentPublishTaskModel)
+    if ids is not None:
+        stmt = stmt.where(ContentPublishTaskModel.id.in_(ids))
+    if interest_id is not None:
+        stmt = stmt.where(ContentPublishTaskModel.interest_id == interest_id)
+    if status is not None:
+        stmt = stmt.where(ContentPublishTaskModel.status == status)
+    return session.execute(stmt.order_by(ContentPublishTaskModel.id)).scalars().all()
+
+
+def _claimable(stale_after=None):
+    clause = ContentPublishTaskModel.status == 'pending'
+    if stale_after is not None:
+        cutoff = arrow.utcnow().shift(seconds=-stale_after)
+        clause = or_(clause, and_(ContentPublishTaskModel.status == 'running',
+                                  ContentPublishTaskModel.updated_at < cutoff))
+    return clause
+
+
+@with_db
+def get_interests_with_publish_tasks(stale_after=None, session=None):
+    """
+    Returns the ids of the interests with publish tasks which can be
+    claimed, see :func:`claim_publish_tasks`.
+    """
+    stmt = select(ContentPublishTaskModel.interest_id)\
+        .where(_claimable(stale_after))\
+        .distinct()
+    return session.execute(stmt).scalars().all()
+
+
+@with_db
+def claim_publish_tasks(ids=None, interest_id=None, stale_after=None, session=None):
+    """
+    Mark the pending publish tasks among those given as running, and
+    return them. If ``stale_after`` is given, tasks which have been
+    running without an attempt for that many seconds are claimed as well.
+
+    Each task is claimed by a single update, so when several processes
+    claim the same tasks at once, each task goes to only one of them.
+    """
+    stmt = update(ContentPublishTaskModel).where(_claimable(stale_after))
+    if ids is not None:
+        stmt = stmt.where(ContentPublishTaskModel.id.in_(ids))
+    if interest_id is not None:
+        stmt = stmt.where(ContentPublishTaskModel.interest_id == interest_id)
+    stmt = stmt.values(status='running', updated_at=arrow.utcnow())\
+        .returning(ContentPublishTaskModel.id)\
+        .execution_options(synchronize_session=False)
+    claimed = session.execute(stmt).scalars().all()
+    if not claimed:
+        return []
+    return get_publish_tasks(ids=claimed, session=session)
+
+
+@with_db
+def record_publish_attempt(id=None, status=None, error=None, session=None):
+    task = session.get(ContentPublishTaskModel, id)
+    if task.status == 'done':
+        # Published by someone else in the meantime.
+        return task
+    task.attempts += 1
+    if status:
+        task.status = status
+    task.error = error
+    session.flush()
+    return task
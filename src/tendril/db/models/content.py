@@ -7,7 +7,10 @@ from typing import Optional
 from sqlalchemy import Column
 from sqlalchemy import String
 from sqlalchemy import Integer
+from sqlalchemy import Boolean
+from sqlalchemy import true
 from sqlalchemy import ForeignKey
+from sqlalchemy import inspect
 from sqlalchemy.orm import Mapped
 from sqlalchemy.orm import mapped_column
 from sqlalchemy.orm import relationship
@@ -20,6 +23,7 @@ from tendril.utils.db import DeclBase
 from tendril.utils.db import BaseMixin
 from tendril.utils.db import TimestampMixin
 from tendril.utils.pydantic import TendrilTBaseModel
+from tendril.config import MEDIA_SEQUENCE_ORDERING
 from .content_formats import MediaContentFormatModel
 from .content_formats import ThumbnailListingTModel
 from .content_formats import MediaContentFormatInfoTModel
@@ -65,6 +69,11 @@ class ContentModel(DeclBase, BaseMixin, TimestampMixin):
     allows_actual_media = False
 
     bg_color = Column(String(20))
+    duration_estimate = Column(Integer, nullable=True)
+    revision = Column(Integer, nullable=False, default=0, server_default='0')
+    # True once all the files of the content are in the publishing bucket.
+    # Maintained by the publishing pipeline.
+    published = Column(Boolean, nullable=False, default=True, server_default=true(), index=True)
 
     # TODO device_content and advertisement are instance specific.
     #  These need to be moved into sxm-core somehow.
@@ -98,8 +107,55 @@ class ContentModel(DeclBase, BaseMixin, TimestampMixin):
         return False
 
     def estimated_duration(self):
+        # The estimate is materialized and kept current by propagate_change().
+        # Content which predates the column is filled in on first read.
+        if self.duration_estimate is None:
+            self.duration_estimate = self._compute_estimated_duration()
+        return self.duration_estimate
+
+    def _compute_estimated_duration(self):
         return None
 
+    def propagate_change(self, delta=None, _path=frozenset()):
+        """
+        Update derived state of this content after a change to it, and
+        push the change up to every sequence which uses it.
+
+        If the caller knows by how much the change moved the estimated
+        duration, it is applied as ``delta``. Otherwise the estimate is
+        recomputed. Sequences above are always given a delta, worked out
+        from the old and new estimates of this content, so that they do
+        not walk all their members for a change to one of them.
+        """
+        if self.id in _path:
+            return
+        _path = _path | {self.id}
+        if inspect(self).persistent:
+            # Incremented by the database when flushed, so that concurrent
+            # changes to the same content each produce a new revision.
+            self.revision = ContentModel.revision + 1
+        else:
+            self.revision = (self.revision or 0) + 1
+        old = self.duration_estimate
+        if delta is not None and old is not None:
+            self.duration_estimate = old + delta
+        else:
+            self.duration_estimate = self._compute_estimated_duration()
+
+        parents, deltas = {}, {}
+        for usage in self.sequence_usages:
+            parent = usage.sequence
+            parents[parent.id] = parent
+            if old is None or self.duration_estimate is None or \
+                    parent.id in deltas and deltas[parent.id] is None:
+                deltas[parent.id] = None
+                continue
+            deltas[parent.id] = deltas.get(parent.id, 0) + \
+                parent.member_estimate(usage.duration, self.duration_estimate) - \
+                parent.member_estimate(usage.duration, old)
+        for parent_id, parent in parents.items():
+            parent.propagate_change(delta=deltas[parent_id], _path=_path)
+
 
 class MediaContentModel(ContentModel):
     type_name = 'media'
@@ -108,9 +164,12 @@ class MediaContentModel(ContentModel):
     allows_actual_media = True
     fidx = Column(Integer, default=0, nullable=False)
 
+    # Formats, thumbnails and their stored files are loaded lazily by
+    # default. Call sites which need them eagerly pass one of the loader
+    # profiles in tendril.db.controllers.content.
     @declared_attr
     def formats(cls):
-        return relationship(MediaContentFormatModel, back_populates="content", lazy="selectin")
+        return relationship(MediaContentFormatModel, back_populates="content", lazy="select")
 
     __mapper_args__ = {
         "polymorphic_identity": type_name
@@ -125,7 +184,7 @@ class MediaContentModel(ContentModel):
                 break
         return rv
 
-    def estimated_duration(self):
+    def _compute_estimated_duration(self):
         durations = [x.duration for x in self.formats]
         simple_durations = [x for x in durations if x > 0]
         step_durations = [x for x in durations if x < 0]
@@ -161,7 +220,7 @@ class StructuredContentModel(ContentModel):
             rv['args'] = self.args
         return rv
 
-    def estimated_duration(self):
+    def _compute_estimated_duration(self):
         return None
 
     def is_usable(self):
@@ -175,6 +234,9 @@ class SequenceContentModel(ContentModel):
 
     id = Column(Integer, ForeignKey("Content.id"), primary_key=True)
     default_duration = Column(Integer, nullable=False, default=10)
+    # Sequences which predate the ordering modes are dense.
+    ordering = Column(String(16), nullable=False, default=MEDIA_SEQUENCE_ORDERING,
+                      server_default='dense')
 
     contents: Mapped[List["SequenceContentAssociationModel"]] = \
         relationship(order_by="SequenceContentAssociationModel.position")
@@ -186,17 +248,25 @@ class SequenceContentModel(ContentModel):
     def export(self, full=False, explicit_durations_only=False):
         rv = super(SequenceContentModel, self).export(full=full, explicit_durations_only=explicit_durations_only)
         rv['default_duration'] = self.default_duration
-        rv['contents'] = [x.export(full=full, explicit_durations_only=explicit_durations_only) for x in self.contents]
+        rv['contents'] = [x.export(full=full, explicit_durations_only=explicit_durations_only, position=idx)
+                          for idx, x in enumerate(self.contents)]
         return rv
 
-    def estimated_duration(self):
-        durations = [x.duration or x.content.estimated_duration() for x in self.contents]
-        actual_durations = []
-        for duration in durations:
-            if duration < 0:
-                duration = self.default_duration * -1 * duration
-            actual_durations.append(duration)
-        return sum(actual_durations) + len(durations)
+    def member_estimate(self, duration, content_estimate):
+        """
+        The share of the estimated duration of this sequence taken by a
+        member with the given duration, or, if it has none, with the
+        given estimated duration of its content.
+        """
+        duration = duration or content_estimate
+        if duration < 0:
+            duration = self.default_duration * -1 * duration
+        # Every item is allowed an extra second.
+        return duration + 1
+
+    def _compute_estimated_duration(self):
+        return sum(self.member_estimate(x.duration, x.content.estimated_duration())
+                   for x in self.contents)
 
     def is_usable(self):
         return len(self.contents) > 0 and all([x.content.is_usable() for x in self.contents])
@@ -211,9 +281,13 @@ class SequenceContentAssociationModel(DeclBase):
     sequence: Mapped[SequenceContentModel] = relationship(back_populates="contents", foreign_keys=[sequence_id], lazy='selectin')
     content: Mapped[ContentModel] = relationship(back_populates="sequence_usages", foreign_keys=[content_id], lazy='joined')
 
-    def export(self, full=False, explicit_durations_only=False):
+    def export(self, full=False, explicit_durations_only=False, position=None):
+        # In gapped sequences, the stored position is a sparse rank. The
+        # sequence provides the dense position when exporting.
+        if position is None:
+            position = self.position
         return {
-            'position': self.position,
+            'position': position,
             'duration': self.duration,
             'content': self.content.export(full=full)
         }
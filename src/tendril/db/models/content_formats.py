@@ -3,9 +3,12 @@
 from typing import Any
 from typing import Dict
 from typing import Optional
+from sqlalchemy import Index
 from sqlalchemy import Column
 from sqlalchemy import String
 from sqlalchemy import Integer
+from sqlalchemy import false
+from sqlalchemy import Boolean
 from sqlalchemy import ForeignKey
 from sqlalchemy.orm import Mapped
 from sqlalchemy.orm import mapped_column
@@ -55,16 +58,17 @@ class MediaContentFormatModel(DeclBase, BaseMixin, TimestampMixin):
     height = Column(Integer, nullable=True)
     duration = Column(Integer, nullable=True)
     info = Column(mutable_json_type(dbtype=JSONB, nested=True), default={})
+    published = Column(Boolean, nullable=False, default=False, server_default=false(), index=True)
 
     @declared_attr
     def content(cls):
         return relationship('MediaContentModel',
-                            back_populates="formats", lazy="selectin")
+                            back_populates="formats", lazy="select")
 
     @declared_attr
     def thumbnails(cls):
         return relationship('MediaContentFormatThumbnailModel',
-                            back_populates='format', lazy='selectin')
+                            back_populates='format', lazy='select')
 
     def export_thumbnails(self):
         rv = {}
@@ -83,6 +87,7 @@ class MediaContentFormatModel(DeclBase, BaseMixin, TimestampMixin):
                 rv['info'] = self.info
         if full:
             rv['thumbnails'] = self.export_thumbnails()
+            rv['published'] = self.published
         return rv
 
     def estimated_duration(self):
@@ -104,6 +109,11 @@ class ExternalPublishedMediaContentFormatModel(MediaContentFormatModel):
     id = Column(Integer, ForeignKey("MediaContentFormat.id"), primary_key=True)
     uri = Column(String, nullable=False)
 
+    def __init__(self, **kwargs):
+        # External formats are published by definition.
+        kwargs.setdefault('published', True)
+        super(ExternalPublishedMediaContentFormatModel, self).__init__(**kwargs)
+
     def export(self, full=False):
         rv = super(ExternalPublishedMediaContentFormatModel, self).export(full=full)
         rv['uri'] = self.uri
@@ -121,7 +131,7 @@ class FileMediaContentFormatModel(MediaContentFormatModel):
 
     @declared_attr
     def stored_file(cls):
-        return relationship(StoredFileModel, lazy="selectin")
+        return relationship(StoredFileModel, lazy="select")
 
     def export(self, full=False):
         rv = super(FileMediaContentFormatModel, self).export(full=full)
@@ -132,3 +142,10 @@ class FileMediaContentFormatModel(MediaContentFormatModel):
     __mapper_args__ = {
         "polymorphic_identity": format_class_name,
     }
+
+
+# Formats are deduplicated by the hash of their stored file, see
+# get_format_by_hash(). Queries must use this same expression to be
+# covered by the index.
+stored_file_sha256 = StoredFileModel.fileinfo[('hash', 'sha256')].as_string()
+Index('StoredFile_sha256_idx', stored_file_sha256)
@@ -0,0 +1,44 @@
+
+
+from sqlalchemy import Column
+from sqlalchemy import String
+from sqlalchemy import Integer
+from sqlalchemy import ForeignKey
+from sqlalchemy import UniqueConstraint
+from sqlalchemy.orm import Mapped
+from sqlalchemy.orm import mapped_column
+from sqlalchemy.orm import declared_attr
+from sqlalchemy.orm import relationship
+
+from tendril.filestore.db.model import StoredFileModel
+from tendril.utils.db import DeclBase
+from tendril.utils.db import BaseMixin
+from tendril.utils.db import TimestampMixin
+
+from tendril.utils import log
+logger = log.get_logger(__name__, log.DEFAULT)
+
+
+class ContentPublishTaskModel(DeclBase, BaseMixin, TimestampMixin):
+    """
+    Tracks the publication of a single stored file of a content interest,
+    i.e., its move from the upload bucket to the publishing bucket, so
+    that publishing survives failures and restarts.
+
+    ``status`` is one of ``pending``, ``running``, ``done`` or ``failed``.
+    A task is ``running`` while a publisher has claimed it, and its
+    ``updated_at`` is refreshed on every attempt.
+    """
+    interest_id: Mapped[int] = mapped_column(ForeignKey('Interest.id'), nullable=False)
+    stored_file_id: Mapped[int] = mapped_column(ForeignKey("StoredFile.id"), nullable=False)
+    status = Column(String(16), nullable=False, default='pending')
+    attempts = Column(Integer, nullable=False, default=0)
+    error = Column(String, nullable=True)
+
+    @declared_attr
+    def stored_file(cls):
+        return relationship(StoredFileModel, lazy="selectin")
+
+    __table_args__ = (
+        UniqueConstraint('interest_id', 'stored_file_id'),
+    )
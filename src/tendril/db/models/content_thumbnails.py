@@ -2,7 +2,10 @@
 
 from sqlalchemy import Column
 from sqlalchemy import Integer
+from sqlalchemy import false
+from sqlalchemy import Boolean
 from sqlalchemy import ForeignKey
+from sqlalchemy import UniqueConstraint
 from sqlalchemy.orm import Mapped
 from sqlalchemy.orm import mapped_column
 from sqlalchemy.orm import declared_attr
@@ -22,14 +25,19 @@ class MediaContentFormatThumbnailModel(DeclBase, BaseMixin, TimestampMixin):
     format_id: Mapped[int] = mapped_column(ForeignKey('MediaContentFormat.id'), nullable=False)
     width = Column(Integer, nullable=False)
     height = Column(Integer, nullable=False)
+    published = Column(Boolean, nullable=False, default=False, server_default=false(), index=True)
 
     @declared_attr
     def format(cls):
-        return relationship('MediaContentFormatModel', back_populates="thumbnails", lazy="selectin")
+        return relationship('MediaContentFormatModel', back_populates="thumbnails", lazy="select")
 
     def export(self, full=False):
         return {f'{self.width}x{self.height}': self.stored_file.expose_uri}
 
     @declared_attr
     def stored_file(cls):
-        return relationship(StoredFileModel, lazy="selectin")
+        return relationship(StoredFileModel, lazy="select")
+
+    __table_args__ = (
+        UniqueConstraint('format_id', 'width', 'height'),
+    )
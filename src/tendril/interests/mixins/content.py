@@ -1,10 +1,16 @@
 
 
 import os
+import shutil
+import hashlib
+import tempfile
 import asyncio
 from asgiref.sync import async_to_sync
+from sqlalchemy import event
+from sqlalchemy import inspect
 
 from httpx import HTTPStatusError
+from tendril.utils.www import async_client
 
 from tendril.db.controllers.interests import get_interest
 from tendril.common.content.exceptions import ContentTypeMismatchError
@@ -12,6 +18,9 @@ from tendril.common.content.exceptions import ContentTypeMismatchError
 from tendril.filestore import buckets
 from tendril.config import MEDIA_UPLOAD_FILESTORE_BUCKET
 from tendril.config import MEDIA_PUBLISHING_FILESTORE_BUCKET
+from tendril.config import MEDIA_UPLOAD_CONCURRENCY
+from tendril.config import MEDIA_THUMBNAIL_ON_DEMAND_SIZES
+from tendril.config import MEDIA_THUMBNAIL_ON_DEMAND_MAX
 
 from tendril.interests.base import InterestBase
 from tendril.common.states import LifecycleStatus
@@ -23,20 +32,38 @@ from tendril.caching.tokens import TokenStatus
 
 from tendril.structures.content import content_types
 from tendril.db.models.content import ContentModel
+from tendril.db.controllers.content import get_content
+from tendril.db.controllers.content import get_content_trees
 from tendril.db.controllers.content import create_content
 from tendril.db.controllers.content import create_content_format_file
 from tendril.db.controllers.content import create_content_format_thumbnail
+from tendril.db.controllers.content import create_content_format_reference
+from tendril.db.controllers.content import get_format_by_hash
+from tendril.db.controllers.content import get_content_format
+from tendril.db.controllers.content import get_unpublished_stored_files
 from tendril.db.controllers.content import sequence_next_position
 from tendril.db.controllers.content import sequence_heal_positions
 from tendril.db.controllers.content import sequence_get_contents
+from tendril.db.controllers.content import sequence_get_timeline
+from tendril.db.controllers.content import sequence_member_interests
 from tendril.db.controllers.content import sequence_add_content
 from tendril.db.controllers.content import sequence_remove_content
+from tendril.db.controllers.content import sequence_move_content
+from tendril.db.controllers.content import sequence_set_content_duration
 from tendril.common.content.exceptions import ContentNotReady
+from tendril.common.content.publishing import publisher
+from tendril.db.controllers.content_publishing import create_publish_tasks
+from tendril.common.content.exceptions import FormatNotFound
+from tendril.common.content.exceptions import ThumbnailSizeUnsupported
+from tendril.common.content.exceptions import ThumbnailNotAvailable
 from tendril.common.interests.representations import rewrap_interest
 from tendril.common.interests.representations import ExportLevel
 
-from tendril.utils.parsers.media.info import get_media_info
-from tendril.utils.parsers.media.thumbnails import generate_thumbnails
+from tendril.common.content.ingest import StagedUpload
+from tendril.common.content.derivations import cached_media_info
+from tendril.common.content.derivations import cached_thumbnails
+from tendril.common.content.thumbnails import thumbnail_box
+from tendril.common.content.thumbnails import parse_thumbnail_size
 
 from tendril.utils.fsutils import TEMPDIR
 from tendril.utils.db import with_db
@@ -105,50 +132,63 @@ class MediaContentInterest(InterestBase):
         if not self.model_instance.status == LifecycleStatus.ACTIVE:
             return result, msg
 
-        publishable = self.publishable()
+        task_ids = self._queue_publish(self.publishable())
 
         if background_tasks:
-            background_tasks.add_task(self._publish_files, publishable)
+            background_tasks.add_task(publisher.publish, self, task_ids)
         else:
-            asyncio.ensure_future(self._publish_files(publishable))
+            publisher.schedule(self, task_ids)
         return result, msg
 
-    async def _publish_files(self, stored_files):
-        for stored_file in stored_files:
-            logger.info(f"Publishing file {stored_file.filename}")
-            try:
-                upload_response = await self.upload_bucket.move(
-                    filename=stored_file.filename,
-                    target_bucket=self.publish_bucket_name,
-                    actual_user=None,
-                )
-            except HTTPStatusError as e:
-                self._report_filestore_error(None, e, "Publishing media file")
-                continue
+    def _queue_publish(self, stored_file_ids):
+        # Publish tasks are committed in their own transaction so that they
+        # are visible to the publisher, which runs independently of the
+        # session of the caller.
+        return create_publish_tasks(interest_id=self.id,
+                                    stored_file_ids=stored_file_ids)
+
+    async def _publish_files(self, stored_file_ids):
+        task_ids = self._queue_publish(stored_file_ids)
+        return await publisher.publish(self, task_ids)
 
     def publishable(self):
-        content = self.model_instance.content
-        rv = []
-        if hasattr(content, "formats"):
-            for fmt in self.model_instance.content.formats:
-                if hasattr(fmt, 'stored_file'):
-                    if fmt.stored_file.bucket.name == self.upload_bucket_name:
-                        rv.append(fmt.stored_file)
-                for thumbnail in fmt.thumbnails:
-                    if thumbnail.stored_file.bucket.name == self.upload_bucket_name:
-                        rv.append(thumbnail.stored_file)
-        return rv
+        # Returns the ids of the stored files which are yet to be published.
+        return get_unpublished_stored_files(content_id=self.model_instance.content_id)
 
     def published(self):
         if self.status != LifecycleStatus.ACTIVE:
             return False
-        content = self.model_instance.content
-        if hasattr(content, "formats"):
-            for fmt in self.model_instance.content.formats:
-                if hasattr(fmt, 'stored_file'):
-                    if fmt.stored_file.bucket.name != self.publish_bucket_name:
-                        return False
-        return True
+        return self.model_instance.content.published
+
+    @staticmethod
+    def _etag(*parts):
+        h = hashlib.sha1()
+        for part in parts:
+            h.update(f'{part};'.encode())
+        return f'W/"{h.hexdigest()}"'
+
+    @with_db
+    @require_state((LifecycleStatus.ACTIVE, LifecycleStatus.APPROVAL, LifecycleStatus.NEW))
+    @require_permission('read_artefacts', strip_auth=False, required=False)
+    def content_etag(self, full=False, auth_user=None, session=None):
+        """
+        Returns an ETag for the output of :meth:`content_information`. It
+        changes whenever the content, anything it contains, or this
+        interest changes, and is computed without exporting anything.
+        """
+        content: ContentModel = self._model_instance.content
+        if not content:
+            raise ContentNotReady('read_content_info', self.id, self.name)
+        return self._etag('content_info', full, content.id, content.revision,
+                          self.status, self.model_instance.updated_at)
+
+    def _content_for_export(self, session=None):
+        content: ContentModel = self._model_instance.content
+        unloaded = inspect(content).unloaded
+        if 'contents' in unloaded or 'formats' in unloaded:
+            # Unless the tree was already loaded, e.g. by a bulk read.
+            content = get_content_trees(ids=[content.id], session=session)[content.id]
+        return content
 
     @with_db
     @require_state((LifecycleStatus.ACTIVE, LifecycleStatus.APPROVAL, LifecycleStatus.NEW))
@@ -157,12 +197,9 @@ class MediaContentInterest(InterestBase):
         if not self._model_instance.content:
             raise ContentNotReady('read_content_info', self.id, self.name)
         else:
-            content: ContentModel = self._model_instance.content
+            content = self._content_for_export(session=session)
             rv = content.export(full=full)
             if full:
-                if 'formats' in rv.keys():
-                    for fmt_info in rv['formats']:
-                        fmt_info['published'] = self.format_published(fmt_info['format_id'])
                 rv['published'] = self.published()
             return rv
 
@@ -223,29 +260,115 @@ class MediaContentInterest(InterestBase):
                        }
             )
 
+    async def _upload_files(self, files, actual_user=None, concurrency=MEDIA_UPLOAD_CONCURRENCY):
+        """
+        Upload a list of ``(target_path, local_path)`` pairs to the upload
+        bucket concurrently, with at most ``concurrency`` uploads in flight,
+        over a single shared HTTP client.
+
+        Returns the filestore response for each file, in order. Failed
+        uploads are returned as the exception they raised, so that the
+        caller can decide what to do with partial failures.
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def _upload(client, target, fpath):
+            async with semaphore:
+                with open(fpath, 'rb') as f:
+                    return await self.upload_bucket.upload(
+                        file=(target, f), actual_user=actual_user,
+                        interest=self.id, client=client
+                    )
+
+        client_args = {}
+        if hasattr(self.upload_bucket, '_async_http_client_args'):
+            client_args = self.upload_bucket._async_http_client_args()
+        async with async_client(**client_args) as client:
+            return await asyncio.gather(
+                *[_upload(client, target, fpath) for target, fpath in files],
+                return_exceptions=True
+            )
+
     @with_db
     @require_state((LifecycleStatus.NEW))
     @require_permission('add_artefact', strip_auth=False)
     def add_format(self, file, rename_to=None, token_id=None, auth_user=None, session=None):
+        if token_id:
+            tokens.update(self.token_namespace, token_id,
+                          state=TokenStatus.INPROGRESS, max=7,
+                          current="Staging Media File")
+
+        # 0. Stage the upload. It is hashed in a single pass, and all
+        #    subsequent steps rewind and read the upload itself.
+        if isinstance(file, StagedUpload):
+            return self._add_format(file, rename_to=rename_to, token_id=token_id,
+                                    auth_user=auth_user, session=session)
+
+        staged = StagedUpload.from_file(file.file, filename=file.filename)
+        try:
+            return self._add_format(staged, rename_to=rename_to, token_id=token_id,
+                                    auth_user=auth_user, session=session)
+        finally:
+            staged.cleanup()
+
+    def _can_reuse_format(self, fmt, auth_user=None, session=None):
+        # A format is only reused if the user could read it anyway, so that
+        # uploading a file does not reveal content of other interests. When
+        # the user is not known, only formats of this interest are reused.
+        if fmt.content_id == self.model_instance.content_id:
+            return True
+        if auth_user is None:
+            return False
+        interest_model = fmt.content.interest
+        if interest_model is None:
+            return False
+        return rewrap_interest(interest_model).check_user_access(
+            auth_user, 'read_artefacts', session=session)
+
+    def _add_format(self, file: StagedUpload, rename_to=None, token_id=None, auth_user=None, session=None):
+        # If a file with identical content has already been ingested, reuse
+        # its stored file, media information and thumbnails by reference.
+        existing = get_format_by_hash(sha256=file.sha256,
+                                      content_id=self.model_instance.content_id,
+                                      session=session)
+        if existing and self._can_reuse_format(existing, auth_user=auth_user, session=session):
+            logger.info(f"Media file {file.filename} for {self.id} duplicates "
+                        f"format {existing.id}. Reusing it.")
+            media_info = cached_media_info(file.file, file.sha256,
+                                           filename=rename_to or file.filename,
+                                           original_filename=file.filename)
+            format_model_instance = create_content_format_reference(
+                id=self.model_instance.content_id, format_id=existing.id,
+                info=media_info.asdict(), session=session
+            )
+            if token_id:
+                tokens.update(self.token_namespace, token_id,
+                              current="Finishing", done=7,
+                              metadata={'format_id': format_model_instance.id,
+                                        'duplicate_of': existing.id})
+            tokens.close(self.token_namespace, token_id)
+            return
+
         storage_folder = f'{self.id}'
+        user_id = auth_user.id if hasattr(auth_user, 'id') else auth_user
         if token_id:
             tokens.update(self.token_namespace, token_id,
-                          state=TokenStatus.INPROGRESS, max=6,
-                          current="Parsing Media Information")
+                          current="Parsing Media Information", done=1)
 
         # 1. Parse Media Information
         filename = rename_to or file.filename
-        media_info = get_media_info(file.file, filename=filename, original_filename=file.filename)
+        media_info = cached_media_info(file.file, file.sha256, filename=filename,
+                                       original_filename=file.filename)
 
         if token_id:
             tokens.update(self.token_namespace, token_id,
-                          current="Uploading Media File to Filestore", done=1)
+                          current="Uploading Media File to Filestore", done=2)
 
         # 2. Upload File to Bucket
         try:
             upload_response = async_to_sync(self.upload_bucket.upload)(
                 file=(os.path.join(storage_folder, filename), file.file),
-                actual_user=auth_user.id, interest=self.id
+                actual_user=user_id, interest=self.id
             )
         except HTTPStatusError as e:
             self._report_filestore_error(token_id, e, "uploading media file to bucket")
@@ -253,37 +376,46 @@ class MediaContentInterest(InterestBase):
 
         if token_id:
             tokens.update(self.token_namespace, token_id,
-                          current="Generating Thumbnails", done=2)
+                          current="Generating Thumbnails", done=3)
 
         # 3. Generate Thumbnails
 
         thumbnail_folder = os.path.join(TEMPDIR, os.path.splitext(filename)[0])
         os.makedirs(thumbnail_folder, exist_ok=True)
-        generated_thumbnails = generate_thumbnails(file.file, thumbnail_folder, filename=filename)
+        generated_thumbnails = cached_thumbnails(file.file, file.sha256, thumbnail_folder, filename=filename)
 
         if token_id:
             tokens.update(self.token_namespace, token_id,
-                          current="Uploading Thumbnails to Filestore", done=3)
+                          current="Uploading Thumbnails to Filestore", done=4)
 
         # 4. Upload Thumbnails to Bucket
 
+        try:
+            results = async_to_sync(self._upload_files)(
+                [(os.path.join(storage_folder, os.path.split(fpath)[1]), fpath)
+                 for _, fpath in generated_thumbnails],
+                actual_user=user_id
+            )
+        finally:
+            shutil.rmtree(thumbnail_folder, ignore_errors=True)
+
         published_thumbnails = []
-        for tsize, fpath in generated_thumbnails:
+        failed_thumbnails = []
+        for (tsize, fpath), result in zip(generated_thumbnails, results):
             fname = os.path.split(fpath)[1]
-            with open(fpath, 'rb') as thumb_file:
-                try:
-                    response = async_to_sync(self.upload_bucket.upload)(
-                        file=(os.path.join(storage_folder, fname), thumb_file),
-                        actual_user=auth_user.id, interest=self.id
-                    )
-                except HTTPStatusError as e:
-                    self._report_filestore_error(token_id, e, "uploading thumbnail to bucket")
-                    return
-            published_thumbnails.append((tsize, fname, response))
+            if isinstance(result, Exception):
+                logger.warning(f"Exception while uploading thumbnail {fname} to bucket : {result}")
+                failed_thumbnails.append({'filename': fname, 'error': str(result)})
+                continue
+            published_thumbnails.append((tsize, fname, result))
+
+        if failed_thumbnails and token_id:
+            tokens.update(self.token_namespace, token_id,
+                          metadata={'failed_thumbnails': failed_thumbnails})
 
         if token_id:
             tokens.update(self.token_namespace, token_id,
-                          current="Registering Media Format", done=4)
+                          current="Registering Media Format", done=5)
 
         # 5. Create Format DB Entry
 
@@ -298,7 +430,7 @@ class MediaContentInterest(InterestBase):
 
         if token_id:
             tokens.update(self.token_namespace, token_id,
-                          current="Registering Media Format Thumbnails", done=5,
+                          current="Registering Media Format Thumbnails", done=6,
                           metadata={'format_id': format_model_instance.id})
 
         # 6. Create Thumbnail DB Entries
@@ -311,33 +443,130 @@ class MediaContentInterest(InterestBase):
             )
 
         if token_id:
-            tokens.update(self.token_namespace, token_id, current="Finishing", done=6)
+            tokens.update(self.token_namespace, token_id, current="Finishing", done=7)
 
         # 7. Close Upload Ticket
         tokens.close(self.token_namespace, token_id)
 
-    def get_format(self, format_id):
-        formats = self.model_instance.content.formats
-        for candidate in formats:
+    @with_db
+    def get_format(self, format_id, profile='export', session=None):
+        content = get_content(id=self.model_instance.content_id, profile=profile, session=session)
+        for candidate in content.formats:
             if candidate.id == format_id:
                 return candidate
 
-    def format_published(self, format_id):
-        fmt = self.get_format(format_id)
-        if hasattr(fmt, 'stored_file'):
-            if fmt.stored_file.bucket.name != self.publish_bucket_name:
-                return False
-        return True
+    def format_published(self, format_id, session=None):
+        return self.get_format(format_id, profile='publish', session=session).published
 
     @with_db
     @require_state((LifecycleStatus.ACTIVE, LifecycleStatus.APPROVAL, LifecycleStatus.NEW))
     @require_permission('read_artefacts', strip_auth=False)
     def format_information(self, format_id, full=False, auth_user=None, session=None):
-        fmt = self.get_format(format_id)
-        rv = fmt.export(full=full)
-        if full:
-            rv['published'] = self.format_published(format_id)
-        return rv
+        fmt = self.get_format(format_id, session=session)
+        return fmt.export(full=full)
+
+    def _generate_format_thumbnails(self, format_id, sizes, session=None):
+        """
+        Generate thumbnails of the given sizes which a format does not
+        already have, working from its stored file, and register them
+        against the format. Thumbnails of active interests are queued for
+        publishing once the session is committed. Formats without a stored
+        file, such as external formats, are left as they are.
+
+        The format is not locked while the thumbnails are downloaded,
+        rendered and uploaded. If a concurrent request registers a
+        thumbnail of the same size first, the unique constraint on the
+        thumbnails keeps that one, and the file generated here is left
+        unused.
+
+        This is not protected by any permission checks. It is used by
+        :meth:`format_thumbnail` once it has authorized the request, and by
+        the thumbnail backfill job.
+        """
+        fmt = get_content_format(id=format_id, session=session)
+        stored_file = getattr(fmt, 'stored_file', None)
+        if stored_file is None:
+            return fmt
+        existing = {(x.width, x.height) for x in fmt.thumbnails}
+        targets = [x for x in sizes if thumbnail_box(x) not in existing]
+        if not targets:
+            return fmt
+
+        filename = os.path.split(stored_file.filename)[1]
+        staged = async_to_sync(StagedUpload.from_uri)(stored_file.expose_uri, filename)
+        thumbnail_folder = tempfile.mkdtemp(dir=TEMPDIR)
+        try:
+            sha256 = (stored_file.fileinfo or {}).get('hash', {}).get('sha256') or staged.sha256
+            generated = cached_thumbnails(staged.file, sha256, thumbnail_folder,
+                                          filename=filename, sizes=targets)
+            results = async_to_sync(self._upload_files)(
+                [(os.path.join(f'{self.id}', os.path.split(fpath)[1]), fpath)
+                 for _, fpath in generated]
+            )
+        finally:
+            staged.cleanup()
+            shutil.rmtree(thumbnail_folder, ignore_errors=True)
+
+        created = []
+        for (tsize, fpath), result in zip(generated, results):
+            if isinstance(result, Exception):
+                logger.warning(f"Exception while uploading thumbnail {fpath} "
+                               f"for format {format_id} to bucket : {result}")
+                continue
+            thumbnail = create_content_format_thumbnail(
+                id=fmt.id, stored_file_id=result['storedfileid'],
+                width=tsize[0], height=tsize[1], session=session
+            )
+            if thumbnail.stored_file_id == result['storedfileid']:
+                created.append(thumbnail.stored_file_id)
+
+        session.expire(fmt, ['thumbnails'])
+        if created and self.model_instance.status == LifecycleStatus.ACTIVE:
+            self._publish_after_commit(created, session=session)
+        return fmt
+
+    def _publish_after_commit(self, stored_file_ids, session=None):
+        # The publisher marks files as published from its own session, so
+        # it is only started once the rows which refer to them are visible.
+        # The publish tasks are committed right away, and are picked up on
+        # the next resume if the session is rolled back instead.
+        task_ids = self._queue_publish(stored_file_ids)
+        event.listen(session, 'after_commit',
+                     lambda _: publisher.schedule(self, task_ids), once=True)
+
+    def _thumbnail_size_allowed(self, box, auth_user=None, session=None):
+        if box in {thumbnail_box(x) for x in MEDIA_THUMBNAIL_ON_DEMAND_SIZES}:
+            return True
+        return self.check_user_access(auth_user, 'add_artefact', session=session)
+
+    @with_db
+    @require_state((LifecycleStatus.ACTIVE, LifecycleStatus.APPROVAL, LifecycleStatus.NEW))
+    @require_permission('read_artefacts', strip_auth=False)
+    def format_thumbnail(self, format_id, size, auth_user=None, session=None):
+        """
+        Returns the thumbnail of the requested size for a format, generating
+        it on demand and storing it for later use if the format does not
+        have one of that size yet.
+
+        Any reader may request the sizes in ``MEDIA_THUMBNAIL_ON_DEMAND_SIZES``.
+        Other sizes, up to ``MEDIA_THUMBNAIL_ON_DEMAND_MAX``, are only
+        generated for users who can add artefacts to the interest, so that
+        readers cannot fill the bucket with arbitrary sizes.
+        """
+        parsed = parse_thumbnail_size(size) if isinstance(size, str) else size
+        box = thumbnail_box(parsed) if parsed else None
+        if not box or min(box) <= 0 or max(box) > MEDIA_THUMBNAIL_ON_DEMAND_MAX or \
+                not self._thumbnail_size_allowed(box, auth_user=auth_user, session=session):
+            raise ThumbnailSizeUnsupported(size, MEDIA_THUMBNAIL_ON_DEMAND_SIZES,
+                                           MEDIA_THUMBNAIL_ON_DEMAND_MAX,
+                                           'read_thumbnail', self.id, self.name)
+        if not self.get_format(format_id, profile='publish', session=session):
+            raise FormatNotFound(format_id, 'read_thumbnail', self.id, self.name)
+        fmt = self._generate_format_thumbnails(format_id, [parsed], session=session)
+        for thumbnail in fmt.thumbnails:
+            if (thumbnail.width, thumbnail.height) == box:
+                return thumbnail.export()
+        raise ThumbnailNotAvailable(format_id, size, 'read_thumbnail', self.id, self.name)
 
     @with_db
     @require_state((LifecycleStatus.NEW))
@@ -359,6 +588,7 @@ class MediaContentInterest(InterestBase):
         generated = provider.generate(args, auth_user=auth_user, session=session)
         for k, v in generated.items():
             setattr(self.model_instance.content, k, v)
+        self.model_instance.content.propagate_change()
         session.add(self.model_instance.content)
         session.flush()
         return self.model_instance.content
@@ -377,11 +607,30 @@ class MediaContentInterest(InterestBase):
             raise ValueError("Expecting a non-negative integer for duration")
 
         self.model_instance.content.default_duration = default_duration
+        self.model_instance.content.propagate_change()
         session.add(self.model_instance.content)
         session.flush()
         return {'interest_id': self.id,
                 'default_duration': self.model_instance.content.default_duration}
 
+    @with_db
+    @require_state((LifecycleStatus.NEW, LifecycleStatus.APPROVAL, LifecycleStatus.ACTIVE))
+    @require_permission('read', strip_auth=False)
+    def sequence_contents_etag(self, full=False, auth_user=None, session=None):
+        """
+        Returns an ETag for the output of :meth:`sequence_get_contents`.
+        Besides the sequence itself, this tracks the interests of its
+        members, whose exports are included in the output.
+        """
+        if self.content_type != 'sequence':
+            raise ContentTypeMismatchError(self.content_type, 'sequence',
+                                           'read', self.id, self.name)
+        content = self.model_instance.content
+        members = sequence_member_interests(id=content.id, session=session)
+        return self._etag('sequence_contents', full, content.id, content.revision,
+                          self.status, self.model_instance.updated_at,
+                          *sorted((x.id, x.status, x.updated_at) for x in members))
+
     @with_db
     @require_state((LifecycleStatus.NEW, LifecycleStatus.APPROVAL, LifecycleStatus.ACTIVE))
     @require_permission('read', strip_auth=False)
@@ -390,15 +639,21 @@ class MediaContentInterest(InterestBase):
             raise ContentTypeMismatchError(self.content_type, 'sequence',
                                            'read', self.id, self.name)
 
+        # The interests of all the members are loaded along with the tree.
+        # A content may appear in a sequence any number of times, but its
+        # interest is wrapped, checked and exported only once.
         contents = sequence_get_contents(id=self.model_instance.content_id,
-                                         session=session)
+                                         with_interests=True, session=session)
         export_level = ExportLevel.STUB
-        contents = [{'interest':
-            rewrap_interest(x["content"].interest).export(
-                export_level=export_level, auth_user=auth_user, session=session),
-            'content_info': x["content"].export(explicit_durations_only=True),
-        }
-            for x in contents]
+        interests = {}
+        for x in contents:
+            model = x["content"].interest
+            if model.id not in interests:
+                interests[model.id] = rewrap_interest(model).export(
+                    export_level=export_level, auth_user=auth_user, session=session)
+        contents = [{'interest': interests[x["content"].interest.id],
+                     'content_info': x["content"].export(explicit_durations_only=True)}
+                    for x in contents]
 
         return {'interest_id': self.id,
                 'default_duration': self.model_instance.content.default_duration,
@@ -406,14 +661,7 @@ class MediaContentInterest(InterestBase):
                                                               session=session),
                 'contents': contents}
 
-    @with_db
-    @require_state((LifecycleStatus.NEW))
-    @require_permission('add_artefact', strip_auth=False)
-    def sequence_add(self, content_id, position=None, duration=None, auth_user=None, session=None):
-        if self.content_type != 'sequence':
-            raise ContentTypeMismatchError(self.content_type, 'sequence',
-                                           'add_artefact', self.id, self.name)
-
+    def _sequence_member_content_id(self, content_id, duration=None, auth_user=None, session=None):
         # Get Content and Verify Access
         content = get_interest(content_id, type=self.type_name, session=session).actual
         if not content.check_user_access(auth_user, 'read', session=session):
@@ -423,16 +671,42 @@ class MediaContentInterest(InterestBase):
         if not content.status == LifecycleStatus.ACTIVE:
             raise ValueError("The content must be active before it can be added to a sequence.")
 
-        if not duration:
+        _duration = duration
+        if not _duration:
             _duration = content.estimated_duration(auth_user=auth_user, session=session)
 
         if not _duration:
             raise ValueError("We need a duration, however none is provided and the content does "
                              "not provide it intrinsically.")
+        return content.model_instance.content_id
+
+    @with_db
+    @require_state((LifecycleStatus.NEW, LifecycleStatus.APPROVAL, LifecycleStatus.ACTIVE))
+    @require_permission('read', strip_auth=False)
+    def sequence_timeline(self, at=None, loop=True, auth_user=None, session=None):
+        if self.content_type != 'sequence':
+            raise ContentTypeMismatchError(self.content_type, 'sequence',
+                                           'read', self.id, self.name)
+
+        timeline = sequence_get_timeline(id=self.model_instance.content_id, session=session)
+        if at is None:
+            return timeline.export()
+        return timeline.export_at(at, loop=loop)
+
+    @with_db
+    @require_state((LifecycleStatus.NEW))
+    @require_permission('add_artefact', strip_auth=False)
+    def sequence_add(self, content_id, position=None, duration=None, auth_user=None, session=None):
+        if self.content_type != 'sequence':
+            raise ContentTypeMismatchError(self.content_type, 'sequence',
+                                           'add_artefact', self.id, self.name)
+
+        member_content_id = self._sequence_member_content_id(content_id, duration=duration,
+                                                             auth_user=auth_user, session=session)
 
         # Create and commit Association Model
         sequence_add_content(id=self.model_instance.content_id,
-                             content=content.model_instance.content_id,
+                             content=member_content_id,
                              position=position,
                              duration=duration,
                              session=session)
@@ -453,3 +727,60 @@ class MediaContentInterest(InterestBase):
                                 session=session)
         sequence_heal_positions(id=self.model_instance.content_id, session=session)
         return True
+
+    @with_db
+    @require_state((LifecycleStatus.NEW))
+    @require_permission('add_artefact', strip_auth=False)
+    def sequence_set_item_duration(self, position, duration=None, auth_user=None, session=None):
+        if self.content_type != 'sequence':
+            raise ContentTypeMismatchError(self.content_type, 'sequence',
+                                           'add_artefact', self.id, self.name)
+
+        sequence_set_content_duration(id=self.model_instance.content_id,
+                                      position=position, duration=duration,
+                                      session=session)
+        return True
+
+    @with_db
+    @require_state((LifecycleStatus.NEW))
+    @require_permission('add_artefact', strip_auth=False)
+    def sequence_batch(self, operations, auth_user=None, session=None):
+        """
+        Applies an ordered list of sequence edits within the caller's
+        transaction. Each operation is a dict with an ``op`` of 'add',
+        'move', 'remove' or 'duration', and positions refer to the state
+        of the sequence after all preceding operations. Positions are
+        healed once, after the last operation.
+        """
+        if self.content_type != 'sequence':
+            raise ContentTypeMismatchError(self.content_type, 'sequence',
+                                           'add_artefact', self.id, self.name)
+
+        sequence_id = self.model_instance.content_id
+        for idx, operation in enumerate(operations):
+            op = operation.get('op')
+            position = operation.get('position')
+            duration = operation.get('duration')
+            if op == 'add':
+                member_content_id = self._sequence_member_content_id(
+                    operation.get('content_id'), duration=duration,
+                    auth_user=auth_user, session=session)
+                sequence_add_content(id=sequence_id, content=member_content_id,
+                                     position=position, duration=duration,
+                                     session=session)
+            elif op == 'move':
+                sequence_move_content(id=sequence_id, position=position,
+                                      to_position=operation.get('to_position'),
+                                      session=session)
+            elif op == 'remove':
+                sequence_remove_content(id=sequence_id, position=position,
+                                        session=session)
+            elif op == 'duration':
+                sequence_set_content_duration(id=sequence_id, position=position,
+                                              duration=duration, session=session)
+            else:
+                raise ValueError(f"Unrecognized sequence operation '{op}' "
+                                 f"at index {idx} of the batch.")
+
+        sequence_heal_positions(id=sequence_id, session=session)
+        return True
@@ -0,0 +1,163 @@
+
+
+import hashlib
+import threading
+from array import array
+from bisect import bisect_right
+from typing import List
+from typing import Tuple
+from typing import Optional
+from collections import OrderedDict
+from collections import namedtuple
+
+from tendril.utils.pydantic import TendrilTBaseModel
+from tendril.db.models.content import SequenceContentModel
+from tendril.config import MEDIA_SEQUENCE_TIMELINE_CACHE_SIZE
+
+from tendril.utils import log
+logger = log.get_logger(__name__, log.DEFAULT)
+
+
+TimelineEntry = namedtuple('TimelineEntry', ['start', 'duration', 'content_id', 'path'])
+
+
+class TimelineEntryTModel(TendrilTBaseModel):
+    start: int
+    duration: int
+    content_id: int
+    path: List[int]
+
+
+class SequenceTimelineTModel(TendrilTBaseModel):
+    sequence_id: int
+    revision: int
+    content_hash: str
+    duration: int
+    items: List[TimelineEntryTModel]
+
+
+class TimelinePositionTModel(TimelineEntryTModel):
+    t: int
+    offset: int
+    index: int
+
+
+def _resolve_duration(association, sequence):
+    duration = association.duration or association.content.estimated_duration() or 0
+    if duration < 0:
+        duration = sequence.default_duration * -1 * duration
+    return duration
+
+
+def _flatten(sequence, start, path, entries, seen):
+    # Nested sequences without an explicit duration on their association
+    # are expanded in place. Everything else is a single leaf spanning its
+    # resolved duration.
+    seen = seen | {sequence.id}
+    for idx, association in enumerate(sequence.contents):
+        content = association.content
+        if isinstance(content, SequenceContentModel) \
+                and not association.duration and content.id not in seen:
+            start = _flatten(content, start, path + (idx,), entries, seen)
+            continue
+        duration = _resolve_duration(association, sequence)
+        entries.append(TimelineEntry(start, duration, content.id, path + (idx,)))
+        start += duration
+    return start
+
+
+class SequenceTimeline(object):
+    """
+    A compiled, flattened view of a sequence, with the start offset of
+    every leaf held in an array so that the item playing at any offset
+    can be found by binary search.
+
+    Build timelines with :func:`compile_timeline` or, with caching, via
+    :func:`tendril.db.controllers.content.sequence_get_timeline`.
+    """
+    def __init__(self, sequence_id, revision, entries: List[TimelineEntry], duration):
+        self.sequence_id = sequence_id
+        self.revision = revision
+        self.entries = entries
+        self.starts = array('q', [x.start for x in entries])
+        self.duration = duration
+        self.content_hash = self._hash()
+
+    def _hash(self):
+        h = hashlib.sha256()
+        for entry in self.entries:
+            h.update(f"{entry.content_id}:{entry.duration};".encode())
+        return h.hexdigest()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def index_at(self, t, loop=True) -> Optional[int]:
+        if not self.entries or self.duration <= 0:
+            return None
+        if loop:
+            t = t % self.duration
+        elif t < 0 or t >= self.duration:
+            return None
+        return bisect_right(self.starts, t) - 1
+
+    def at(self, t, loop=True) -> Optional[Tuple[int, TimelineEntry]]:
+        idx = self.index_at(t, loop=loop)
+        if idx is None:
+            return None
+        return idx, self.entries[idx]
+
+    def export_at(self, t, loop=True):
+        found = self.at(t, loop=loop)
+        if not found:
+            return None
+        idx, entry = found
+        offset = (t % self.duration if loop else t) - entry.start
+        rv = self._export_entry(entry)
+        rv.update({'t': t, 'offset': offset, 'index': idx})
+        return rv
+
+    @staticmethod
+    def _export_entry(entry):
+        return {'start': entry.start,
+                'duration': entry.duration,
+                'content_id': entry.content_id,
+                'path': list(entry.path)}
+
+    def export(self):
+        return {'sequence_id': self.sequence_id,
+                'revision': self.revision,
+                'content_hash': self.content_hash,
+                'duration': self.duration,
+                'items': [self._export_entry(x) for x in self.entries]}
+
+
+def compile_timeline(sequence: SequenceContentModel):
+    entries = []
+    duration = _flatten(sequence, 0, (), entries, frozenset())
+    return SequenceTimeline(sequence.id, sequence.revision, entries, duration)
+
+
+class TimelineCache(object):
+    def __init__(self, size=MEDIA_SEQUENCE_TIMELINE_CACHE_SIZE):
+        self._size = size
+        self._timelines = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, sequence_id, revision):
+        with self._lock:
+            timeline = self._timelines.get(sequence_id)
+            if timeline is None or timeline.revision != revision:
+                return None
+            self._timelines.move_to_end(sequence_id)
+            return timeline
+
+    def put(self, timeline: SequenceTimeline):
+        with self._lock:
+            self._timelines[timeline.sequence_id] = timeline
+            self._timelines.move_to_end(timeline.sequence_id)
+            while len(self._timelines) > self._size:
+                self._timelines.popitem(last=False)
+
+
+timelines = TimelineCache()
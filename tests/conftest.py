@@ -0,0 +1,115 @@
+
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+
+
+@pytest.fixture
+def db():
+    """
+    Run a test against the configured database, inside a transaction
+    which is rolled back when the test ends. Sessions opened by the code
+    under test join this transaction through savepoints, so their commits
+    are discarded along with it.
+
+    Tests using this fixture are skipped if the database is unavailable.
+    """
+    from tendril.utils.db import engine
+    from tendril.utils.db import Session
+    from tendril.utils.db import get_metadata
+
+    try:
+        connection = engine.connect()
+    except OperationalError as e:
+        pytest.skip(f"Database is not available : {e}")
+    transaction = connection.begin()
+    get_metadata().create_all(connection)
+    Session.configure(bind=connection, join_transaction_mode='create_savepoint')
+    try:
+        yield connection
+    finally:
+        Session.configure(bind=engine, join_transaction_mode='conservative_savepoint')
+        transaction.rollback()
+        connection.close()
+
+
+class QueryCounter(object):
+    def __init__(self):
+        self.statements = []
+
+    def __call__(self, conn, cursor, statement, *args):
+        self.statements.append(statement)
+
+    def __len__(self):
+        return len(self.statements)
+
+
+@pytest.fixture
+def queries(db):
+    """
+    Collects the SQL statements executed while the test runs. Use
+    ``len(queries)`` before and after the code under test to count them.
+    """
+    counter = QueryCounter()
+    event.listen(db, 'before_cursor_execute', counter)
+    try:
+        yield counter
+    finally:
+        event.remove(db, 'before_cursor_execute', counter)
+
+
+@pytest.fixture
+def local_buckets(tmp_path):
+    """
+    Puts local filesystem stand-ins in place of the upload and publishing
+    filestore buckets for the duration of the test.
+    """
+    from tendril.filestore import buckets
+    from tendril.config import MEDIA_UPLOAD_FILESTORE_BUCKET
+    from tendril.config import MEDIA_PUBLISHING_FILESTORE_BUCKET
+    from tendril.common.content.localstore import install_local_buckets
+
+    names = [MEDIA_UPLOAD_FILESTORE_BUCKET, MEDIA_PUBLISHING_FILESTORE_BUCKET]
+    saved = dict(buckets._available_buckets)
+    install_local_buckets(str(tmp_path / 'buckets'), names)
+    try:
+        yield names
+    finally:
+        buckets._available_buckets.clear()
+        buckets._available_buckets.update(saved)
+
+
+@pytest.fixture
+def make_media(db, local_buckets):
+    """
+    Returns a function which creates a media content container with one
+    file format, backed by a stored file in the upload bucket, and one
+    thumbnail of that format.
+    """
+    from tendril.filestore.db.model import StoredFileModel
+    from tendril.filestore.db.model import FilestoreBucketModel
+    from tendril.db.models.content import MediaContentModel
+    from tendril.db.models.content_formats import FileMediaContentFormatModel
+    from tendril.db.models.content_thumbnails import MediaContentFormatThumbnailModel
+
+    def make(session, id, sha256=None, duration=5, bucket=local_buckets[0]):
+        bucket_model = session.query(FilestoreBucketModel).filter_by(name=bucket).one_or_none()
+        if bucket_model is None:
+            bucket_model = FilestoreBucketModel(name=bucket)
+            session.add(bucket_model)
+        content = MediaContentModel(id=id)
+        stored_file = StoredFileModel(filename=f'media_{id}.png', bucket=bucket_model,
+                                      fileinfo={'hash': {'sha256': sha256 or f'{id:064x}'}})
+        thumbnail_file = StoredFileModel(filename=f'media_{id}_thumb.png', bucket=bucket_model,
+                                         fileinfo={'hash': {'sha256': f'{id:063x}t'}})
+        fmt = FileMediaContentFormatModel(content=content, stored_file=stored_file,
+                                          duration=duration, width=640, height=480)
+        session.add_all([content, stored_file, thumbnail_file, fmt])
+        session.flush()
+        session.add(MediaContentFormatThumbnailModel(format_id=fmt.id, stored_file=thumbnail_file,
+                                                     width=64, height=48))
+        session.flush()
+        return content
+
+    return make
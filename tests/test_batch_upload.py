@@ -0,0 +1,98 @@
+
+
+import io
+import os
+import pytest
+from types import SimpleNamespace
+
+from tendril.utils.db import get_session
+from tendril.db.models.content import MediaContentModel
+from tendril.db.controllers.content import burn_fidx
+from tendril.common.content import processing as processing_module
+from tendril.common.content.processing import ProcessingQueue
+from tendril.caching.tokens import TokenStatus
+
+
+class _Tokens(object):
+    def __init__(self):
+        self.tokens = {}
+
+    def add(self, token_id, **metadata):
+        self.tokens[token_id] = SimpleNamespace(state=TokenStatus.NEW, metadata=metadata,
+                                                done=0, current=None, error=None)
+
+    def read(self, namespace, token_id):
+        return self.tokens.get(token_id)
+
+    def update(self, namespace, token_id, state=None, current=None, done=None,
+               metadata=None, error=None, **kwargs):
+        token = self.tokens[token_id]
+        token.state = state or token.state
+        token.current, token.done, token.error = current, done, error
+        token.metadata.update(metadata or {})
+
+    def close(self, namespace, token_id, failed=False, **kwargs):
+        self.tokens[token_id].state = TokenStatus.FAILED if failed else TokenStatus.CLOSED
+
+
+@pytest.fixture
+def tokens(monkeypatch):
+    tokens = _Tokens()
+    monkeypatch.setattr(processing_module, 'tokens', tokens)
+    return tokens
+
+
+def test_burn_fidx(db):
+    with get_session() as session:
+        session.add_all([MediaContentModel(id=x) for x in (1, 2, 3)])
+    with get_session() as session:
+        media = session.get(MediaContentModel, 1)
+        assert burn_fidx(counts={1: 3, 2: 1}, session=session) == {1: [0, 1, 2], 2: [0]}
+        assert media.fidx == 3
+        assert burn_fidx(counts={1: 2}, session=session) == {1: [3, 4]}
+        assert burn_fidx(counts={}, session=session) == {}
+    with get_session() as session:
+        assert [session.get(MediaContentModel, x).fidx for x in (1, 2, 3)] == [5, 1, 0]
+
+
+def test_batch_token_follows_uploads(tokens):
+    tokens.add('batch', uploads=[{'token_id': x} for x in ('a', 'b', 'c')])
+    for x in ('a', 'b', 'c'):
+        tokens.add(x)
+    batch = tokens.tokens['batch']
+
+    tokens.tokens['a'].state = TokenStatus.CLOSED
+    ProcessingQueue.update_batch('batch')
+    assert (batch.state, batch.done, batch.error) == (TokenStatus.INPROGRESS, 1, None)
+
+    # Upload tokens expire once closed. Their end state is kept in the batch.
+    tokens.tokens['b'].state = TokenStatus.FAILED
+    del tokens.tokens['a']
+    ProcessingQueue.update_batch('batch')
+    assert batch.done == 2
+    assert batch.error['failed'] == ['b']
+
+    tokens.tokens['c'].state = TokenStatus.CLOSED
+    ProcessingQueue.update_batch('batch')
+    assert batch.state == TokenStatus.CLOSED
+    assert [x['state'] for x in batch.metadata['uploads']] == \
+        [TokenStatus.CLOSED.value, TokenStatus.FAILED.value, TokenStatus.CLOSED.value]
+
+
+class _Unreadable(io.BytesIO):
+    def read(self, *args):
+        raise IOError("Unreadable upload")
+
+
+def test_stage_all(tmp_path):
+    queue = ProcessingQueue(path=str(tmp_path / 'spool'))
+    staged = queue.stage_all([(io.BytesIO(b'x' * 1000 * i), f'f{i}.png') for i in range(1, 6)])
+    assert [(x.filename, x.size) for x in staged] == [(f'f{i}.png', 1000 * i) for i in range(1, 6)]
+    assert len(os.listdir(queue.staging_folder)) == 5
+
+    for x in staged:
+        x.cleanup()
+    with pytest.raises(IOError):
+        queue.stage_all([(io.BytesIO(b'abc'), 'a.png'), (_Unreadable(), 'b.png')])
+    # Nothing is left behind when any of the files fails.
+    assert os.listdir(queue.staging_folder) == []
@@ -0,0 +1,85 @@
+
+
+import asyncio
+import threading
+from types import SimpleNamespace
+from contextlib import contextmanager
+import pytest
+
+httpx = pytest.importorskip('httpx')
+fastapi = pytest.importorskip('fastapi')
+content_api = pytest.importorskip('tendril.apiserver.templates.content')
+
+from tendril.db.models.content import SequenceContentModel  # noqa: E402
+
+
+class _Interest(object):
+    def __init__(self, events, started, release):
+        self.events = events
+        self.started = started
+        self.release = release
+
+    def sequence_timeline(self, at=None, loop=True, auth_user=None, session=None):
+        # Stands in for loading and compiling a large sequence. It blocks
+        # until the test lets it go, or gives up after a while if it is
+        # holding up the event loop and the test never can.
+        self.events.append('timeline started')
+        self.started.set()
+        self.release.wait(timeout=2)
+        self.events.append('timeline done')
+
+
+class _Actual(object):
+    interest_class = SimpleNamespace(model=SimpleNamespace(role_spec=SimpleNamespace(prefix='contents')))
+    accepted_types = {'sequence': SequenceContentModel}
+
+    def __init__(self, interest):
+        self._interest = interest
+
+    def item(self, id, session=None):
+        return self._interest
+
+
+@contextmanager
+def _get_session():
+    yield None
+
+
+def _dependencies(dependant):
+    for x in dependant.dependencies:
+        yield x.call
+        yield from _dependencies(x)
+
+
+def _app(actual):
+    app = fastapi.FastAPI()
+    for router in content_api.InterestContentRouterGenerator(actual).generate('contents'):
+        app.include_router(router)
+        # Every dependency of these routes is authentication.
+        for route in router.routes:
+            for dependency in _dependencies(route.dependant):
+                app.dependency_overrides[dependency] = lambda: None
+    return app
+
+
+def test_slow_handlers_do_not_block_other_requests(monkeypatch):
+    monkeypatch.setattr(content_api, 'get_session', _get_session)
+    events = []
+    started = threading.Event()
+    release = threading.Event()
+    app = _app(_Actual(_Interest(events, started, release)))
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+            slow = asyncio.ensure_future(client.get('/contents/1/sequence/timeline'))
+            await asyncio.to_thread(started.wait, 2)
+            response = await client.get('/contents/allowed_types')
+            assert response.status_code == 200
+            events.append('allowed types done')
+            release.set()
+            assert (await slow).status_code == 200
+
+    asyncio.run(run())
+    # A trivial request is served while the slow one is still running.
+    assert events == ['timeline started', 'allowed types done', 'timeline done']
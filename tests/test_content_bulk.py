@@ -0,0 +1,50 @@
+
+
+from tendril.utils.db import get_session
+from tendril.db.models.content import SequenceContentModel
+from tendril.db.models.content import StructuredContentModel
+from tendril.db.controllers.content import get_contents
+
+
+def _make_contents(session, make_media, start, count):
+    for id in range(start, start + count):
+        if id % 3 == 0:
+            session.add(SequenceContentModel(id=id))
+        elif id % 3 == 1:
+            session.add(StructuredContentModel(id=id, path='clock'))
+        else:
+            make_media(session, id)
+    session.flush()
+    return list(range(start, start + count))
+
+
+def test_get_contents_keeps_order_and_types(db, make_media):
+    with get_session() as session:
+        ids = _make_contents(session, make_media, 1, 6)
+    with get_session() as session:
+        requested = [5, 999, 3, 1, 4, 2, 6]
+        contents = get_contents(ids=requested, session=session)
+        assert [x.id for x in contents] == [5, 3, 1, 4, 2, 6]
+        assert [x.content_type for x in contents] == \
+            ['media', 'sequence', 'structured', 'structured', 'media', 'sequence']
+        assert [x.id for x in get_contents(ids=ids, type='media', session=session)] == [2, 5]
+        assert get_contents(ids=[], session=session) == []
+
+
+def test_get_contents_query_count_is_fixed(db, queries, make_media):
+    counts = {}
+    for first, count in ((1, 6), (1000, 90)):
+        with get_session() as session:
+            ids = _make_contents(session, make_media, first, count)
+        with get_session() as session:
+            start = len(queries)
+            contents = get_contents(ids=ids, profile='export', session=session)
+            counts[count] = len(queries) - start
+            # Sequence members are loaded by get_content_trees. Everything
+            # else is exported without further loads.
+            start = len(queries)
+            for x in contents:
+                if not isinstance(x, SequenceContentModel):
+                    x.export(full=True)
+            assert len(queries) == start
+    assert counts[6] == counts[90]
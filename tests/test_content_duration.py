@@ -0,0 +1,63 @@
+
+
+from tendril.utils.db import get_session
+from tendril.db.models.content import SequenceContentModel
+from tendril.db.controllers.content import sequence_add_content
+from tendril.db.controllers.content import sequence_remove_content
+from tendril.db.controllers.content import sequence_set_content_duration
+from tendril.db.controllers.content import create_content_format_file
+
+
+def test_estimated_durations_propagate(db, queries, make_media):
+    with get_session() as session:
+        media = make_media(session, 3, duration=7)
+        session.add_all([SequenceContentModel(id=1, default_duration=10),
+                         SequenceContentModel(id=2, default_duration=5)])
+        session.flush()
+        sequence_add_content(2, 3, session=session)
+        sequence_add_content(2, 3, duration=-2, session=session)
+        sequence_add_content(1, 2, session=session)
+        inner = session.get(SequenceContentModel, 2)
+        outer = session.get(SequenceContentModel, 1)
+        # 7s of media, two default durations, and a second per item.
+        assert (media.estimated_duration(), inner.estimated_duration(),
+                outer.estimated_duration()) == (7, 19, 20)
+
+        create_content_format_file(id=3, stored_file_id=media.formats[0].stored_file_id,
+                                   duration=9, session=session)
+        assert (media.estimated_duration(), inner.estimated_duration(),
+                outer.estimated_duration()) == (9, 21, 22)
+
+    with get_session() as session:
+        outer = session.get(SequenceContentModel, 1)
+        start = len(queries)
+        # The estimate is read from the row, without walking the tree.
+        assert outer.estimated_duration() == 22
+        assert len(queries) == start
+
+
+def test_sequence_changes_are_applied_as_deltas(db, make_media, monkeypatch):
+    with get_session() as session:
+        make_media(session, 3, duration=7)
+        session.add(SequenceContentModel(id=1, default_duration=10))
+        session.flush()
+        sequence_add_content(1, 3, session=session)
+        sequence = session.get(SequenceContentModel, 1)
+
+        calls = []
+        compute = SequenceContentModel._compute_estimated_duration
+        monkeypatch.setattr(SequenceContentModel, '_compute_estimated_duration',
+                            lambda self: calls.append(self.id) or compute(self))
+        for _ in range(5):
+            sequence_add_content(1, 3, duration=-1, session=session)
+        sequence_set_content_duration(1, 0, 4, session=session)
+        sequence_remove_content(1, 1, session=session)
+        # None of the changes walks the members of the sequence.
+        assert calls == []
+        estimate = sequence.estimated_duration()
+
+    monkeypatch.undo()
+    with get_session() as session:
+        sequence = session.get(SequenceContentModel, 1)
+        # The first item is now 4s, and four remain at one default duration.
+        assert estimate == sequence._compute_estimated_duration() == 5 + 4 * 11
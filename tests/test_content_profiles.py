@@ -0,0 +1,39 @@
+
+
+import pytest
+
+from tendril.utils.db import get_session
+from tendril.db.controllers.content import get_content
+from tendril.db.controllers.content import content_load_options
+
+
+def _queries_after_load(queries, make_media, profile, touch):
+    with get_session() as session:
+        make_media(session, 1)
+    with get_session() as session:
+        content = get_content(id=1, profile=profile, session=session)
+        start = len(queries)
+        touch(content)
+        return len(queries) - start
+
+
+def _published(content):
+    return [(x.published, [y.published for y in x.thumbnails]) for x in content.formats]
+
+
+def test_export_profile_loads_everything_export_touches(db, queries, make_media):
+    assert _queries_after_load(queries, make_media, 'export',
+                               lambda x: x.export(full=True)) == 0
+
+
+def test_publish_profile_loads_published_state(db, queries, make_media):
+    assert _queries_after_load(queries, make_media, 'publish', _published) == 0
+
+
+def test_summary_profile_loads_only_the_content(db, queries, make_media):
+    assert _queries_after_load(queries, make_media, 'summary', _published) > 0
+
+
+def test_unknown_profile():
+    with pytest.raises(ValueError):
+        content_load_options('everything')
@@ -0,0 +1,40 @@
+
+
+from sqlalchemy import update
+
+from tendril.utils.db import get_session
+from tendril.db.models.content import ContentModel
+from tendril.db.models.content import SequenceContentModel
+from tendril.db.models.content import SequenceContentAssociationModel
+
+
+def _revision(session, id):
+    return session.query(ContentModel.revision).filter_by(id=id).scalar()
+
+
+def test_propagate_change_reaches_sequences(db, make_media):
+    with get_session() as session:
+        media = make_media(session, 2)
+        session.add(SequenceContentModel(id=1))
+        session.flush()
+        session.add(SequenceContentAssociationModel(sequence_id=1, content_id=2,
+                                                    position=0, duration=5))
+        session.flush()
+        before = _revision(session, 1), _revision(session, 2)
+        media.propagate_change()
+        session.flush()
+        assert (_revision(session, 1), _revision(session, 2)) == \
+            (before[0] + 1, before[1] + 1)
+
+
+def test_propagate_change_does_not_lose_concurrent_increments(db, make_media):
+    with get_session() as session:
+        media = make_media(session, 2)
+        session.flush()
+        start = media.revision
+        # Another writer bumps the revision behind this session's back.
+        session.connection().execute(update(ContentModel).where(ContentModel.id == 2)
+                                     .values(revision=ContentModel.revision + 1))
+        media.propagate_change()
+        session.flush()
+        assert media.revision == start + 2
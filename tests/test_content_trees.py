@@ -0,0 +1,73 @@
+
+
+import itertools
+
+from tendril.utils.db import get_session
+from tendril.db.models.content import SequenceContentModel
+from tendril.db.models.content import SequenceContentAssociationModel
+from tendril.db.controllers.content import sequence_get_tree
+from tendril.db.controllers.content import get_content_trees
+
+
+def _make_tree(session, make_media, root, fanout, depth, ids):
+    session.add(SequenceContentModel(id=root))
+    session.flush()
+    for position in range(fanout):
+        id = next(ids)
+        if depth > 1:
+            _make_tree(session, make_media, id, fanout, depth - 1, ids)
+        else:
+            make_media(session, id)
+        session.add(SequenceContentAssociationModel(sequence_id=root, content_id=id,
+                                                    position=position, duration=5))
+    session.flush()
+
+
+def _leaves(export):
+    for item in export['contents']:
+        if 'contents' in item['content']:
+            yield from _leaves(item['content'])
+        else:
+            yield item['content']
+
+
+def _export_tree(root, queries):
+    with get_session() as session:
+        start = len(queries)
+        export = sequence_get_tree(root, session=session).export(full=True)
+        return export, len(queries) - start
+
+
+def test_tree_export_query_count_is_bounded(db, queries, make_media):
+    counts = {}
+    for root, fanout in ((1, 2), (100000, 10)):
+        with get_session() as session:
+            _make_tree(session, make_media, root, fanout, 3, itertools.count(root + 1))
+        export, counts[fanout] = _export_tree(root, queries)
+        leaves = list(_leaves(export))
+        assert len(leaves) == fanout ** 3
+        assert all(x['formats'][0]['uri'] for x in leaves)
+        assert all(x['formats'][0]['thumbnails'] for x in leaves)
+    # The loads are batched, so 1000 leaves cost at most one extra IN query
+    # per bulk-loaded entity over 8 leaves, and nothing per node.
+    assert counts[10] - counts[2] <= 4
+    assert counts[10] <= 16
+
+
+def test_many_trees_load_together(db, queries, make_media):
+    counts = {}
+    for first, roots in ((1, 2), (100000, 20)):
+        ids = itertools.count(first + roots)
+        with get_session() as session:
+            for root in range(first, first + roots):
+                _make_tree(session, make_media, root, 3, 2, ids)
+        requested = list(range(first, first + roots)) + [999999999]
+        with get_session() as session:
+            start = len(queries)
+            trees = get_content_trees(ids=requested, session=session)
+            exports = [x.export(full=True) for x in trees.values()]
+            counts[roots] = len(queries) - start
+        # Ids which do not exist are left out.
+        assert sorted(trees) == requested[:-1]
+        assert all(len(list(_leaves(x))) == 9 for x in exports)
+    assert counts[2] == counts[20]
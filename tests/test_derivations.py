@@ -0,0 +1,65 @@
+
+
+import os
+
+from tendril.common.content.derivations import DerivationCache
+
+
+def _disk_size(path):
+    return sum(os.path.getsize(os.path.join(root, x))
+               for root, _, files in os.walk(path) if root != path for x in files)
+
+
+def test_size_bound_holds_across_instances(tmp_path):
+    # Each instance stands in for a separate worker process sharing the
+    # cache folder. Neither holds any state of its own.
+    path = str(tmp_path / 'cache')
+    caches = [DerivationCache(path=path, max_size=10000) for _ in range(2)]
+    for idx in range(20):
+        caches[idx % 2].put_json(DerivationCache.key(f'{idx}', 'test'), 'x' * 1000)
+        assert _disk_size(path) <= 10000
+    assert caches[0].stats()['size'] == caches[1].stats()['size'] == _disk_size(path)
+
+
+def test_counters_are_shared(tmp_path):
+    path = str(tmp_path / 'cache')
+    writer, reader = DerivationCache(path=path), DerivationCache(path=path)
+    key = DerivationCache.key('abc', 'test')
+    assert reader.get_json(key) is None
+    writer.put_json(key, {'value': 1})
+    assert reader.get_json(key) == {'value': 1}
+
+    # Lookups are counted by the reader until it next takes the lock.
+    assert writer.stats()['hits'] == 0
+    reader.stats()
+    stats = writer.stats()
+    assert (stats['hits'], stats['misses']) == (1, 1)
+    assert stats['hit_rate'] == 0.5
+    assert stats['bytes_saved'] == len('{"value": 1}')
+
+
+def test_lookups_do_not_take_the_lock(tmp_path, monkeypatch):
+    cache = DerivationCache(path=str(tmp_path / 'cache'))
+    key = DerivationCache.key('abc', 'test')
+    cache.put_json(key, {'value': 1})
+    os.utime(cache._entry_path(key), (1, 1))
+
+    monkeypatch.setattr(DerivationCache, '_state', None)
+    assert cache.get_json(key) == {'value': 1}
+    assert cache.get_file(key, str(tmp_path / 'copy')) == str(tmp_path / 'copy')
+    assert cache.get_json(DerivationCache.key('xyz', 'test')) is None
+    # The entry is marked as used all the same.
+    assert os.stat(cache._entry_path(key)).st_mtime > 1
+
+
+def test_least_recently_used_is_evicted(tmp_path):
+    cache = DerivationCache(path=str(tmp_path / 'cache'), max_size=2500)
+    keys = [DerivationCache.key(f'{idx}', 'test') for idx in range(3)]
+    cache.put_json(keys[0], 'a' * 1000)
+    cache.put_json(keys[1], 'b' * 1000)
+    os.utime(cache._entry_path(keys[0]), (1, 1))
+    os.utime(cache._entry_path(keys[1]), (2, 2))
+    assert cache.get_json(keys[0]) is not None
+    cache.put_json(keys[2], 'c' * 1000)
+    assert cache.get_json(keys[1]) is None
+    assert cache.get_json(keys[0]) is not None
@@ -0,0 +1,47 @@
+
+
+from tendril.utils.db import get_session
+from tendril.db.controllers.content import get_format_by_hash
+
+
+def test_get_format_by_hash(db, make_media):
+    with get_session() as session:
+        first = make_media(session, 1, sha256='a' * 64).formats[0]
+        second = make_media(session, 2, sha256='a' * 64).formats[0]
+        make_media(session, 3, sha256='b' * 64)
+
+        assert get_format_by_hash(sha256='a' * 64, session=session).id == first.id
+        assert get_format_by_hash(sha256='c' * 64, session=session) is None
+        # Formats of the caller's own content come first.
+        assert get_format_by_hash(sha256='a' * 64, content_id=2, session=session).id == second.id
+        assert get_format_by_hash(sha256='a' * 64, content_id=3, session=session).id == first.id
+
+
+def test_formats_of_other_interests_need_a_user(db, make_media):
+    from types import SimpleNamespace
+    from tendril.interests.mixins.content import MediaContentInterest
+
+    with get_session() as session:
+        own = make_media(session, 1, sha256='a' * 64).formats[0]
+        other = make_media(session, 2, sha256='a' * 64).formats[0]
+        interest = SimpleNamespace(model_instance=SimpleNamespace(content_id=1))
+        assert MediaContentInterest._can_reuse_format(interest, own, session=session)
+        assert not MediaContentInterest._can_reuse_format(interest, other, session=session)
+
+
+def test_references_keep_their_own_info(db, make_media):
+    from tendril.db.models.content import MediaContentModel
+    from tendril.db.controllers.content import create_content_format_reference
+
+    with get_session() as session:
+        source = make_media(session, 1, sha256='a' * 64).formats[0]
+        source.info = {'filename': 'private.png', 'original_filename': 'Private Name.png'}
+        session.add(MediaContentModel(id=2))
+        session.flush()
+        reference = create_content_format_reference(
+            id=2, format_id=source.id, info={'filename': 'mine.png'}, session=session)
+        assert reference.info == {'filename': 'mine.png'}
+        assert (reference.stored_file_id, reference.width, reference.height) == \
+            (source.stored_file_id, source.width, source.height)
+        assert [x.stored_file_id for x in reference.thumbnails] == \
+            [x.stored_file_id for x in source.thumbnails]
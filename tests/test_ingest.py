@@ -0,0 +1,92 @@
+
+
+import io
+import os
+import hashlib
+import tracemalloc
+
+from tendril.common.content.ingest import StagedUpload
+
+
+class _Stream(object):
+    """
+    A file-like source which can only be read forwards, and which counts
+    the bytes read from it.
+    """
+    def __init__(self, data):
+        self._data = io.BytesIO(data)
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        chunk = self._data.read(size)
+        self.bytes_read += len(chunk)
+        return chunk
+
+
+class _Seekable(_Stream):
+    def seek(self, offset, whence=0):
+        return self._data.seek(offset, whence)
+
+    def seekable(self):
+        return True
+
+    @property
+    def closed(self):
+        return self._data.closed
+
+
+def test_staged_upload(tmp_path):
+    data = os.urandom(3 * 1024 * 1024 + 17)
+    source = _Stream(data)
+    with StagedUpload(source, 'video.mp4', chunk_size=64 * 1024,
+                      folder=str(tmp_path)) as staged:
+        assert source.bytes_read == len(data)
+        assert staged.size == len(data)
+        assert staged.sha256 == hashlib.sha256(data).hexdigest()
+        assert staged.path.endswith('.mp4')
+        # Every consumer gets the whole of the same bytes.
+        assert staged.file.read() == data
+        assert staged.file.read() == data
+        path = staged.path
+    assert not os.path.exists(path)
+
+
+def test_staged_upload_from_path(tmp_path):
+    path = tmp_path / 'photo.png'
+    path.write_bytes(b'png' * 1000)
+    staged = StagedUpload.from_path(str(path), 'photo.png')
+    assert staged.size == 3000
+    assert staged.sha256 == hashlib.sha256(b'png' * 1000).hexdigest()
+
+
+def test_seekable_uploads_are_staged_in_place(tmp_path):
+    # The upload of a 32 MiB file is hashed in a single pass, and the
+    # stages then read the upload itself, without a copy on disk or in
+    # memory.
+    data = os.urandom(32 * 1024 * 1024)
+    source = _Seekable(data)
+    folder = tmp_path / 'ingest'
+
+    tracemalloc.start()
+    try:
+        staged = StagedUpload.from_file(source, 'video.mp4', chunk_size=1024 * 1024,
+                                        folder=str(folder))
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert source.bytes_read == len(data)
+    assert peak < 4 * 1024 * 1024
+    assert not folder.exists()
+    assert (staged.size, staged.sha256) == (len(data), hashlib.sha256(data).hexdigest())
+    assert staged.file is source and staged.file.read(4) == data[:4]
+    # The upload belongs to the caller, and is left open.
+    staged.cleanup()
+    assert not source.closed
+
+
+def test_unseekable_uploads_are_copied(tmp_path):
+    data = b'x' * 1000
+    with StagedUpload.from_file(_Stream(data), 'photo.png', folder=str(tmp_path)) as staged:
+        assert staged.path.startswith(str(tmp_path))
+        assert staged.file.read() == data
@@ -0,0 +1,198 @@
+
+
+import io
+import os
+import threading
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from tendril.common.content import processing as processing_module
+from tendril.common.content.processing import ProcessingQueue
+
+
+class _Tokens(object):
+    def __init__(self):
+        self.failed = []
+
+    def update(self, namespace, token_id, state=None, **kwargs):
+        if state == processing_module.TokenStatus.FAILED:
+            self.failed.append(token_id)
+
+    def read(self, namespace, token_id):
+        return None
+
+    def close(self, namespace, token_id, **kwargs):
+        pass
+
+
+class _Interest(object):
+    id = 1
+    name = 'interest'
+
+
+class _User(object):
+    id = 'user'
+
+
+class _Queue(ProcessingQueue):
+    def _executor(self):
+        return ThreadPoolExecutor(self.workers)
+
+
+@pytest.fixture
+def tokens(monkeypatch):
+    tokens = _Tokens()
+    monkeypatch.setattr(processing_module, 'tokens', tokens)
+    return tokens
+
+
+def _queue(tmp_path, **kwargs):
+    kwargs.setdefault('max_depth', 1000)
+    return _Queue(path=str(tmp_path / 'spool'), poll_interval=0.01, **kwargs)
+
+
+def _submit(queue, count, prefix='t'):
+    for i in range(count):
+        staged = queue.stage(io.BytesIO(b'%d' % i), f'{prefix}{i}.png')
+        queue.submit(f'{prefix}{i}', _Interest, staged, rename_to=f'{prefix}{i}.png', user=_User())
+
+
+def test_claims_are_exclusive(tmp_path, tokens):
+    queues = [_queue(tmp_path) for _ in range(4)]
+    _submit(queues[0], 200)
+    claimed = [[] for _ in queues]
+
+    def claim(queue, into):
+        while True:
+            jobs = queue._claim(3)
+            if not jobs and not queue._jobs('pending'):
+                return
+            into.extend(job['token_id'] for _, job in jobs)
+
+    threads = [threading.Thread(target=claim, args=(q, c)) for q, c in zip(queues, claimed)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    tokens_claimed = [x for c in claimed for x in c]
+    assert sorted(tokens_claimed) == sorted(f't{i}' for i in range(200))
+
+
+def test_recover_leaves_live_dispatchers_alone(tmp_path, tokens):
+    alive, other = _queue(tmp_path), _queue(tmp_path)
+    _submit(alive, 3)
+    lock = alive._try_lock(os.path.join(alive._folder('running'), f'{alive.dispatcher_id}.lock'))
+    assert len(alive._claim(3)) == 3
+
+    other.recover()
+    assert len(other._jobs('running')) == 3
+
+    lock.close()
+    other.recover()
+    assert len(other._jobs('running')) == 0
+    assert len(other._jobs('pending')) == 3
+
+
+def test_broken_pool_charges_only_the_culprit(tmp_path, tokens, monkeypatch):
+    ran = []
+
+    def process_job(job):
+        ran.append((job['token_id'], job['attempts']))
+        if job['filename'] == 'crash0.png':
+            raise BrokenProcessPool('A worker died')
+
+    monkeypatch.setattr(processing_module, 'process_job', process_job)
+    queue = _queue(tmp_path, workers=4, max_attempts=2)
+    _submit(queue, 1, prefix='crash')
+    _submit(queue, 6)
+    thread = queue.start()
+    try:
+        for _ in range(500):
+            if not queue.depth():
+                break
+            thread.join(0.01)
+    finally:
+        queue.stop()
+        thread.join(5)
+
+    assert queue.depth() == 0
+    assert tokens.failed == ['crash0']
+    assert [x for x in ran if x[0] == 'crash0'][-2:] == [('crash0', 1), ('crash0', 2)]
+    # Jobs lost along with the pool were not charged for it.
+    assert all(attempts == 1 for token_id, attempts in ran if token_id != 'crash0')
+    assert not os.listdir(queue.staging_folder)
+
+
+def _jobs(prefix, count, lane, tenant, start):
+    return [(f'{prefix}{i}', {'token_id': f'{prefix}{i}', 'lane': lane,
+                              'tenant': tenant, 'queued_at': start + i})
+            for i in range(count)]
+
+
+def test_lanes_share_workers_by_weight(tmp_path):
+    queue = _queue(tmp_path, lane_weights={'fast': 4, 'bulk': 1})
+    jobs = _jobs('bulk', 20, 'bulk', 'a', 0) + _jobs('fast', 20, 'fast', 'a', 100)
+    selected = [job['lane'] for _, job in queue._select(jobs, 10)]
+    # The older bulk job goes first, then four fast jobs for every bulk one.
+    assert selected == ['bulk'] + ['fast'] * 4 + ['bulk'] + ['fast'] * 4
+
+
+def test_tenants_take_turns_within_a_lane(tmp_path):
+    queue = _queue(tmp_path)
+    jobs = _jobs('a', 20, 'bulk', 'a', 0) + _jobs('b', 3, 'bulk', 'b', 100)
+    selected = [job['token_id'] for _, job in queue._select(jobs, 8)]
+    # A tenant with a long backlog does not hold up one which queued later.
+    assert selected == ['a0', 'b0', 'a1', 'b1', 'a2', 'b2', 'a3', 'a4']
+
+
+def test_stats_report_lanes(tmp_path, tokens):
+    queue = _queue(tmp_path)
+    _submit(queue, 3)
+    stats = queue.stats()
+    assert stats['fast']['pending'] == 3
+    assert stats['fast']['tenants'] == 1
+    assert stats['bulk']['pending'] == 0
+    assert stats['bulk']['oldest_wait'] is None
+
+
+def test_dispatcher_runs_once(tmp_path, tokens):
+    queue = _queue(tmp_path)
+    lock = queue._try_lock(os.path.join(queue._folder('running'), f'{queue.dispatcher_id}.lock'))
+    try:
+        # Returns right away instead of dispatching alongside the holder.
+        queue.run()
+    finally:
+        lock.close()
+
+
+def test_suspect_jobs_are_not_starved(tmp_path, tokens):
+    queue = _queue(tmp_path)
+    _submit(queue, 1, prefix='suspect')
+    job_path, job = queue._claim(1)[0]
+    queue._requeue(job_path, job, charge=False)
+    _submit(queue, 3)
+
+    # New jobs keep arriving, so the dispatcher is never idle unless it
+    # stops taking them while a suspect job waits.
+    assert queue._claim(3) == []
+    assert [job['token_id'] for _, job in queue._claim(3, alone=True)] == ['suspect0']
+    assert len(queue._claim(3)) == 3
+
+
+def test_jobs_carry_only_the_user_id(tmp_path, tokens, monkeypatch):
+    from types import SimpleNamespace
+    from contextlib import nullcontext
+
+    calls = []
+    monkeypatch.setattr(processing_module, 'get_session', nullcontext)
+    interest = SimpleNamespace(add_format=lambda **kwargs: calls.append(kwargs))
+    monkeypatch.setattr(processing_module, 'get_interest',
+                        lambda id, session=None: SimpleNamespace(actual=interest))
+    queue = _queue(tmp_path)
+    _submit(queue, 1)
+    job = queue._read(queue._jobs('pending')[0])
+    assert job['user_id'] == 'user' and 'user' not in job
+
+    processing_module.process_job(job)
+    assert calls[0]['auth_user'] == 'user'
@@ -0,0 +1,74 @@
+
+
+import pytest
+
+from tendril.utils.db import get_session
+from tendril.filestore.db.model import StoredFileModel
+from tendril.filestore.db.model import FilestoreBucketModel
+from tendril.db.models.content import MediaContentModel
+from tendril.db.models.content_formats import MediaContentFormatModel
+from tendril.db.controllers.content import get_content
+from tendril.db.controllers.content import sync_published_state
+from tendril.db.controllers.content import get_unpublished_contents
+from tendril.db.controllers.content import set_stored_file_published
+from tendril.db.controllers.content import get_unpublished_stored_files
+from tendril.db.controllers.content import create_content_format_file
+from tendril.db.controllers.content import create_content_format_thumbnail
+
+
+@pytest.fixture
+def contents(db):
+    """
+    Two media contents sharing stored file 1. Content 3 also has a second
+    format on stored file 2, and a thumbnail on stored file 3.
+    """
+    with get_session() as session:
+        uploads = FilestoreBucketModel(name='uploads')
+        session.add_all([uploads, FilestoreBucketModel(name='cdn'),
+                         MediaContentModel(id=3), MediaContentModel(id=4)])
+        files = [StoredFileModel(filename=f'file_{i}.png', bucket=uploads, fileinfo={})
+                 for i in range(3)]
+        session.add_all(files)
+        session.flush()
+        files = [x.id for x in files]
+        first = create_content_format_file(id=3, stored_file_id=files[0], duration=5, session=session)
+        create_content_format_file(id=3, stored_file_id=files[1], duration=5, session=session)
+        create_content_format_thumbnail(id=first.id, stored_file_id=files[2],
+                                        width=64, height=48, session=session)
+        create_content_format_file(id=4, stored_file_id=files[0], duration=5, session=session)
+    return files
+
+
+def _unpublished_contents():
+    return sorted(x.id for x in get_unpublished_contents())
+
+
+def test_new_formats_are_unpublished(contents):
+    assert sorted(get_unpublished_stored_files(content_id=3)) == contents
+    assert _unpublished_contents() == [3, 4]
+
+
+def test_publishing_a_file_updates_its_content(contents):
+    set_stored_file_published(stored_file_id=contents[0])
+    assert _unpublished_contents() == [3]
+    assert sorted(get_unpublished_stored_files(content_id=3)) == contents[1:]
+
+    set_stored_file_published(stored_file_id=contents[1])
+    # Content is published once all its formats are. Thumbnails follow
+    # separately and do not hold the content back.
+    assert _unpublished_contents() == []
+    assert get_content(id=3).published
+    assert get_unpublished_stored_files(content_id=3) == [contents[2]]
+
+
+def test_sync_published_state_follows_buckets(contents):
+    with get_session() as session:
+        cdn = session.query(FilestoreBucketModel).filter_by(name='cdn').one()
+        session.get(StoredFileModel, contents[1]).bucket_id = cdn.id
+        session.flush()
+        sync_published_state(bucket='cdn', session=session)
+        published = {x.stored_file_id: x.published
+                     for x in session.query(MediaContentFormatModel)
+                     if x.content_id == 3}
+    assert published == {contents[0]: False, contents[1]: True}
+    assert _unpublished_contents() == [3, 4]
@@ -0,0 +1,151 @@
+
+
+import arrow
+import httpx
+import asyncio
+import pytest
+from sqlalchemy import update
+
+from tendril.utils.db import get_session
+from tendril.db.models.interests import InterestModel
+from tendril.filestore.db.model import StoredFileModel
+from tendril.filestore.db.model import FilestoreBucketModel
+from tendril.db.models.content_publishing import ContentPublishTaskModel
+from tendril.db.controllers.content_publishing import get_publish_tasks
+from tendril.db.controllers.content_publishing import claim_publish_tasks
+from tendril.db.controllers.content_publishing import create_publish_tasks
+from tendril.db.controllers.content_publishing import record_publish_attempt
+from tendril.common.content.publishing import PublishScheduler
+
+
+class _Bucket(object):
+    def __init__(self):
+        self.moves = []
+
+    async def move(self, filename, target_bucket, actual_user=None):
+        await asyncio.sleep(0)
+        self.moves.append(filename)
+
+
+class _Interest(object):
+    def __init__(self, id):
+        self.id = id
+        self.upload_bucket = _Bucket()
+        self.publish_bucket_name = 'cdn'
+
+
+@pytest.fixture
+def interest_id(db):
+    with get_session() as session:
+        interest = InterestModel(name='publishing')
+        bucket = FilestoreBucketModel(name='uploads')
+        session.add_all([interest, bucket])
+        session.add_all([StoredFileModel(filename=f'file_{i}.png', bucket=bucket, fileinfo={})
+                         for i in range(3)])
+        session.flush()
+        return interest.id
+
+
+def _stored_file_ids():
+    with get_session() as session:
+        return [x.id for x in session.query(StoredFileModel).order_by(StoredFileModel.id)]
+
+
+def _status(task_ids):
+    return [x.status for x in get_publish_tasks(ids=task_ids)]
+
+
+def test_tasks_are_claimed_once(interest_id):
+    task_ids = create_publish_tasks(interest_id=interest_id, stored_file_ids=_stored_file_ids())
+    assert [x.id for x in claim_publish_tasks(ids=task_ids)] == task_ids
+    assert claim_publish_tasks(ids=task_ids) == []
+    assert claim_publish_tasks(ids=task_ids, stale_after=600) == []
+    assert _status(task_ids) == ['running'] * 3
+
+
+def test_abandoned_claims_are_reclaimed(interest_id):
+    task_ids = create_publish_tasks(interest_id=interest_id, stored_file_ids=_stored_file_ids())
+    claim_publish_tasks(ids=task_ids)
+    with get_session() as session:
+        session.execute(update(ContentPublishTaskModel)
+                        .where(ContentPublishTaskModel.id == task_ids[0])
+                        .values(updated_at=arrow.utcnow().shift(hours=-1)))
+    assert [x.id for x in claim_publish_tasks(ids=task_ids, stale_after=600)] == task_ids[:1]
+
+
+def test_done_tasks_stay_done(interest_id):
+    task_ids = create_publish_tasks(interest_id=interest_id, stored_file_ids=_stored_file_ids())
+    claim_publish_tasks(ids=task_ids)
+    record_publish_attempt(id=task_ids[0], status='done')
+    record_publish_attempt(id=task_ids[0], status='failed', error='Late failure')
+    record_publish_attempt(id=task_ids[1], status='failed', error='Failure')
+    assert _status(task_ids) == ['done', 'failed', 'running']
+
+    assert create_publish_tasks(interest_id=interest_id,
+                                stored_file_ids=_stored_file_ids()) == task_ids
+    assert _status(task_ids) == ['done', 'pending', 'running']
+
+
+def test_concurrent_publishers_move_each_file_once(interest_id):
+    task_ids = create_publish_tasks(interest_id=interest_id, stored_file_ids=_stored_file_ids())
+    interest = _Interest(interest_id)
+
+    async def publish():
+        return await asyncio.gather(*[PublishScheduler(backoff=0).publish(interest, task_ids)
+                                      for _ in range(3)])
+
+    assert all(asyncio.run(publish()))
+    assert sorted(interest.upload_bucket.moves) == [f'file_{i}.png' for i in range(3)]
+    assert _status(task_ids) == ['done'] * 3
+
+
+def _http_error(status_code):
+    request = httpx.Request('POST', 'http://filestore/move')
+    return httpx.HTTPStatusError(f"HTTP {status_code}", request=request,
+                                 response=httpx.Response(status_code, request=request))
+
+
+class _LostResponseBucket(_Bucket):
+    # The first move goes through, but its response never arrives. The
+    # retry finds the file gone from the upload bucket.
+    async def move(self, filename, target_bucket, actual_user=None):
+        if filename in self.moves:
+            raise _http_error(404)
+        self.moves.append(filename)
+        with get_session() as session:
+            cdn = session.query(FilestoreBucketModel).filter_by(name=target_bucket).one()
+            session.query(StoredFileModel).filter_by(filename=filename).one().bucket = cdn
+        raise httpx.ReadTimeout("Timed out", request=httpx.Request('POST', 'http://filestore/move'))
+
+
+def test_moves_whose_response_was_lost_succeed(interest_id):
+    with get_session() as session:
+        session.add(FilestoreBucketModel(name='cdn'))
+    task_ids = create_publish_tasks(interest_id=interest_id, stored_file_ids=_stored_file_ids())
+    interest = _Interest(interest_id)
+    interest.upload_bucket = _LostResponseBucket()
+    assert asyncio.run(PublishScheduler(backoff=0).publish(interest, task_ids))
+    assert _status(task_ids) == ['done'] * 3
+
+
+class _MissingBucket(_Bucket):
+    async def move(self, filename, target_bucket, actual_user=None):
+        raise _http_error(404)
+
+
+def test_missing_files_fail(interest_id):
+    with get_session() as session:
+        session.add(FilestoreBucketModel(name='cdn'))
+    task_ids = create_publish_tasks(interest_id=interest_id, stored_file_ids=_stored_file_ids())
+    interest = _Interest(interest_id)
+    interest.upload_bucket = _MissingBucket()
+    assert not asyncio.run(PublishScheduler(backoff=0).publish(interest, task_ids))
+    assert _status(task_ids) == ['failed'] * 3
+
+
+def test_retries_stay_within_the_claim_timeout():
+    assert PublishScheduler(backoff=2, max_attempts=5, claim_timeout=600)._retry_delays() == \
+        [2, 4, 8, 16]
+    delays = PublishScheduler(backoff=60, max_attempts=6, claim_timeout=600)._retry_delays()
+    assert sum(delays) == pytest.approx(300)
+    assert delays == sorted(delays)
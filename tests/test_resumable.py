@@ -0,0 +1,69 @@
+
+
+import os
+import pytest
+from types import SimpleNamespace
+
+from tendril.common.content.resumable import ResumableUploads
+from tendril.common.content.exceptions import UploadConflict
+from tendril.common.content.exceptions import UploadNotFound
+from tendril.common.content.exceptions import UploadLengthExceeded
+
+
+interest = SimpleNamespace(id=1, name='interest')
+owner = SimpleNamespace(id='owner')
+
+
+@pytest.fixture
+def uploads(tmp_path):
+    return ResumableUploads(path=str(tmp_path / 'spool'), expiry=100)
+
+
+@pytest.fixture
+def upload(uploads):
+    return uploads.create('token', interest, 'photo.png', 'photo_f1.png', 10, owner)
+
+
+def test_upload_in_chunks(tmp_path, uploads, upload):
+    with uploads.lock(upload, interest):
+        uploads.check_offset(upload, 0, interest)
+        uploads.append(upload, b'12345', interest)
+        with pytest.raises(UploadConflict):
+            with uploads.lock(upload, interest):
+                pass
+    with pytest.raises(UploadConflict):
+        uploads.check_offset(upload, 0, interest)
+    with pytest.raises(UploadLengthExceeded):
+        uploads.append(upload, b'x' * 6, interest)
+    uploads.append(upload, b'67890', interest)
+    assert uploads.is_complete(upload)
+
+    staged = uploads.complete(upload, str(tmp_path))
+    with open(staged.path, 'rb') as f:
+        assert f.read() == b'1234567890'
+    with pytest.raises(UploadNotFound):
+        uploads.get('token', interest, owner)
+
+
+def test_upload_is_only_visible_to_its_owner(uploads, upload):
+    assert uploads.get('token', interest, owner) == upload
+    with pytest.raises(UploadNotFound):
+        uploads.get('token', interest, SimpleNamespace(id='someone else'))
+    with pytest.raises(UploadNotFound):
+        uploads.get('token', SimpleNamespace(id=2, name='other'), owner)
+
+
+def test_lock_on_completed_upload(tmp_path, uploads, upload):
+    uploads.append(upload, b'1234567890', interest)
+    uploads.complete(upload, str(tmp_path))
+    with pytest.raises(UploadNotFound):
+        with uploads.lock(upload, interest):
+            pass
+
+
+def test_expire(uploads, upload):
+    data_path = uploads._data_path('token')
+    os.utime(data_path, (0, 0))
+    uploads.expire()
+    with pytest.raises(UploadNotFound):
+        uploads.get('token', interest, owner)
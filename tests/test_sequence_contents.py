@@ -0,0 +1,33 @@
+
+
+from tendril.utils.db import get_session
+from tendril.db.models.content import SequenceContentModel
+from tendril.db.models.content import SequenceContentAssociationModel
+from tendril.db.controllers.content import sequence_get_contents
+
+
+def _make_sequence(session, make_media, id, length):
+    session.add(SequenceContentModel(id=id))
+    session.flush()
+    for position in range(length):
+        make_media(session, id + position + 1)
+        session.add(SequenceContentAssociationModel(sequence_id=id, content_id=id + position + 1,
+                                                    position=position, duration=5))
+    session.flush()
+
+
+def test_sequence_contents_query_count_is_fixed(db, queries, make_media):
+    counts = {}
+    for id, length in ((1000, 3), (2000, 30)):
+        with get_session() as session:
+            _make_sequence(session, make_media, id, length)
+        with get_session() as session:
+            start = len(queries)
+            contents = sequence_get_contents(id, with_interests=True, session=session)
+            for x in contents:
+                # Member interests and exports must not load anything more.
+                x['content'].interest
+                x['content'].export(explicit_durations_only=True)
+            counts[length] = len(queries) - start
+            assert [x['position'] for x in contents] == list(range(length))
+    assert counts[3] == counts[30]
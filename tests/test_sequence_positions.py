@@ -0,0 +1,168 @@
+
+
+import pytest
+
+from tendril.utils.db import get_session
+from tendril.db.models.content import MediaContentModel
+from tendril.db.models.content import SequenceContentModel
+from tendril.db.models.content import SequenceContentAssociationModel
+from tendril.db.controllers.content import sequence_heal_positions
+from tendril.db.controllers.content import sequence_add_content
+from tendril.db.controllers.content import sequence_remove_content
+from tendril.db.controllers.content import sequence_move_content
+from tendril.db.controllers.content import sequence_set_ordering
+from tendril.db.controllers.content import sequence_get_contents
+from tendril.db.controllers.content import sequence_get_at_position
+
+
+def _make_sequence(session, id, positions, content_id=None):
+    session.add(SequenceContentModel(id=id, ordering='dense'))
+    if content_id is None:
+        content_id = id + 1
+        session.add(MediaContentModel(id=content_id))
+    session.flush()
+    session.add_all([SequenceContentAssociationModel(sequence_id=id, content_id=content_id,
+                                                     position=position, duration=5)
+                     for position in positions])
+    session.flush()
+
+
+def _positions(session, id):
+    return session.query(SequenceContentAssociationModel.position)\
+        .filter_by(sequence_id=id)\
+        .order_by(SequenceContentAssociationModel.position)\
+        .all()
+
+
+@pytest.mark.parametrize('length', [10, 100, 1000])
+def test_heal_positions_is_dense(db, length):
+    with get_session() as session:
+        _make_sequence(session, 100, range(0, 3 * length, 3))
+        sequence_heal_positions(id=100, session=session)
+        assert [x for x, in _positions(session, 100)] == list(range(length))
+
+
+def test_heal_positions_query_count_is_constant(db, queries):
+    counts = {}
+    for idx, length in enumerate([10, 100, 1000]):
+        id = 100 + 10 * idx
+        with get_session() as session:
+            _make_sequence(session, id, range(0, 3 * length, 3))
+            start = len(queries)
+            sequence_heal_positions(id=id, session=session)
+            counts[length] = len(queries) - start
+    assert len(set(counts.values())) == 1
+
+
+@pytest.mark.parametrize('position', [0, 5000, 9999])
+def test_insert_into_long_sequence(db, queries, position):
+    with get_session() as session:
+        _make_sequence(session, 100, range(10000))
+        session.add(MediaContentModel(id=200))
+        session.flush()
+        start = len(queries)
+        sequence_add_content(100, 200, position=position, duration=7, session=session)
+        count = len(queries) - start
+
+        rows = session.query(SequenceContentAssociationModel)\
+            .filter_by(sequence_id=100)\
+            .order_by(SequenceContentAssociationModel.position).all()
+        assert [x.position for x in rows] == list(range(10001))
+        assert rows[position].content_id == 200
+        assert rows[position].duration == 7
+    # The shift is a fixed number of statements, however many rows move.
+    assert count < 20
+
+
+def test_insert_query_count_does_not_grow(db, queries):
+    counts = {}
+    for idx, length in enumerate([10, 10000]):
+        id = 100 + 10 * idx
+        with get_session() as session:
+            _make_sequence(session, id, range(length))
+            start = len(queries)
+            sequence_add_content(id, id + 1, position=0, session=session)
+            counts[length] = len(queries) - start
+    assert counts[10] == counts[10000]
+
+
+def test_get_at_position_loads_one_row(db):
+    with get_session() as session:
+        _make_sequence(session, 100, range(10000))
+    with get_session() as session:
+        sequence = session.get(SequenceContentModel, 100)
+        assert sequence_get_at_position(100, 5000, session=session).position == 5000
+        assert sequence_get_at_position(100, 10000, session=session) is None
+        # The members of the sequence are not loaded to find it.
+        assert 'contents' not in sequence.__dict__
+
+
+def test_remove_from_long_sequence(db):
+    with get_session() as session:
+        _make_sequence(session, 100, range(10000))
+        sequence_remove_content(100, 0, session=session)
+        assert [x for x, in _positions(session, 100)] == list(range(9999))
+
+
+def _edit(session, id, ordering):
+    session.add(SequenceContentModel(id=id, ordering=ordering))
+    session.add_all([MediaContentModel(id=id + x) for x in range(1, 7)])
+    session.flush()
+    for x in range(1, 7):
+        sequence_add_content(id, id + x, session=session)
+    sequence_move_content(id, 0, 3, session=session)
+    sequence_remove_content(id, 1, session=session)
+    sequence_add_content(id, id + 6, position=0, session=session)
+    sequence_move_content(id, 5, 2, session=session)
+    return [x['content'].id - id for x in sequence_get_contents(id, session=session)]
+
+
+def test_gapped_edits_match_dense(db):
+    with get_session() as session:
+        dense = _edit(session, 100, 'dense')
+        gapped = _edit(session, 200, 'gapped')
+    assert dense == gapped == [6, 2, 6, 4, 1, 5]
+
+
+def test_gapped_insert_only_writes_new_row(db):
+    with get_session() as session:
+        session.add(SequenceContentModel(id=100, ordering='gapped'))
+        session.add_all([MediaContentModel(id=x) for x in (101, 102)])
+        session.flush()
+        for _ in range(10):
+            sequence_add_content(100, 101, session=session)
+        before = [x for x, in _positions(session, 100)]
+        assert all(b - a > 1 for a, b in zip(before, before[1:]))
+
+        sequence_add_content(100, 102, position=5, session=session)
+        after = [x for x, in _positions(session, 100)]
+        assert len(after) == 11
+        assert set(before) < set(after)
+        assert sequence_get_at_position(100, 5, session=session).content_id == 102
+
+
+def test_gapped_rebalances_when_out_of_room(db):
+    with get_session() as session:
+        session.add(SequenceContentModel(id=100, ordering='gapped'))
+        session.add_all([MediaContentModel(id=x) for x in (101, 102)])
+        session.flush()
+        sequence_add_content(100, 101, session=session)
+        sequence_add_content(100, 101, session=session)
+        # Halving the gap runs out of room after a few inserts, and the
+        # sequence is rebalanced without changing the order.
+        for _ in range(20):
+            sequence_add_content(100, 102, position=1, session=session)
+        rows = sequence_get_contents(100, session=session)
+        assert [x['content'].id for x in rows] == [101] + [102] * 20 + [101]
+        positions = [x for x, in _positions(session, 100)]
+        assert positions == sorted(set(positions))
+
+
+def test_set_ordering_round_trip(db):
+    with get_session() as session:
+        _make_sequence(session, 100, range(0, 30, 3))
+        sequence_set_ordering(100, 'gapped', session=session)
+        positions = [x for x, in _positions(session, 100)]
+        assert len(positions) == 10 and all(b - a > 1 for a, b in zip(positions, positions[1:]))
+        sequence_set_ordering(100, 'dense', session=session)
+        assert [x for x, in _positions(session, 100)] == list(range(10))
@@ -0,0 +1,82 @@
+
+
+import pytest
+
+from tendril.utils.db import get_session
+from tendril.db.models.content import MediaContentModel
+from tendril.db.models.content import SequenceContentModel
+from tendril.db.controllers import content as content_controller
+from tendril.db.controllers.content import sequence_add_content
+from tendril.db.controllers.content import sequence_remove_content
+from tendril.db.controllers.content import sequence_get_timeline
+from tendril.structures.content.timeline import TimelineCache
+
+
+@pytest.fixture
+def timelines(monkeypatch):
+    cache = TimelineCache(size=8)
+    monkeypatch.setattr(content_controller, 'timelines', cache)
+    return cache
+
+
+def _make_sequences(session):
+    session.add_all([SequenceContentModel(id=1, default_duration=1000),
+                     SequenceContentModel(id=2, default_duration=500)])
+    session.add_all([MediaContentModel(id=x, duration_estimate=3000) for x in range(3, 7)])
+    session.flush()
+    sequence_add_content(2, 3, session=session)
+    sequence_add_content(2, 4, duration=-2, session=session)
+    sequence_add_content(1, 5, duration=2000, session=session)
+    sequence_add_content(1, 2, session=session)
+    sequence_add_content(1, 6, duration=-1, session=session)
+
+
+def test_timeline_flattens_nested_sequences(db, timelines):
+    with get_session() as session:
+        _make_sequences(session)
+        timeline = sequence_get_timeline(1, session=session)
+        assert timeline.duration == 7000
+        assert [(x['start'], x['duration'], x['content_id'], x['path'])
+                for x in timeline.export()['items']] == [
+            (0, 2000, 5, [0]),
+            (2000, 3000, 3, [1, 0]),
+            (5000, 1000, 4, [1, 1]),
+            (6000, 1000, 6, [2]),
+        ]
+
+
+@pytest.mark.parametrize('t, content_id, offset', [
+    (0, 5, 0), (1999, 5, 1999), (2000, 3, 0), (5000, 4, 0),
+    (6999, 6, 999), (7000, 5, 0), (8000, 5, 1000),
+])
+def test_timeline_export_at(db, timelines, t, content_id, offset):
+    with get_session() as session:
+        _make_sequences(session)
+        position = sequence_get_timeline(1, session=session).export_at(t)
+    assert (position['content_id'], position['offset']) == (content_id, offset)
+
+
+def test_timeline_export_at_without_looping(db, timelines):
+    with get_session() as session:
+        _make_sequences(session)
+        timeline = sequence_get_timeline(1, session=session)
+    assert timeline.export_at(7000, loop=False) is None
+    assert timeline.export_at(-1, loop=False) is None
+
+
+def test_timeline_cache_follows_revision(db, queries, timelines):
+    with get_session() as session:
+        _make_sequences(session)
+        timeline = sequence_get_timeline(1, session=session)
+
+        start = len(queries)
+        assert sequence_get_timeline(1, session=session) is timeline
+        # Only the sequence itself is read to check its revision.
+        assert len(queries) - start <= 1
+
+        # A change to a nested sequence invalidates the outer timeline.
+        sequence_remove_content(2, 0, session=session)
+        changed = sequence_get_timeline(1, session=session)
+        assert changed is not timeline
+        assert changed.duration == 4000
+        assert changed.content_hash != timeline.content_hash
@@ -0,0 +1,300 @@
+
+
+import os
+import asyncio
+import hashlib
+import pytest
+from PIL import Image
+
+from tendril.common.content import derivations as derivations_module
+from tendril.common.content import thumbnails as thumbnails_module
+from tendril.common.content.thumbnails import thumbnail_target
+from tendril.common.content.thumbnails import generate_thumbnails
+from tendril.common.content.derivations import DerivationCache
+from tendril.common.content.derivations import cached_thumbnails
+
+
+@pytest.fixture
+def image_file(tmp_path):
+    path = tmp_path / 'source' / 'photo.jpg'
+    path.parent.mkdir()
+    Image.new('RGB', (1600, 900), (200, 40, 40)).save(path, quality=90)
+    with open(path, 'rb') as f:
+        sha256 = hashlib.sha256(f.read()).hexdigest()
+    return str(path), sha256
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    cache = DerivationCache(path=str(tmp_path / 'cache'), max_size=64 * 1024 * 1024)
+    monkeypatch.setattr(derivations_module, 'derivations', cache)
+    return cache
+
+
+def test_thumbnail_target():
+    assert thumbnail_target('/uploads/photo.jpg', 128, background=None) == \
+        ((128, 128), 'photo_jpg_thumb_128.jpg')
+    assert thumbnail_target('photo.png', (320, 180), background=(0, 0, 0, 0)) == \
+        ((320, 180), 'photo_png_thumb_320x180.png')
+
+
+def test_generate_thumbnails(tmp_path, image_file):
+    path, _ = image_file
+    sizes = [128, (320, 180)]
+    with open(path, 'rb') as f:
+        generated = generate_thumbnails(f, str(tmp_path / 'out'), filename=path,
+                                        sizes=sizes, background=None)
+    assert [x[0] for x in generated] == [(128, 128), (320, 180)]
+    for size, (box, output_path) in zip(sizes, generated):
+        assert os.path.basename(output_path) == thumbnail_target(path, size, background=None)[1]
+        with Image.open(output_path) as thumbnail:
+            assert thumbnail.size[0] <= box[0] and thumbnail.size[1] <= box[1]
+            assert max(thumbnail.size[0] / box[0], thumbnail.size[1] / box[1]) == 1
+
+
+def test_cached_thumbnails(tmp_path, image_file, cache):
+    path, sha256 = image_file
+    sizes = [128, 256]
+    with open(path, 'rb') as f:
+        first = cached_thumbnails(f, sha256, str(tmp_path / 'first'), filename=path,
+                                  sizes=sizes, background=None)
+    assert cache.stats()['hits'] == 0
+
+    with open(path, 'rb') as f:
+        second = cached_thumbnails(f, sha256, str(tmp_path / 'second'), filename=path,
+                                   sizes=sizes, background=None)
+    stats = cache.stats()
+    assert stats['hits'] == len(sizes)
+    assert stats['bytes_saved'] > 0
+
+    assert [x[0] for x in first] == [x[0] for x in second] == [(128, 128), (256, 256)]
+    for (_, a), (_, b) in zip(first, second):
+        assert os.path.basename(a) == os.path.basename(b)
+        with open(a, 'rb') as fa, open(b, 'rb') as fb:
+            assert fa.read() == fb.read()
+
+
+def test_pyramid_decodes_once(tmp_path, monkeypatch):
+    # Rendering each size on its own decodes the full source once per
+    # size. The pyramid decodes once, at a reduced scale, and derives
+    # each size from the previous one.
+    path = str(tmp_path / 'photo.jpg')
+    Image.effect_noise((4000, 3000), 64).convert('RGB').save(path, quality=90)
+    sizes = [128, 256, 512, (1280, 720)]
+    boxes = [thumbnail_target(path, x, background=None)[0] for x in sizes]
+
+    per_size = []
+    for box in boxes:
+        with Image.open(path) as image:
+            image.load()
+            image.thumbnail(box)
+            per_size.append(image.size)
+
+    decodes = []
+    decode = thumbnails_module._decode_image
+
+    def counting_decode(file, largest):
+        decodes.append(largest)
+        return decode(file, largest)
+
+    monkeypatch.setitem(thumbnails_module._decoders, '.jpg', counting_decode)
+    with open(path, 'rb') as f:
+        generated = generate_thumbnails(f, str(tmp_path / 'out'), filename=path,
+                                        sizes=sizes, background=None, workers=1)
+
+    # A single decode, scaled for the largest of the thumbnails.
+    assert decodes == [(1280, 720)]
+    for box, (_, output_path) in zip(boxes, generated):
+        with Image.open(output_path) as thumbnail:
+            assert thumbnail.size == thumbnails_module._fit((4000, 3000), box)
+    assert [thumbnails_module._fit((4000, 3000), x) for x in boxes] == per_size
+
+
+def test_thumbnail_sizes_are_unique(db, make_media):
+    from tendril.utils.db import get_session
+    from tendril.filestore.db.model import StoredFileModel
+    from tendril.db.controllers.content import create_content_format_thumbnail
+    from tendril.db.models.content_thumbnails import MediaContentFormatThumbnailModel
+
+    with get_session() as session:
+        fmt = make_media(session, 1).formats[0]
+        existing = fmt.thumbnails[0]
+        duplicate_file = StoredFileModel(filename='duplicate_thumb.png',
+                                         bucket=existing.stored_file.bucket)
+        session.add(duplicate_file)
+        session.flush()
+        rv = create_content_format_thumbnail(id=fmt.id, stored_file_id=duplicate_file.id,
+                                             width=existing.width, height=existing.height,
+                                             session=session)
+        assert rv.id == existing.id
+        assert session.query(MediaContentFormatThumbnailModel)\
+            .filter_by(format_id=fmt.id).count() == 1
+
+
+def test_external_formats_are_not_thumbnailed(db):
+    from tendril.utils.db import get_session
+    from tendril.db.models.content import MediaContentModel
+    from tendril.db.models.content_formats import ExternalPublishedMediaContentFormatModel
+    from tendril.interests.mixins.content import MediaContentInterest
+
+    with get_session() as session:
+        content = MediaContentModel(id=1)
+        fmt = ExternalPublishedMediaContentFormatModel(content=content,
+                                                       uri='https://example.com/video.mp4')
+        session.add_all([content, fmt])
+        session.flush()
+        # Nothing about the interest is needed before the format is checked.
+        rv = MediaContentInterest._generate_format_thumbnails(None, fmt.id, [128], session=session)
+        assert rv.id == fmt.id
+        assert rv.thumbnails == []
+
+
+def test_formats_missing_thumbnails(db, make_media):
+    from tendril.utils.db import get_session
+    from tendril.db.controllers.content import get_formats_missing_thumbnails
+    from tendril.db.controllers.content import create_content_format_thumbnail
+
+    with get_session() as session:
+        formats = [make_media(session, id).formats[0] for id in range(1, 5)]
+        ids = [x.id for x in formats]
+        stored_file_id = formats[0].thumbnails[0].stored_file_id
+        # make_media gives every format a 64x48 thumbnail.
+        create_content_format_thumbnail(id=ids[0], stored_file_id=stored_file_id,
+                                        width=128, height=128, session=session)
+        create_content_format_thumbnail(id=ids[1], stored_file_id=stored_file_id,
+                                        width=128, height=128, session=session)
+
+        def missing(**kwargs):
+            return [x.id for x in get_formats_missing_thumbnails(session=session, **kwargs)]
+
+        assert missing(sizes=[(64, 48)]) == []
+        assert missing(sizes=[(64, 48), (128, 128)]) == ids[2:]
+        assert missing(sizes=[(256, 256)]) == ids
+        # Keyset pagination resumes after the last format seen.
+        assert missing(sizes=[(256, 256)], limit=3) == ids[:3]
+        assert missing(sizes=[(256, 256)], after_id=ids[2], limit=3) == ids[3:]
+
+
+class _UploadBucket(object):
+    def __init__(self):
+        self.in_flight = 0
+        self.peak = 0
+
+    async def upload(self, file, actual_user=None, interest=None, client=None):
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        try:
+            await asyncio.sleep(0.01)
+            target, f = file
+            if target.endswith('bad'):
+                raise IOError(f"Could not upload {target}")
+            return {'filename': target, 'size': len(f.read())}
+        finally:
+            self.in_flight -= 1
+
+
+def test_thumbnail_uploads_are_bounded(tmp_path, monkeypatch):
+    from types import SimpleNamespace
+    from contextlib import asynccontextmanager
+    from tendril.interests.mixins import content as content_mixin
+    from tendril.interests.mixins.content import MediaContentInterest
+
+    @asynccontextmanager
+    async def async_client(**kwargs):
+        # The bucket above never makes a request.
+        yield None
+
+    monkeypatch.setattr(content_mixin, 'async_client', async_client)
+
+    files = []
+    for idx in range(8):
+        path = tmp_path / f'thumb_{idx}.png'
+        path.write_bytes(b'x' * idx)
+        files.append((f'thumbs/{idx}' + ('bad' if idx == 5 else ''), str(path)))
+    interest = SimpleNamespace(id=1, upload_bucket=_UploadBucket())
+    results = asyncio.run(MediaContentInterest._upload_files(interest, files, concurrency=3))
+
+    assert interest.upload_bucket.peak == 3
+    # Failures are returned in place, without losing the other uploads.
+    assert isinstance(results[5], IOError)
+    assert [x['size'] for idx, x in enumerate(results) if idx != 5] == [0, 1, 2, 3, 4, 6, 7]
+
+
+def test_on_demand_sizes_beyond_the_allowlist_need_write_access(monkeypatch):
+    from types import SimpleNamespace
+    from tendril.interests.mixins import content as content_mixin
+    from tendril.interests.mixins.content import MediaContentInterest
+
+    monkeypatch.setattr(content_mixin, 'MEDIA_THUMBNAIL_ON_DEMAND_SIZES', [128, (320, 240)])
+
+    def check_user_access(user, action, session=None):
+        return user == 'writer' and action == 'add_artefact'
+
+    interest = SimpleNamespace(check_user_access=check_user_access)
+
+    def allowed(box, user):
+        return MediaContentInterest._thumbnail_size_allowed(interest, box, auth_user=user)
+
+    assert allowed((128, 128), 'reader')
+    assert allowed((320, 240), 'reader')
+    assert not allowed((300, 300), 'reader')
+    assert allowed((300, 300), 'writer')
+
+
+def test_generated_thumbnails_are_published_after_commit(db, make_media, monkeypatch, tmp_path):
+    from types import SimpleNamespace
+    from tendril.utils.db import get_session
+    from tendril.common.states import LifecycleStatus
+    from tendril.filestore.db.model import StoredFileModel
+    from tendril.db.controllers.content import create_content_format_thumbnail
+    from tendril.interests.mixins import content as content_mixin
+    from tendril.interests.mixins.content import MediaContentInterest
+
+    async def from_uri(uri, filename):
+        return SimpleNamespace(file=None, sha256=None, cleanup=lambda: None)
+
+    def generate(file, sha256, folder, filename=None, sizes=None):
+        return [thumbnail_target(filename, x) for x in sizes]
+
+    scheduled = []
+    monkeypatch.setattr(content_mixin, 'TEMPDIR', str(tmp_path))
+    monkeypatch.setattr(content_mixin.StagedUpload, 'from_uri', from_uri)
+    monkeypatch.setattr(content_mixin, 'cached_thumbnails', generate)
+    monkeypatch.setattr(content_mixin, 'publisher',
+                        SimpleNamespace(schedule=lambda interest, ids: scheduled.append(ids)))
+
+    with get_session() as session:
+        fmt = make_media(session, 1).formats[0]
+        bucket = fmt.stored_file.bucket
+        files = [StoredFileModel(filename=f'thumb_{x}.png', bucket=bucket) for x in range(3)]
+        session.add_all(files)
+        session.flush()
+        # Another request registers the 256 thumbnail while this one renders.
+        uploaded = iter(files[:2])
+
+        async def upload_files(targets):
+            create_content_format_thumbnail(id=fmt.id, stored_file_id=files[2].id,
+                                            width=256, height=256, session=session)
+            return [{'storedfileid': next(uploaded).id} for _ in targets]
+
+        interest = SimpleNamespace(id=1, model_instance=SimpleNamespace(status=LifecycleStatus.ACTIVE),
+                                   _upload_files=upload_files, _queue_publish=list)
+        interest._publish_after_commit = lambda ids, session=None: \
+            MediaContentInterest._publish_after_commit(interest, ids, session=session)
+        MediaContentInterest._generate_format_thumbnails(interest, fmt.id, [128, 256], session=session)
+        assert scheduled == []
+        assert sorted((x.width, x.stored_file_id) for x in fmt.thumbnails) == \
+            [(64, fmt.thumbnails[0].stored_file_id), (128, files[0].id), (256, files[2].id)]
+    # Only the thumbnail this call registered is published.
+    assert scheduled == [[files[0].id]]
+
+
+def test_thumbnail_of_a_missing_format(db, make_media):
+    from tendril.utils.db import get_session
+    from tendril.db.controllers.content import create_content_format_thumbnail
+
+    with get_session() as session:
+        fmt = make_media(session, 1).formats[0]
+        with pytest.raises(ValueError):
+            create_content_format_thumbnail(id=fmt.id + 1, stored_file_id=fmt.stored_file_id,
+                                            width=128, height=128, session=session)